@@ -0,0 +1,164 @@
+import ipaddress
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+
+# 同時執行的驗證工作數 (api_flow.routes 另以瀏覽器池通道數為上限)
+JOB_WORKERS = int(os.environ.get("API_JOB_WORKERS", "4"))
+# 尚未完成的工作上限，超過時拒絕新工作 (避免無限制堆積)
+JOB_MAX_PENDING = int(os.environ.get("API_JOB_MAX_PENDING", "200"))
+# 完成的工作結果保留秒數，之後查詢會得到 404
+JOB_TTL_SECONDS = float(os.environ.get("API_JOB_TTL_SECONDS", "3600"))
+CALLBACK_TIMEOUT = 10
+CALLBACK_MAX_RETRIES = 3
+# 允許的 callback 主機 (逗號分隔)；設定後只接受清單中的主機，未設定時只接受解析到公開位址的主機
+CALLBACK_ALLOWED_HOSTS = {
+    host.strip().lower() for host in os.environ.get("API_CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()
+}
+
+
+class JobQueueFull(Exception):
+    """尚未完成的工作數已達 JOB_MAX_PENDING"""
+
+
+def is_valid_callback_url(url: str) -> bool:
+    """
+    callback_url 需為 http / https；有 CALLBACK_ALLOWED_HOSTS 時主機需在清單中，
+    否則主機解析出的每個位址都必須是公開位址 (拒絕 loopback、私有網段、
+    link-local 如 169.254.169.254 等)，避免伺服器被當成跳板存取內部服務
+    """
+    try:
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+    except ValueError:
+        return False
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return False
+    if CALLBACK_ALLOWED_HOSTS:
+        return parts.hostname.lower() in CALLBACK_ALLOWED_HOSTS
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(parts.hostname, port, proto=socket.IPPROTO_TCP)}
+    except (OSError, UnicodeError):
+        return False
+    return bool(addresses) and all(_is_public_address(address) for address in addresses)
+
+
+def _is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global
+
+
+class JobManager:
+    """
+    非同步驗證工作
+
+    submit() 立即回傳 job_id，工作由有上限的執行緒池執行 fn()，其回傳的 dict
+    (status_code / message) 即為工作結果；提供 callback_url 時，完成後以 POST
+    JSON 通知 (失敗重試 CALLBACK_MAX_RETRIES 次)。工作狀態只存在本程序記憶體，
+    完成超過 JOB_TTL_SECONDS 後清除。
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, max_pending: int = JOB_MAX_PENDING, ttl_seconds: float = JOB_TTL_SECONDS):
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api-job")
+        self._jobs = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, license_number: str, normalized_license_number: str, fn, callback_url: str = None) -> dict:
+        """
+        登記並排入一筆工作，回傳工作狀態 (含 job_id)；佇列已滿時拋出 JobQueueFull
+        license_number 為呼叫端送來的原始證號，normalized_license_number 為補零後實際查詢的證號
+        """
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "license_number": license_number,
+            "normalized_license_number": normalized_license_number,
+            "state": "queued",
+            "created_at": time.time(),
+            "finished_at": None,
+            "result": None,
+            "callback_url": callback_url,
+        }
+        with self._lock:
+            self._evict_expired()
+            if self._pending >= self.max_pending:
+                raise JobQueueFull(f"尚未完成的工作已達 {self.max_pending} 筆")
+            self._pending += 1
+            self._jobs[job["job_id"]] = job
+        self._executor.submit(self._run, job, fn)
+        print(f"[Job] 已排入工作 {job['job_id']}: {normalized_license_number}")
+        return self._snapshot(job)
+
+    def get(self, job_id: str):
+        """取得工作狀態，不存在 (或已過期清除) 時回傳 None"""
+        with self._lock:
+            self._evict_expired()
+            job = self._jobs.get(job_id)
+            return self._snapshot(job) if job else None
+
+    def _run(self, job: dict, fn):
+        with self._lock:
+            job["state"] = "running"
+        try:
+            result = fn()
+        except Exception as e:
+            print(f"[Job] 工作 {job['job_id']} 執行失敗: {e}")
+            result = {"status_code": 999, "message": "Error: Third-party service is under maintenance."}
+        with self._lock:
+            job["result"] = result
+            job["state"] = "done"
+            job["finished_at"] = time.time()
+            self._pending -= 1
+            snapshot = self._snapshot(job)
+        print(f"[Job] 工作 {job['job_id']} 完成: status_code={result.get('status_code')}")
+        if job["callback_url"]:
+            self._notify(job["callback_url"], snapshot)
+
+    def _notify(self, callback_url: str, payload: dict):
+        """
+        POST 工作結果到 callback_url，連線失敗或 5xx 時重試
+        送出前重新檢查網址 (DNS 結果可能已改變)，且不跟隨轉址
+        """
+        for attempt in range(1, CALLBACK_MAX_RETRIES + 1):
+            if not is_valid_callback_url(callback_url):
+                print(f"[Job] callback 網址已不是允許的位址，不送出: {callback_url}")
+                return
+            try:
+                response = requests.post(callback_url, json=payload, timeout=CALLBACK_TIMEOUT, allow_redirects=False)
+                if response.status_code < 500:
+                    return
+                print(f"[Job] callback 回應 HTTP {response.status_code} ({attempt}/{CALLBACK_MAX_RETRIES})")
+            except requests.RequestException as e:
+                print(f"[Job] callback 失敗 ({attempt}/{CALLBACK_MAX_RETRIES}): {e}")
+            if attempt < CALLBACK_MAX_RETRIES:
+                time.sleep(2 ** attempt)
+
+    def _evict_expired(self):
+        """(持有 _lock 時呼叫) 清除完成超過 ttl_seconds 的工作"""
+        cutoff = time.time() - self.ttl_seconds
+        expired = [job_id for job_id, job in self._jobs.items() if job["finished_at"] and job["finished_at"] < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    @staticmethod
+    def _snapshot(job: dict) -> dict:
+        """對外回傳的工作狀態；完成後附上與同步 API 相同的 status_code / message"""
+        snapshot = {
+            "job_id": job["job_id"],
+            "license_number": job["license_number"],
+            "normalized_license_number": job["normalized_license_number"],
+            "state": job["state"],
+        }
+        if job["result"] is not None:
+            snapshot.update(job["result"])
+        return snapshot
@@ -1,44 +1,163 @@
-from flask import Blueprint, request, jsonify
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from lia_bot import LIAQueryBot
+from flask import Blueprint, Response, request, jsonify, stream_with_context, url_for
+
+from lia_bot import get_browser_pool, query_license
+from .jobs import JOB_WORKERS, JobManager, JobQueueFull, is_valid_callback_url
 
 api_bp = Blueprint('api_flow', __name__)
 
+INVALID_FORMAT = {"status_code": 2, "message": "Failed: Invalid ID alphanumeric format."}
+SERVICE_ERROR = {"status_code": 999, "message": "Error: Third-party service is under maintenance."}
+
+# 非同步驗證工作 (POST /api/verify-agent-license/jobs)：同時執行的工作數不超過瀏覽器池通道數，
+# 多出的工作在 JobManager 內排隊，不會在瀏覽器池等到 BrowserPoolBusy
+job_manager = JobManager(workers=min(JOB_WORKERS, get_browser_pool().size))
+
+# 批次驗證 (POST /api/verify-agent-license/batch)：單次請求的證號上限與同時查詢數 (同樣不超過瀏覽器池通道數)
+BATCH_MAX_SIZE = int(os.environ.get("API_BATCH_MAX_SIZE", "500"))
+BATCH_CONCURRENCY = int(os.environ.get("API_BATCH_CONCURRENCY", "4"))
+
+
+def _normalize_license_number(license_number):
+    """8-10 位數字的證號補零成 10 位，格式無效回傳 None"""
+    if not isinstance(license_number, str) or not license_number.isdigit():
+        return None
+    if len(license_number) < 8 or len(license_number) > 10:
+        return None
+    return license_number.zfill(10)
+
+
+def _parse_license_number(data):
+    """
+    驗證請求中的證號，回傳 (補零後的證號, 錯誤回應)
+    錯誤回應為 (body, http_status)，證號有效時為 None
+    """
+    if not isinstance(data, dict):
+        return None, (INVALID_FORMAT, 400)
+
+    reg_no = _normalize_license_number(data.get('license_number'))
+    if reg_no is None:
+        return None, (INVALID_FORMAT, 200)
+
+    return reg_no, None
+
+
+def _verify(reg_no: str) -> dict:
+    """查詢證號並轉成 API 回應格式 (status_code / message)"""
+    try:
+        result = query_license(reg_no, skip_screenshot=True)
+    except Exception:
+        return SERVICE_ERROR
+
+    status = result.get('status')
+    if status == 'found_valid':
+        return {"status_code": 0, "message": "Verification passed: New agent identified."}
+    elif status == 'found_invalid':
+        return {"status_code": 1, "message": "Failed: Not a new agent (seniority > 1 year)."}
+    elif status == 'not_registered':
+        return {"status_code": 1, "message": "Failed: Not a new agent (license not registered)."}
+    elif status == 'not_found':
+        return {"status_code": 3, "message": "Failed: License number not found in database."}
+    else:
+        return SERVICE_ERROR
+
+
+def _batch_line(license_number, reg_no, result: dict) -> str:
+    """批次結果的一行 NDJSON (原始證號、補零後的證號與 API 回應)"""
+    line = {"license_number": license_number, "normalized_license_number": reg_no, **result}
+    return json.dumps(line, ensure_ascii=False) + "\n"
+
 
 @api_bp.route('/api/verify-agent-license', methods=['POST'])
 def verify_agent_license():
-    data = request.get_json(silent=True)
-    if data is None:
-        return jsonify({"status_code": 2, "message": "Failed: Invalid ID alphanumeric format."}), 400
+    reg_no, error = _parse_license_number(request.get_json(silent=True))
+    if error:
+        body, http_status = error
+        return jsonify(body), http_status
+
+    return jsonify(_verify(reg_no))
 
-    license_number = data.get('license_number')
-    if not license_number:
-        return jsonify({"status_code": 2, "message": "Failed: Invalid ID alphanumeric format."})
 
-    if not license_number.isdigit() or len(license_number) < 8 or len(license_number) > 10:
-        return jsonify({"status_code": 2, "message": "Failed: Invalid ID alphanumeric format."})
+@api_bp.route('/api/verify-agent-license/jobs', methods=['POST'])
+def submit_verify_job():
+    """
+    非同步驗證：立即回傳 job_id (HTTP 202)，結果以 GET .../jobs/<job_id> 查詢
+    可選的 callback_url 會在完成時收到與查詢結果相同的 JSON
+    """
+    data = request.get_json(silent=True)
+    reg_no, error = _parse_license_number(data)
+    if error:
+        body, http_status = error
+        return jsonify(body), http_status
 
-    reg_no = license_number.zfill(10)
+    callback_url = data.get('callback_url')
+    if callback_url is not None and not (isinstance(callback_url, str) and is_valid_callback_url(callback_url)):
+        return jsonify({"status_code": 2, "message": "Failed: Invalid callback_url."}), 400
 
-    bot = None
     try:
-        bot = LIAQueryBot(headless=True)
-        bot.start()
-        result = bot.perform_query(reg_no, skip_screenshot=True)
-
-        status = result.get('status')
-        if status == 'found_valid':
-            return jsonify({"status_code": 0, "message": "Verification passed: New agent identified."})
-        elif status == 'found_invalid':
-            return jsonify({"status_code": 1, "message": "Failed: Not a new agent (seniority > 1 year)."})
-        elif status == 'not_registered':
-            return jsonify({"status_code": 1, "message": "Failed: Not a new agent (license not registered)."})
-        elif status == 'not_found':
-            return jsonify({"status_code": 3, "message": "Failed: License number not found in database."})
+        job = job_manager.submit(data['license_number'], reg_no, lambda: _verify(reg_no), callback_url)
+    except JobQueueFull:
+        return jsonify(SERVICE_ERROR), 503
+
+    job["status_url"] = url_for('api_flow.get_verify_job', job_id=job["job_id"], _external=True)
+    return jsonify(job), 202
+
+
+@api_bp.route('/api/verify-agent-license/jobs/<job_id>', methods=['GET'])
+def get_verify_job(job_id):
+    """查詢非同步驗證工作；state 為 done 時附上 status_code / message"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"message": "Job not found."}), 404
+    return jsonify(job)
+
+
+@api_bp.route('/api/verify-agent-license/batch', methods=['POST'])
+def verify_agent_license_batch():
+    """
+    批次驗證：{"license_numbers": [...]}，以 NDJSON 逐行回傳，每完成一筆就送出一行
+    {"license_number", "normalized_license_number", "status_code", "message"}
+    (與非同步工作相同：license_number 為呼叫端送來的原始證號，另附補零後的證號)。
+    格式無效的證號立即回傳 status_code 2 (normalized_license_number 為 null)；
+    補零後重複的證號只查詢一次，但每個原始輸入各回傳一行 (例如 "13403577" 與
+    "0013403577")。完成順序不保證與輸入順序相同。
+    """
+    data = request.get_json(silent=True)
+    license_numbers = data.get('license_numbers') if isinstance(data, dict) else None
+    if not isinstance(license_numbers, list) or not license_numbers:
+        return jsonify(INVALID_FORMAT), 400
+    if len(license_numbers) > BATCH_MAX_SIZE:
+        return jsonify({"status_code": 2, "message": f"Failed: At most {BATCH_MAX_SIZE} license numbers per batch."}), 400
+
+    invalid = []
+    reg_nos = {}  # 補零後的證號 -> 對應的原始輸入 (保留輸入順序並去除重複)
+    for license_number in license_numbers:
+        reg_no = _normalize_license_number(license_number)
+        if reg_no is None:
+            invalid.append(license_number)
         else:
-            return jsonify({"status_code": 999, "message": "Error: Third-party service is under maintenance."})
-    except Exception:
-        return jsonify({"status_code": 999, "message": "Error: Third-party service is under maintenance."})
-    finally:
-        if bot:
-            bot.close()
+            reg_nos.setdefault(reg_no, {})[license_number] = None
+    print(f"[Batch] 收到 {len(license_numbers)} 筆證號 (有效且不重複 {len(reg_nos)} 筆，格式無效 {len(invalid)} 筆)")
+
+    def generate():
+        for license_number in invalid:
+            yield _batch_line(license_number, None, INVALID_FORMAT)
+        if not reg_nos:
+            return
+        workers = min(BATCH_CONCURRENCY, get_browser_pool().size, len(reg_nos))
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api-batch")
+        try:
+            futures = {executor.submit(_verify, reg_no): reg_no for reg_no in reg_nos}
+            for future in as_completed(futures):
+                result = future.result()
+                reg_no = futures[future]
+                for license_number in reg_nos[reg_no]:
+                    yield _batch_line(license_number, reg_no, result)
+        finally:
+            # 用戶端中途斷線時取消尚未開始的查詢
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
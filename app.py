@@ -7,9 +7,15 @@ load_dotenv()
 def create_app():
     app = Flask(__name__)
 
+    # 預先載入 OCR 模型並暖機 (gunicorn --preload 時於 master 載入，worker 以 copy-on-write 共用)
+    import ocr_service
+    ocr_service.warm_up()
+
     # REST API — 永遠載入（production 必要）
     from api_flow import api_bp
+    from metrics_flow import metrics_bp
     app.register_blueprint(api_bp)
+    app.register_blueprint(metrics_bp)
 
     # 實驗用模組 — 僅在 staging 環境載入
     if os.environ.get('FLASK_ENV') == 'staging':
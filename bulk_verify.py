@@ -0,0 +1,176 @@
+"""
+批次驗證大量登錄證字號 (稽核用)
+
+逐行讀取 CSV 或 JSONL (不一次載入整個檔案)，以固定數量的執行緒查詢，
+每完成一筆就以 JSONL 附加寫入輸出檔。輸出檔同時是進度紀錄：中斷後以
+相同指令重新執行，已寫入結果的證號會略過 (--retry-errors 會重查狀態為
+error / unknown 的證號)。
+
+Usage:
+    python bulk_verify.py agents.csv -o results.jsonl
+    python bulk_verify.py agents.jsonl -o results.jsonl --workers 4 --screenshots shots/
+    python bulk_verify.py agents.csv -o results.jsonl --column 登錄證字號
+"""
+import argparse
+import csv
+import json
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from lia_bot import query_license
+
+# 輸入檔中證號欄位的預設名稱 (依序嘗試)
+DEFAULT_COLUMNS = ("license_number", "reg_no", "登錄證字號")
+RETRYABLE_STATUSES = ("error", "unknown", "exception")
+
+
+def read_license_numbers(path: str, column: str = None):
+    """逐筆產生輸入檔中的證號 (.jsonl 以外一律視為 CSV)"""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                row = json.loads(line)
+                value = row.get(column) if column else next((row[key] for key in DEFAULT_COLUMNS if key in row), None)
+                yield "" if value is None else str(value).strip()
+        else:
+            reader = csv.DictReader(f)
+            key = column or next((name for name in DEFAULT_COLUMNS if name in (reader.fieldnames or [])), None)
+            if key is None:
+                # 沒有可辨識的欄位名稱時使用第一欄
+                key = reader.fieldnames[0]
+            for row in reader:
+                yield (row.get(key) or "").strip()
+
+
+def load_checkpoint(output: str, retry_errors: bool) -> set:
+    """讀取既有輸出檔，回傳已完成 (不需重查) 的證號"""
+    done = set()
+    path = Path(output)
+    if not path.exists():
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue  # 中斷時寫到一半的行
+            if retry_errors and row.get("status") in RETRYABLE_STATUSES:
+                continue
+            done.add(row.get("reg_no") or row.get("license_number"))
+    return done
+
+
+def _ends_with_newline(path: str) -> bool:
+    with open(path, "rb") as f:
+        f.seek(-1, 2)
+        return f.read(1) == b"\n"
+
+
+def normalize(license_number: str):
+    """8-10 位數字補零成 10 位，格式無效回傳 None"""
+    if not license_number.isdigit() or len(license_number) < 8 or len(license_number) > 10:
+        return None
+    return license_number.zfill(10)
+
+
+def verify_one(license_number: str, reg_no: str, screenshot_dir: Path = None) -> dict:
+    started = time.perf_counter()
+    try:
+        result = query_license(reg_no, skip_screenshot=screenshot_dir is None)
+    except Exception as e:
+        result = {"success": False, "status": "exception", "msg": str(e)}
+    row = {
+        "license_number": license_number,
+        "reg_no": reg_no,
+        "status": result.get("status"),
+        "msg": result.get("msg"),
+        "date": result.get("date"),
+        "record": result.get("record"),
+        "cached": result.get("cached", False),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000),
+    }
+    if screenshot_dir is not None and result.get("screenshot_bytes"):
+        path = screenshot_dir / result["suggested_filename"]
+        path.write_bytes(result["screenshot_bytes"])
+        row["screenshot"] = str(path)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批次驗證登錄證字號 (CSV / JSONL → JSONL)")
+    parser.add_argument("input", help="輸入檔 (.csv 或 .jsonl)")
+    parser.add_argument("-o", "--output", required=True, help="結果輸出檔 (JSONL，同時作為續跑的進度紀錄)")
+    parser.add_argument("--column", help=f"證號欄位名稱 (預設依序嘗試 {', '.join(DEFAULT_COLUMNS)})")
+    parser.add_argument("--workers", type=int, default=2, help="同時查詢數 (實際並行仍受瀏覽器池限制)")
+    parser.add_argument("--screenshots", help="截圖輸出資料夾 (未指定時不截圖，查詢較快)")
+    parser.add_argument("--retry-errors", action="store_true", help="重查上次結果為 error / unknown 的證號")
+    args = parser.parse_args()
+
+    screenshot_dir = None
+    if args.screenshots:
+        screenshot_dir = Path(args.screenshots)
+        screenshot_dir.mkdir(parents=True, exist_ok=True)
+
+    done = load_checkpoint(args.output, args.retry_errors)
+    if done:
+        print(f"從 {args.output} 接續，略過已完成的 {len(done)} 筆")
+
+    counts = {"written": 0, "skipped": 0}
+    started = time.perf_counter()
+    max_in_flight = args.workers * 2  # 只預先讀取少量輸入，保持逐行讀取
+
+    with open(args.output, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=args.workers) as executor:
+        if out.tell() and not _ends_with_newline(args.output):
+            out.write("\n")  # 上次中斷時寫到一半的行，避免與新結果接在同一行
+
+        def write(row: dict):
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            out.flush()
+            counts["written"] += 1
+            print(f"[{counts['written']}] {row['license_number']}: {row['status']} {row.get('msg') or ''}")
+
+        def drain(futures: set, block_until: int) -> set:
+            while len(futures) > block_until:
+                finished, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    write(future.result())
+            return futures
+
+        futures = set()
+        try:
+            for license_number in read_license_numbers(args.input, args.column):
+                reg_no = normalize(license_number)
+                if reg_no is None:
+                    if license_number not in done:
+                        done.add(license_number)
+                        write({"license_number": license_number, "reg_no": None, "status": "invalid", "msg": "證號格式無效"})
+                    continue
+                if reg_no in done:
+                    counts["skipped"] += 1
+                    continue
+                done.add(reg_no)
+                futures.add(executor.submit(verify_one, license_number, reg_no, screenshot_dir))
+                futures = drain(futures, max_in_flight - 1)
+            drain(futures, 0)
+        except KeyboardInterrupt:
+            print("\n中斷：等待進行中的查詢寫入結果後結束，重新執行同一指令即可接續")
+            for future in futures:
+                future.cancel()
+            drain({future for future in futures if not future.cancelled()}, 0)
+            sys.exit(130)
+
+    elapsed = time.perf_counter() - started
+    print(f"完成：寫入 {counts['written']} 筆，略過 {counts['skipped']} 筆，耗時 {elapsed:.0f} 秒")
+
+
+if __name__ == "__main__":
+    main()
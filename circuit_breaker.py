@@ -0,0 +1,128 @@
+import threading
+import time
+from collections import Counter as TallyCounter, deque
+
+import metrics
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+# lia_upstream_circuit_state 的數值
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """上游服務斷路中，查詢未執行直接失敗"""
+
+
+class CircuitBreaker:
+    """
+    上游服務斷路器
+
+    記錄最近 window 次呼叫的成功 / 失敗 (含失敗種類)，至少 min_calls 次且失敗率
+    達 failure_rate 時斷路 (open)：open_seconds 內的呼叫由 before_call() 直接拋出
+    CircuitOpenError。冷卻時間過後進入半開 (half_open)：有 probe 時在背景執行
+    probe() 探測上游 (呼叫端仍直接失敗)，沒有 probe 時放行一個呼叫當作探測；
+    探測成功恢復 closed，失敗則重新斷路。
+    """
+
+    def __init__(self, name: str, window: int = 20, min_calls: int = 5, failure_rate: float = 0.5,
+                 open_seconds: float = 30, probe=None):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.probe = probe
+        self._outcomes = deque(maxlen=window)  # None 表示成功，否則為失敗種類
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self._set_state(CLOSED)
+
+    def before_call(self):
+        """呼叫上游前檢查；斷路中拋出 CircuitOpenError"""
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self._set_state(HALF_OPEN)
+            if self._state == HALF_OPEN and not self._probing:
+                self._probing = True
+                if self.probe is None:
+                    return  # 放行這個呼叫當作探測
+                threading.Thread(target=self._run_probe, name=f"{self.name}-probe", daemon=True).start()
+            metrics.CIRCUIT_REJECTED.inc(circuit=self.name)
+            raise CircuitOpenError(f"{self.name} 暫時無法使用 (斷路中，{self._retry_in():.0f} 秒後重新探測)")
+
+    def record_success(self):
+        with self._lock:
+            self._outcomes.append(None)
+            if self._state != CLOSED:
+                print(f"[Circuit] {self.name} 探測成功，恢復正常")
+                self._outcomes.clear()
+                self._probing = False
+                self._set_state(CLOSED)
+
+    def record_failure(self, kind: str):
+        metrics.UPSTREAM_FAILURES.inc(circuit=self.name, kind=kind)
+        with self._lock:
+            self._outcomes.append(kind)
+            if self._state != CLOSED:
+                print(f"[Circuit] {self.name} 探測失敗 ({kind})，繼續斷路 {self.open_seconds:g} 秒")
+                self._trip()
+                return
+            failures = [outcome for outcome in self._outcomes if outcome is not None]
+            if len(self._outcomes) >= self.min_calls and len(failures) / len(self._outcomes) >= self.failure_rate:
+                kinds = ", ".join(f"{k}×{n}" for k, n in TallyCounter(failures).most_common())
+                print(f"[Circuit] {self.name} 最近 {len(self._outcomes)} 次呼叫失敗 {len(failures)} 次 ({kinds})，斷路 {self.open_seconds:g} 秒")
+                self._trip()
+
+    def record_ignored(self):
+        """呼叫結果與上游無關 (例如本機瀏覽器池滿載)；若它是半開時放行的探測，讓下一個呼叫重新探測"""
+        with self._lock:
+            if self._state == HALF_OPEN and self.probe is None:
+                self._probing = False
+
+    def is_closed(self) -> bool:
+        """上游目前是否正常 (供背景工作判斷是否該呼叫上游，不觸發探測)"""
+        with self._lock:
+            return self._state == CLOSED
+
+    def snapshot(self) -> dict:
+        """目前狀態 (供監控端點顯示)"""
+        with self._lock:
+            failures = [outcome for outcome in self._outcomes if outcome is not None]
+            return {
+                "name": self.name,
+                "state": self._state,
+                "recent_calls": len(self._outcomes),
+                "recent_failures": len(failures),
+                "failure_kinds": dict(TallyCounter(failures)),
+                "retry_in_seconds": round(self._retry_in(), 1) if self._state == OPEN else None,
+            }
+
+    def _run_probe(self):
+        try:
+            ok = self.probe()
+        except Exception as e:
+            print(f"[Circuit] {self.name} 探測發生錯誤: {e}")
+            ok = False
+        if ok:
+            self.record_success()
+        else:
+            self.record_failure("probe")
+
+    def _trip(self):
+        """(持有 _lock 時呼叫)"""
+        self._opened_at = time.monotonic()
+        self._probing = False
+        self._set_state(OPEN)
+
+    def _retry_in(self) -> float:
+        return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    def _set_state(self, state: str):
+        self._state = state
+        metrics.CIRCUIT_STATE.set(STATE_VALUES[state], circuit=self.name)
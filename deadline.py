@@ -0,0 +1,46 @@
+import time
+
+
+class DeadlineExceeded(Exception):
+    """查詢的整體時間預算已用完"""
+
+
+class Deadline:
+    """
+    單次查詢的整體時間預算
+
+    各步驟的逾時由 timeout() / timeout_ms() 依剩餘時間決定 (不超過原本的上限)，
+    重試間隔由 sleep() 執行；剩餘時間不足時拋出 DeadlineExceeded，讓查詢在預算
+    用完之前結束。seconds 為 None 表示不限時間 (各步驟維持原本的上限)。
+    """
+
+    def __init__(self, seconds: float = None):
+        self.seconds = seconds
+        self.expires_at = None if seconds is None else time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        if self.expires_at is None:
+            return float("inf")
+        return self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self, needed: float = 0):
+        """剩餘時間不足 needed 秒時拋出 DeadlineExceeded"""
+        if self.remaining() <= needed:
+            raise DeadlineExceeded(f"查詢超過 {self.seconds:g} 秒時間預算")
+
+    def timeout(self, cap: float) -> float:
+        """本步驟可用的逾時秒數 (min(cap, 剩餘時間))"""
+        self.check()
+        return min(cap, self.remaining())
+
+    def timeout_ms(self, cap_ms: float) -> float:
+        """同 timeout()，單位為毫秒 (Playwright 的 timeout 參數)"""
+        return self.timeout(cap_ms / 1000) * 1000
+
+    def sleep(self, seconds: float):
+        """等待重試；等完後已沒有時間可用時直接拋出 DeadlineExceeded"""
+        self.check(seconds)
+        time.sleep(seconds)
@@ -0,0 +1,394 @@
+import asyncio
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+from playwright.async_api import async_playwright, Error as PlaywrightError, TimeoutError as PlaywrightTimeoutError
+
+import metrics
+import ocr_service
+from deadline import Deadline, DeadlineExceeded
+from lia_bot import BrowserPool, BrowserPoolBusy, LIAQueryBot, PendingScreenshot, _default_concurrency, _mark_captcha_exhausted
+from lia_parser import parse_page
+from screenshot_store import encode_screenshot
+
+
+class AsyncLIAQueryBot:
+    """
+    壽險公會業務員登錄查詢 (playwright.async_api 版本)
+
+    在一個 event loop 上以單一 Chromium 同時進行多筆查詢：每筆查詢使用獨立的
+    BrowserContext (最多 concurrency 個，查詢結束後放回重複使用)，等待頁面時不
+    佔用執行緒；ddddocr 識別與截圖壓縮這類 CPU 工作交給 executor 執行。頁面
+    判斷、Email 範本與截圖檔名沿用 LIAQueryBot 的共用邏輯，verify() 回傳與
+    LIAQueryBot.perform_query 相同格式的 final_result。
+
+        async with AsyncLIAQueryBot() as bot:
+            results = await asyncio.gather(*(bot.verify(reg_no) for reg_no in reg_nos))
+
+    同步程式 (Flask 路由、Trello 佇列) 透過 AsyncQueryBridge 使用。
+    """
+
+    ENGINE = "async"
+    URL = LIAQueryBot.URL
+    DNS_MAX_RETRIES = LIAQueryBot.DNS_MAX_RETRIES
+    WAIT_TIMEOUT_MS = LIAQueryBot.WAIT_TIMEOUT_MS
+    WAIT_SLICE_MS = LIAQueryBot.WAIT_SLICE_MS
+    CAPTCHA_REFRESH_TIMEOUT_MS = LIAQueryBot.CAPTCHA_REFRESH_TIMEOUT_MS
+    # 同時進行的查詢數 (BrowserContext 數量)；0 時與瀏覽器池相同，依可用記憶體估算
+    CONCURRENCY = int(os.environ.get("LIA_ASYNC_CONCURRENCY", "0"))
+
+    def __init__(self, headless: bool = True, concurrency: int = None, base_url: str = None):
+        self.headless = headless
+        self.concurrency = concurrency or self.CONCURRENCY or _default_concurrency()
+        if base_url:
+            self.URL = base_url.rstrip("/") + LIAQueryBot.QUERY_PATH
+        self._playwright = None
+        self._browser = None
+        self._start_lock = None
+        self._slots = None
+        self._idle_pages = []  # (page, 已使用次數)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def start(self):
+        """啟動 Chromium (已啟動時不做任何事；同時呼叫只會啟動一次)"""
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._browser is not None and self._browser.is_connected():
+                return
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch(
+                headless=self.headless, args=BrowserPool.LAUNCH_ARGS
+            )
+            if self._slots is None:
+                # Chromium 重新啟動時沿用同一個 Semaphore，進行中的查詢結束時才會正確歸還名額
+                self._slots = asyncio.Semaphore(self.concurrency)
+            self._idle_pages = []
+            print(f"[Async] Chromium 已啟動，最多同時 {self.concurrency} 筆查詢")
+
+    async def close(self):
+        if self._browser is not None:
+            await self._browser.close()
+            self._browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+        self._idle_pages = []
+
+    async def verify(self, reg_no: str, max_retries=5, skip_screenshot=False, deadline: Deadline = None) -> dict:
+        """
+        查詢一個證號 (reg_no 需已補零為 10 碼)，可在同一個 event loop 上同時呼叫
+        deadline 的用法同 LIAQueryBot.perform_query；等待空位超過
+        BrowserPool.MAX_WAIT_SECONDS 時拋出 BrowserPoolBusy
+        """
+        deadline = deadline or Deadline(LIAQueryBot.QUERY_DEADLINE_SECONDS)
+        if deadline.expired():
+            # 與同步引擎相同，預算用完時回傳 error 結果而不是拋出例外
+            return LIAQueryBot._deadline_result(deadline)
+        await self.start()
+        max_wait = min(BrowserPool.MAX_WAIT_SECONDS, deadline.remaining())
+        try:
+            await asyncio.wait_for(self._slots.acquire(), max_wait)
+        except asyncio.TimeoutError:
+            metrics.BROWSER_POOL_REJECTED.inc()
+            raise BrowserPoolBusy(f"等待瀏覽器超過 {max_wait:g} 秒")
+
+        started = time.perf_counter()
+        status = "exception"
+        page = None
+        try:
+            page, uses = await self._acquire_page()
+            try:
+                result = await self._run_query(page, reg_no, max_retries, skip_screenshot, deadline)
+            except DeadlineExceeded:
+                result = LIAQueryBot._deadline_result(deadline)
+            except PlaywrightTimeoutError:
+                # 逾時是依剩餘預算縮短的結果時，同樣視為預算用完
+                if not deadline.expired():
+                    raise
+                result = LIAQueryBot._deadline_result(deadline)
+            status = result["status"]
+            if not result.get("deadline_exceeded") and uses + 1 < BrowserPool.PAGE_MAX_USES:
+                self._idle_pages.append((page, uses + 1))
+                page = None
+            return result
+        finally:
+            if page is not None:
+                # 狀態不明或已達使用次數的 page 連同 context 關閉，下次重新建立
+                await self._discard_page(page)
+            self._slots.release()
+            metrics.QUERY_SECONDS.observe(time.perf_counter() - started, engine=self.ENGINE, status=status)
+            metrics.QUERY_OUTCOMES.inc(engine=self.ENGINE, status=status)
+
+    async def _acquire_page(self):
+        """取得閒置的 page，沒有時建立新的 BrowserContext，回傳 (page, 已使用次數)"""
+        while self._idle_pages:
+            page, uses = self._idle_pages.pop()
+            if not page.is_closed():
+                return page, uses
+        context = await self._browser.new_context()
+        return await context.new_page(), 0
+
+    @staticmethod
+    async def _discard_page(page):
+        try:
+            await page.context.close()
+        except PlaywrightError:
+            pass
+
+    def _phase(self, phase: str):
+        """查詢階段計時 (lia_query_phase_seconds)"""
+        return metrics.QUERY_PHASE_SECONDS.time(engine=self.ENGINE, phase=phase)
+
+    async def _install_request_filter(self, page, screenshot_fidelity: bool):
+        """設定子資源攔截規則 (規則與 LIAQueryBot 相同；page 會被重複使用，先移除上一次的規則)"""
+        await page.unroute("**/*")
+        if not LIAQueryBot.BLOCK_RESOURCES:
+            return
+        origin = urlsplit(self.URL).netloc
+
+        async def handle_route(route):
+            request = route.request
+            if LIAQueryBot._should_block(request.resource_type, request.url, origin, screenshot_fidelity):
+                metrics.BLOCKED_REQUESTS.inc(resource_type=request.resource_type)
+                await route.abort()
+            else:
+                await route.continue_()
+
+        await page.route("**/*", handle_route)
+
+    async def _navigate(self, page, deadline: Deadline):
+        """完整載入查詢頁面 (DNS 解析失敗時重試)"""
+        with self._phase("navigation"):
+            for nav_attempt in range(self.DNS_MAX_RETRIES):
+                try:
+                    await page.goto(self.URL, wait_until='domcontentloaded', timeout=deadline.timeout_ms(60000))
+                    break
+                except Exception as e:
+                    if "ERR_NAME_NOT_RESOLVED" in str(e):
+                        print(f"    DNS 解析失敗，3秒後重試... ({nav_attempt + 1}/{self.DNS_MAX_RETRIES})")
+                        if nav_attempt < self.DNS_MAX_RETRIES - 1:
+                            metrics.DNS_RETRIES.inc(engine=self.ENGINE)
+                            deadline.check(3)
+                            await asyncio.sleep(3)
+                            continue
+                        print(f"    DNS 解析連續 {self.DNS_MAX_RETRIES} 次失敗，無法連接至壽險公會網站")
+                    raise
+
+    async def _get_captcha_text(self, page, deadline: Deadline) -> str:
+        """等待驗證碼圖片載入後截圖，在 executor 上以 ddddocr 識別"""
+        await page.wait_for_function(LIAQueryBot.CAPTCHA_READY_JS, timeout=deadline.timeout_ms(self.WAIT_TIMEOUT_MS))
+        img_bytes = await page.locator('#captcha').screenshot()
+        result = await asyncio.get_running_loop().run_in_executor(None, ocr_service.classify, img_bytes)
+        print(f"    識別驗證碼: {result}")
+        return result.lower().strip()
+
+    async def _refresh_captcha(self, page, deadline: Deadline):
+        """點擊刷新驗證碼，等到新圖片載入完成 (src 改變且圖片已解碼)"""
+        print("    刷新驗證碼...")
+        old_src = await page.locator('#captcha').get_attribute('src')
+        await page.locator('#btn3').click()
+        try:
+            await page.wait_for_function(
+                LIAQueryBot.CAPTCHA_REFRESHED_JS, arg=old_src,
+                timeout=deadline.timeout_ms(self.CAPTCHA_REFRESH_TIMEOUT_MS),
+            )
+        except PlaywrightTimeoutError:
+            print("    驗證碼圖片網址未改變，沿用目前圖片狀態")
+
+    async def _submit(self, page, deadline: Deadline):
+        """
+        點擊查詢並等待結果，回傳攔截到的對話框訊息 (沒有對話框時為 None)
+        對話框由 dialog 事件的 handler 接受並記錄；等待方式同 LIAQueryBot._wait_for_result，
+        以短時間片輪詢，讓 handler 能在等待期間執行
+        """
+        dialog_message = None
+
+        async def handle_dialog(dialog):
+            nonlocal dialog_message
+            dialog_message = dialog.message
+            print(f"    攔截到對話框: {dialog_message}")
+            await dialog.accept()
+
+        # page 會被重複使用，用 on + remove_listener 避免未觸發的 handler 殘留到下一次查詢
+        page.on("dialog", handle_dialog)
+        try:
+            await page.locator('#btn1').click()
+            wait_until = time.monotonic() + deadline.timeout(self.WAIT_TIMEOUT_MS / 1000)
+            while time.monotonic() < wait_until:
+                if dialog_message is not None:
+                    return dialog_message
+                try:
+                    await page.wait_for_function(LIAQueryBot.RESULT_READY_JS, timeout=self.WAIT_SLICE_MS)
+                    return dialog_message
+                except PlaywrightTimeoutError:
+                    continue
+                except PlaywrightError:
+                    # 換頁中 (execution context 被銷毀)，稍後再檢查
+                    await asyncio.sleep(self.WAIT_SLICE_MS / 1000)
+            deadline.check()
+            print(f"    等待查詢結果逾時 ({self.WAIT_TIMEOUT_MS}ms)")
+            return dialog_message
+        finally:
+            page.remove_listener("dialog", handle_dialog)
+
+    async def _run_query(self, page, reg_no: str, max_retries: int, skip_screenshot: bool, deadline: Deadline):
+        final_result = {
+            "success": False,
+            "status": "error",
+            "msg": "未完成查詢",
+            "screenshot_path": None,
+            "email_info": None
+        }
+
+        print(f"[Async] 前往查詢頁面: {reg_no}")
+        await self._install_request_filter(page, screenshot_fidelity=not skip_screenshot)
+        await self._navigate(page, deadline)
+
+        attempt_ms = []
+        for attempt in range(1, max_retries + 1):
+            print(f"第 {attempt} 次嘗試...")
+            attempt_started = time.perf_counter()
+            # 填寫、點擊、截圖等未指定逾時的操作也不超過剩餘預算
+            page.set_default_timeout(deadline.timeout_ms(self.WAIT_TIMEOUT_MS))
+
+            with self._phase("captcha"):
+                captcha_text = await self._get_captcha_text(page, deadline)
+            with self._phase("submit"):
+                await page.locator('#iusr').fill(reg_no)
+                await page.locator('input[name="captchaAnswer"]').fill(captcha_text)
+                dialog_message = await self._submit(page, deadline)
+            attempt_seconds = time.perf_counter() - attempt_started
+            metrics.CAPTCHA_ATTEMPT_SECONDS.observe(attempt_seconds, engine=self.ENGINE)
+            attempt_ms.append(round(attempt_seconds * 1000, 1))
+
+            if dialog_message and "驗證碼錯誤" in dialog_message:
+                print("    驗證碼錯誤，重試中...")
+                metrics.CAPTCHA_ATTEMPTS.inc(engine=self.ENGINE, outcome="rejected")
+                with self._phase("captcha_refresh"):
+                    await self._refresh_captcha(page, deadline)
+                continue
+
+            metrics.CAPTCHA_ATTEMPTS.inc(engine=self.ENGINE, outcome="accepted")
+            if dialog_message and "查無資料" in dialog_message:
+                final_result.update({"success": True, "status": "not_found", "msg": "查無此登錄字號資料"})
+                break
+
+            with self._phase("parse"):
+                final_result.update(LIAQueryBot._verdict_from_page(parse_page(await page.content())))
+            break
+        else:
+            _mark_captcha_exhausted(final_result, max_retries)
+
+        final_result["attempt_ms"] = attempt_ms
+
+        if final_result["success"] and not skip_screenshot:
+            page.set_default_timeout(deadline.timeout_ms(self.WAIT_TIMEOUT_MS))
+            with self._phase("screenshot"):
+                screenshot_bytes, mimetype, filename = await self._render_screenshot(
+                    page, reg_no, final_result["status"], final_result.get("date")
+                )
+            final_result["screenshot_bytes"] = screenshot_bytes
+            final_result["screenshot_mimetype"] = mimetype
+            final_result["suggested_filename"] = filename
+            print(f"截圖已擷取 (記憶體中), 建議檔名: {filename}")
+
+        final_result["email_info"] = LIAQueryBot._generate_email_template(final_result["status"])
+        return final_result
+
+    async def _render_screenshot(self, page, reg_no: str, status: str, date_str: str = None) -> tuple:
+        """截取結果區域 (範圍同 LIAQueryBot._screenshot_clip) 並在 executor 上壓縮"""
+        width = page.viewport_size['width']
+        table = page.locator('table.formStyle02').first
+        box = await table.bounding_box() if await table.count() else None
+        if box:
+            bottom = box["y"] + box["height"] + LIAQueryBot.SCREENSHOT_PADDING_PX
+            clip = {"x": 0, "y": 0, "width": max(width, box["x"] + box["width"]), "height": bottom}
+        else:
+            page_height = await page.evaluate("document.body.scrollHeight")
+            clip = {"x": 0, "y": 0, "width": width, "height": page_height * 0.6}
+        png_bytes = await page.screenshot(clip=clip)
+        screenshot_bytes, mimetype, extension = await asyncio.get_running_loop().run_in_executor(
+            None, encode_screenshot, png_bytes
+        )
+        return screenshot_bytes, mimetype, LIAQueryBot._generate_screenshot_filename(reg_no, status, date_str, extension)
+
+
+class AsyncQueryBridge:
+    """
+    讓同步程式 (Flask 路由、Trello 佇列、批次工作) 使用 AsyncLIAQueryBot
+
+    在專屬執行緒上執行 event loop，查詢以 run_coroutine_threadsafe 送入；多個
+    執行緒同時查詢時在同一個 event loop 上並行。執行緒與 Chromium 延遲到第一次
+    查詢才啟動 (gunicorn --preload fork 後需在子程序重建)。
+    start() / close() / perform_query() 與 LIAQueryBot 介面相同，供 query_license 使用
+    (LIA_QUERY_ENGINE=async)。
+    """
+
+    ENGINE = AsyncLIAQueryBot.ENGINE
+
+    def __init__(self, headless: bool = True):
+        self.headless = headless
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._bot = None
+        self._pid = None
+
+    def start(self):
+        """(介面相容) event loop 與 Chromium 在第一次查詢時啟動，之後常駐"""
+
+    def close(self):
+        """(介面相容) 常駐的 event loop 與 Chromium 由所有查詢共用，不在此關閉"""
+
+    def submit(self, reg_no: str, **kwargs):
+        """送出查詢，回傳 concurrent.futures.Future (參數同 AsyncLIAQueryBot.verify)"""
+        loop, bot = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(bot.verify(reg_no, **kwargs), loop)
+
+    def perform_query(self, reg_no: str, max_retries=5, skip_screenshot=False, deadline: Deadline = None,
+                      lazy_screenshot: bool = False):
+        """
+        同步查詢 (等待 event loop 上的 verify 完成)
+        本引擎查詢結束即釋放 page，lazy_screenshot 時改為先截好圖，以已完成的
+        PendingScreenshot 放在結果的 "screenshot"，呼叫端用法不變
+        """
+        result = self.submit(
+            reg_no, max_retries=max_retries, skip_screenshot=skip_screenshot, deadline=deadline
+        ).result()
+        if lazy_screenshot and result.get("screenshot_bytes"):
+            result["screenshot"] = PendingScreenshot.rendered(
+                result.pop("screenshot_bytes"), result.pop("screenshot_mimetype"), result.pop("suggested_filename")
+            )
+        return result
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._pid != os.getpid() or self._thread is None or not self._thread.is_alive():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="lia-async-loop", daemon=True)
+                self._thread.start()
+                self._bot = AsyncLIAQueryBot(headless=self.headless)
+                self._pid = os.getpid()
+            return self._loop, self._bot
+
+
+_bridges = {}
+_bridges_lock = threading.Lock()
+
+
+def get_async_bridge(headless: bool = True) -> AsyncQueryBridge:
+    """取得程序層級共用的 AsyncQueryBridge (依 headless 區分)"""
+    with _bridges_lock:
+        if headless not in _bridges:
+            _bridges[headless] = AsyncQueryBridge(headless=headless)
+        return _bridges[headless]
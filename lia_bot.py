@@ -1,20 +1,607 @@
-from playwright.sync_api import sync_playwright
-import ddddocr
+from playwright.sync_api import sync_playwright, Error as PlaywrightError, TimeoutError as PlaywrightTimeoutError
+import atexit
+import ctypes
+import ctypes.util
+import os
+import queue
 import time
 import re
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
 import threading
+import urllib.request
+import weakref
+from concurrent.futures import Future
 from datetime import datetime, timedelta
 from pathlib import Path # 引入 Path 模組
+from urllib.parse import urlsplit
+
+import requests
+
+import metrics
+import ocr_service
+from circuit_breaker import CircuitBreaker
+from deadline import Deadline, DeadlineExceeded
+from screenshot_store import encode_screenshot
+from lia_parser import parse_page, extract_result_record
+from result_cache import create_result_cache
+from single_flight import SingleFlight
+
+def _process_tree_rss_mb(pid: int = None) -> float:
+    """
+    加總指定程序與其所有子程序 (Playwright driver、Chromium) 的 RSS (MB)
+    僅支援 Linux /proc，其他平台回傳 0
+    """
+    pid = pid or os.getpid()
+    total_kb = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+                        break
+            task_dir = Path(f"/proc/{current}/task")
+            for task in task_dir.iterdir():
+                children = (task / "children").read_text().split()
+                pending.extend(int(child) for child in children)
+        except (OSError, ValueError):
+            continue
+    return total_kb / 1024
+
+
+def _mem_available_mb() -> float:
+    """讀取系統可用記憶體 (MB)，僅支援 Linux /proc，其他平台回傳 0"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+# cgroup 記憶體上限與目前用量 (v2、v1)
+CGROUP_MEMORY_FILES = (
+    ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current"),
+    ("/sys/fs/cgroup/memory/memory.limit_in_bytes", "/sys/fs/cgroup/memory/memory.usage_in_bytes"),
+)
+
+
+def _cgroup_available_mb():
+    """
+    讀取容器 cgroup 記憶體上限扣除目前用量後的可用記憶體 (MB)
+    沒有 cgroup 或未設上限 (v2 為 "max"、v1 為接近 2^63 的數值) 時回傳 None
+    """
+    for limit_path, usage_path in CGROUP_MEMORY_FILES:
+        try:
+            limit = Path(limit_path).read_text().strip()
+            if limit == "max" or int(limit) >= 1 << 60:
+                return None
+            usage = int(Path(usage_path).read_text().strip())
+            return max(0, int(limit) - usage) / (1024 * 1024)
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+def _default_concurrency() -> int:
+    """
+    決定同時查詢的 BrowserContext 數量
+    優先使用 BROWSER_CONCURRENCY；未設定時依可用記憶體估算 (每個 context 約
+    BROWSER_CONTEXT_MB，並保留 BROWSER_RESERVED_MB 給 Chromium 本體與 Flask)。
+    可用記憶體取系統 MemAvailable 與容器 cgroup 上限兩者較小者，兩者都讀不到時為 1
+    """
+    configured = os.environ.get("BROWSER_CONCURRENCY")
+    if configured:
+        return max(1, int(configured))
+    available = [mb for mb in (_mem_available_mb() or None, _cgroup_available_mb()) if mb is not None]
+    if not available:
+        return 1
+    per_context = int(os.environ.get("BROWSER_CONTEXT_MB", "150"))
+    reserved = int(os.environ.get("BROWSER_RESERVED_MB", "300"))
+    return max(1, min(4, int((min(available) - reserved) // per_context)))
+
+
+class BrowserPoolBusy(Exception):
+    """等待瀏覽器池空位超過 BrowserPool.MAX_WAIT_SECONDS"""
+
+
+class ScreenshotExpired(Exception):
+    """延後截圖的結果頁面已釋放 (超過保留時間沒有人取用，或已呼叫 release())"""
+
+
+class PendingScreenshot:
+    """
+    延後產生的結果截圖 (query_license(..., lazy_screenshot=True) 結果中的 "screenshot")
+
+    查詢結果先交給呼叫端，結果頁面暫留在瀏覽器池通道上最多 hold_seconds 秒；
+    期間任一執行緒呼叫 get() 時才在該通道上截圖並壓縮，之後再呼叫直接回傳
+    同一張。沒人取用或呼叫 release() 時釋放 page，讓通道接下一筆查詢。
+    """
+
+    def __init__(self, render, hold_seconds: float):
+        self._render = render
+        self.hold_seconds = hold_seconds
+        self._requested = threading.Event()
+        self._rendered = Future()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def rendered(cls, screenshot_bytes: bytes, mimetype: str, filename: str):
+        """已截好的截圖 (查詢結束即釋放 page 的引擎使用，呼叫端用法與延後截圖相同)"""
+        pending = cls(None, 0)
+        pending._requested.set()
+        pending._rendered.set_result((screenshot_bytes, mimetype, filename))
+        return pending
+
+    def get(self, timeout: float = None) -> tuple:
+        """回傳 (bytes, mimetype, filename)；page 已釋放時拋出 ScreenshotExpired"""
+        with self._lock:
+            if not self._rendered.done():
+                self._requested.set()
+        return self._rendered.result(timeout)
+
+    def release(self):
+        """確定不需要截圖時提早釋放 page"""
+        with self._lock:
+            if self._requested.is_set():
+                return
+            self._rendered.set_exception(ScreenshotExpired("結果頁面已釋放"))
+            self._requested.set()
+        metrics.DEFERRED_SCREENSHOTS.inc(result="released")
+
+    def _serve(self):
+        """(瀏覽器池通道上執行) 等待 get() 的要求並截圖，逾時則放棄"""
+        self._requested.wait(self.hold_seconds)
+        with self._lock:
+            if self._rendered.done():
+                return  # 已 release()
+            if not self._requested.is_set():
+                self._rendered.set_exception(
+                    ScreenshotExpired(f"結果頁面保留 {self.hold_seconds:g} 秒內沒有取用截圖，已釋放")
+                )
+                metrics.DEFERRED_SCREENSHOTS.inc(result="expired")
+                return
+        try:
+            self._rendered.set_result(self._render())
+            metrics.DEFERRED_SCREENSHOTS.inc(result="rendered")
+        except Exception as e:
+            self._rendered.set_exception(e)
+            raise
+
+    def __deepcopy__(self, memo):
+        # 合併查詢的等待者拿到結果副本時，共用同一張截圖
+        return self
+
+
+class _Lane:
+    """單一查詢通道：一條執行緒 + 自己的 Playwright driver + 一個隔離的 BrowserContext"""
+
+    def __init__(self):
+        self.playwright = None
+        self.browser = None
+        self.generation = None
+        self.context = None
+        self.page = None
+        self.page_uses = 0
+        # 上一筆工作留下的閒置工作 idle(page)，通道空閒時定期執行
+        self.idle = None
+
+
+class BrowserPool:
+    """
+    程序層級的常駐 Chromium 池
+
+    只啟動一個 Chromium (開啟 remote debugging port)，由 size 條通道執行緒
+    各自以 connect_over_cdp 連上並持有一個隔離的 BrowserContext，因此最多
+    同時執行 size 筆查詢。Playwright sync API 綁定在啟動它的執行緒上，呼叫端
+    透過 run() 把工作放進先進先出的等待佇列，由空閒的通道執行 fn(page)。
+    等待超過 MAX_WAIT_SECONDS 仍未開始的工作會被取消並拋出 BrowserPoolBusy。
+
+    page (連同其 BrowserContext) 使用 PAGE_MAX_USES 次後回收；Chromium 處理
+    BROWSER_MAX_USES 次查詢或整體 RSS 超過 MAX_RSS_MB 時，等進行中的查詢
+    結束後重新啟動。
+    """
+
+    PAGE_MAX_USES = int(os.environ.get("BROWSER_PAGE_MAX_USES", "20"))
+    BROWSER_MAX_USES = int(os.environ.get("BROWSER_MAX_USES", "200"))
+    MAX_RSS_MB = int(os.environ.get("BROWSER_MAX_RSS_MB", "700"))
+    MAX_WAIT_SECONDS = float(os.environ.get("BROWSER_MAX_WAIT_SECONDS", "30"))
+    CDP_PORT = int(os.environ.get("BROWSER_CDP_PORT", "0"))
+    IDLE_INTERVAL_SECONDS = float(os.environ.get("BROWSER_IDLE_INTERVAL_SECONDS", "15"))
+
+    LAUNCH_ARGS = [
+        '--disable-dev-shm-usage',
+        '--disable-gpu',
+        '--no-sandbox',
+        '--disable-extensions',
+        '--single-process',
+    ]
+
+    def __init__(self, headless: bool = True, size: int = None):
+        self.headless = headless
+        self.size = size or _default_concurrency()
+        self._start_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._jobs = None
+        self._threads = []
+        self._pid = None
+        # Chromium 程序狀態，由 _cond 保護
+        self._process = None
+        self._user_data_dir = None
+        self._atexit_registered = False
+        self._endpoint = None
+        self._generation = 0
+        self._active = 0
+        self._browser_uses = 0
+        self._restart_pending = False
+
+    def run(self, fn, after=None, idle=None, max_wait: float = None):
+        """
+        在空閒通道上執行 fn(page) 並回傳結果，fn 拋出的例外會原樣拋回呼叫端
+        after(page) 在結果交給呼叫端之後、通道接下一筆工作之前執行 (例如把 page
+        整理回查詢表單)，不影響呼叫端的回應時間；after 失敗時 page 會被丟棄
+        idle(page) 在通道閒置期間每 IDLE_INTERVAL_SECONDS 執行一次 (例如重新
+        預解驗證碼)，直到通道接下一筆工作為止
+        等待超過 max_wait (預設 MAX_WAIT_SECONDS) 秒仍輪不到時拋出 BrowserPoolBusy
+        """
+        max_wait = self.MAX_WAIT_SECONDS if max_wait is None else max_wait
+        future = Future()
+        started = threading.Event()
+        queued_at = time.perf_counter()
+        self._ensure_threads().put((fn, after, idle, future, started))
+        if not started.wait(max_wait) and future.cancel():
+            metrics.BROWSER_POOL_REJECTED.inc()
+            raise BrowserPoolBusy(f"等待瀏覽器超過 {max_wait:g} 秒")
+        metrics.BROWSER_POOL_WAIT_SECONDS.observe(time.perf_counter() - queued_at)
+        return future.result()
+
+    def _ensure_threads(self) -> queue.Queue:
+        """
+        延遲啟動通道執行緒；gunicorn --preload fork 後執行緒不會被繼承，需在子程序重建
+        同一程序內個別通道執行緒意外結束時只補上該通道，沿用原本的等待佇列
+        (已排入的工作不會遺失)，共用的 Chromium 也不受影響
+        """
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._jobs = queue.Queue()
+                self._pid = os.getpid()
+                with self._cond:
+                    # fork 前的 Chromium 屬於父程序，子程序自行啟動新的
+                    self._process = None
+                    self._user_data_dir = None
+                    self._endpoint = None
+                    self._active = 0
+                    self._restart_pending = False
+                self._threads = [None] * self.size
+                print(f"瀏覽器池啟動 {self.size} 條查詢通道")
+            for i, thread in enumerate(self._threads):
+                if thread is not None and thread.is_alive():
+                    continue
+                if thread is not None:
+                    print(f"查詢通道 {thread.name} 已結束，重新啟動該通道")
+                self._threads[i] = threading.Thread(target=self._worker, name=f"browser-lane-{i}", daemon=True)
+                self._threads[i].start()
+            return self._jobs
+
+    def _worker(self):
+        jobs = self._jobs
+        lane = _Lane()
+        while True:
+            try:
+                job = jobs.get(timeout=self.IDLE_INTERVAL_SECONDS if lane.idle else None)
+            except queue.Empty:
+                self._run_idle(lane)
+                continue
+            fn, after, idle, future, started = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            started.set()
+            lane.idle = None
+            in_job = False
+            try:
+                if lane.playwright is None:
+                    lane.playwright = sync_playwright().start()
+                generation = self._begin_job(lane)
+                in_job = True
+                page = self._acquire_page(lane, generation)
+                result = fn(page)
+            except BaseException as e:
+                # page 狀態不明，直接丟棄，下次重新建立
+                self._discard_page(lane)
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+                try:
+                    if after is not None:
+                        after(page)
+                    lane.idle = idle
+                except Exception as e:
+                    print(f"    整理 page 時發生錯誤，丟棄此 page: {e}")
+                    self._discard_page(lane)
+            finally:
+                if in_job:
+                    self._end_job(lane)
+
+    def _run_idle(self, lane: _Lane):
+        """
+        通道閒置時執行上一筆工作留下的 idle(page)
+        Chromium 等待重啟或已換新時不執行 (page 屬於舊的 Chromium)；執行期間
+        計入 _active，避免其他通道在此時重啟 Chromium
+        """
+        with self._cond:
+            usable = (
+                lane.page is not None
+                and not self._restart_pending
+                and lane.generation == self._generation
+                and self._process is not None
+                and self._process.poll() is None
+            )
+            if usable:
+                self._active += 1
+        if not usable:
+            lane.idle = None
+            return
+        try:
+            lane.idle(lane.page)
+        except Exception as e:
+            print(f"    通道閒置工作失敗，丟棄此 page: {e}")
+            lane.idle = None
+            self._discard_page(lane)
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    def _begin_job(self, lane: _Lane) -> int:
+        """登記一筆進行中的查詢；需要重啟 Chromium 時等其他通道結束後由本通道執行"""
+        with self._cond:
+            while True:
+                if self._process is not None and self._process.poll() is not None:
+                    print("偵測到 Chromium 已結束，準備重新啟動")
+                    self._restart_pending = True
+                if not self._restart_pending and self._process is not None:
+                    break
+                if self._active == 0:
+                    self._launch_browser(lane.playwright)
+                    break
+                self._cond.wait()
+            self._active += 1
+            return self._generation
+
+    def _end_job(self, lane: _Lane):
+        lane.page_uses += 1
+        if lane.page_uses >= self.PAGE_MAX_USES:
+            self._discard_page(lane)
+        with self._cond:
+            self._active -= 1
+            self._browser_uses += 1
+            if not self._restart_pending:
+                if self._browser_uses >= self.BROWSER_MAX_USES:
+                    print(f"瀏覽器已使用 {self._browser_uses} 次，準備重新啟動")
+                    self._restart_pending = True
+                else:
+                    rss_mb = _process_tree_rss_mb()
+                    if rss_mb > self.MAX_RSS_MB:
+                        print(f"記憶體用量 {rss_mb:.0f}MB 超過 {self.MAX_RSS_MB}MB，準備重新啟動瀏覽器")
+                        self._restart_pending = True
+            self._cond.notify_all()
+
+    def _launch_browser(self, playwright):
+        """(持有 _cond 時呼叫) 關閉舊的 Chromium 並以 remote debugging port 啟動新的"""
+        self._stop_browser()
+        _remove_stale_profiles()
+        port = self.CDP_PORT or _free_port()
+        self._user_data_dir = tempfile.mkdtemp(prefix=f"{PROFILE_PREFIX}{os.getpid()}-")
+        args = [
+            playwright.chromium.executable_path,
+            f'--remote-debugging-port={port}',
+            f'--user-data-dir={self._user_data_dir}',
+            '--no-first-run',
+            '--no-default-browser-check',
+            *self.LAUNCH_ARGS,
+        ]
+        if self.headless:
+            args.append('--headless')
+        print("啟動常駐瀏覽器...")
+        # 獨立的程序群組 (結束時連同 Chromium 子程序一起結束)，並在本程序結束時一併結束
+        self._process = subprocess.Popen(
+            args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            start_new_session=True, preexec_fn=_kill_with_parent(os.getpid()),
+        )
+        if not self._atexit_registered:
+            atexit.register(self._stop_at_exit)
+            self._atexit_registered = True
+        self._endpoint = f"http://127.0.0.1:{port}"
+        _wait_for_cdp(self._endpoint, self._process)
+        self._generation += 1
+        self._browser_uses = 0
+        self._restart_pending = False
+
+    def _stop_browser(self):
+        """結束 Chromium 程序群組並刪除 profile 目錄 (可重複呼叫)"""
+        process, user_data_dir = self._process, self._user_data_dir
+        self._process = None
+        self._user_data_dir = None
+        if process is not None:
+            _kill_process_group(process)
+        if user_data_dir:
+            shutil.rmtree(user_data_dir, ignore_errors=True)
+
+    def _stop_at_exit(self):
+        """atexit：只結束本程序啟動的 Chromium (fork 出的子程序結束時不影響父程序的)"""
+        if self._pid == os.getpid():
+            self._stop_browser()
+
+    def _acquire_page(self, lane: _Lane, generation: int):
+        """取得本通道就緒的 page，必要時重新連上 Chromium 或建立新的 BrowserContext"""
+        if lane.browser is None or lane.generation != generation or not lane.browser.is_connected():
+            self._disconnect(lane)
+            lane.browser = lane.playwright.chromium.connect_over_cdp(self._endpoint)
+            lane.generation = generation
+        if lane.page is None or lane.page.is_closed():
+            self._discard_page(lane)
+            lane.context = lane.browser.new_context()
+            lane.page = lane.context.new_page()
+            lane.page_uses = 0
+        return lane.page
+
+    def _discard_page(self, lane: _Lane):
+        try:
+            if lane.context:
+                lane.context.close()
+        except Exception as e:
+            print(f"    關閉 BrowserContext 時發生錯誤: {e}")
+        lane.context = None
+        lane.page = None
+
+    def _disconnect(self, lane: _Lane):
+        self._discard_page(lane)
+        try:
+            if lane.browser:
+                lane.browser.close()
+        except Exception as e:
+            print(f"    中斷 CDP 連線時發生錯誤: {e}")
+        lane.browser = None
+
+
+# prctl(PR_SET_PDEATHSIG)：父程序結束時由核心送出指定訊號 (僅 Linux)
+PR_SET_PDEATHSIG = 1
+try:
+    _prctl = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True).prctl
+except (OSError, AttributeError):
+    _prctl = None
+
+PROFILE_PREFIX = "lia-chromium-"
+
+
+def _kill_with_parent(parent_pid: int):
+    """
+    回傳給 Popen preexec_fn 的函式 (fork 後、exec 前在子程序執行)：父程序被
+    SIGKILL (gunicorn 逾時、重新部署) 時 Chromium 也一併結束，不會殘留。
+    PR_SET_PDEATHSIG 以啟動它的通道執行緒為準，該執行緒意外結束時 Chromium 也會
+    結束，由 _begin_job 偵測後重新啟動
+    """
+    def preexec():
+        if _prctl is not None:
+            _prctl(PR_SET_PDEATHSIG, signal.SIGKILL)
+        if os.getppid() != parent_pid:
+            # 設定前父程序已經結束
+            os._exit(1)
+    return preexec
+
+
+def _kill_process_group(process):
+    """結束以 start_new_session 啟動的程序及其整個程序群組 (已結束時不做任何事)"""
+    if process.poll() is not None:
+        return
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    except ProcessLookupError:
+        pass
+
+
+def _remove_stale_profiles():
+    """刪除已結束程序留下的 Chromium profile 目錄 (lia-chromium-<pid>-*)"""
+    for path in Path(tempfile.gettempdir()).glob(f"{PROFILE_PREFIX}*"):
+        try:
+            owner = int(path.name[len(PROFILE_PREFIX):].split("-", 1)[0])
+            os.kill(owner, 0)
+        except ValueError:
+            continue
+        except ProcessLookupError:
+            shutil.rmtree(path, ignore_errors=True)
+        except PermissionError:
+            continue
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_cdp(endpoint: str, process, timeout: float = 30):
+    """等待 Chromium 的 remote debugging port 可連線"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Chromium 啟動失敗 (exit code {process.returncode})")
+        try:
+            with urllib.request.urlopen(f"{endpoint}/json/version", timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"等待 Chromium remote debugging port 逾時 ({endpoint})")
+
+
+_pools = {}
+# 查詢結束後已整理回查詢表單的 page -> (查詢網址, 整理完成時間)；page 關閉後自動移除
+_warm_pages = weakref.WeakKeyDictionary()
+# 最近一次查詢開始的時間 (time.monotonic())，閒置過久時停止重新預解驗證碼
+_last_query_at = 0.0
+_pools_lock = threading.Lock()
+
+
+def get_browser_pool(headless: bool = True) -> BrowserPool:
+    """取得程序層級共用的瀏覽器池 (依 headless 區分)"""
+    with _pools_lock:
+        if headless not in _pools:
+            _pools[headless] = BrowserPool(headless=headless)
+        return _pools[headless]
 
-_browser_lock = threading.Lock()
 
 class LIAQueryBot:
     """壽險公會業務員登錄查詢機器人 (核心邏輯)"""
     
     DNS_MAX_RETRIES = 5
+    ENGINE = "browser"
 
-    URL = (
-        "https://public.liaroc.org.tw/lia-public/DIS/Servlet/RD?"
+    # 等待條件：以頁面事件 / DOM 狀態取代固定 sleep
+    WAIT_TIMEOUT_MS = 60000
+    # 單次查詢的整體時間預算 (秒)：導航、等待與重試的逾時都從剩餘時間計算，
+    # 預算用完前以 error 結束，需小於 gunicorn --timeout
+    QUERY_DEADLINE_SECONDS = float(os.environ.get("LIA_QUERY_DEADLINE_SECONDS", "100"))
+    # Playwright 預設的操作逾時，查詢結束後還原 (查詢期間依剩餘時間縮短)
+    DEFAULT_ACTION_TIMEOUT_MS = 30000
+    # 結果截圖在結果表格下方多留的高度
+    SCREENSHOT_PADDING_PX = 16
+    # 延後截圖時結果頁面保留在瀏覽器池的秒數 (期間該通道不接其他查詢)
+    SCREENSHOT_HOLD_SECONDS = float(os.environ.get("LIA_SCREENSHOT_HOLD_SECONDS", "20"))
+    WAIT_SLICE_MS = 100
+    CAPTCHA_REFRESH_TIMEOUT_MS = 5000
+    # 設為 1 時改回舊版固定 sleep + networkidle，方便比較每次嘗試的耗時
+    LEGACY_FIXED_WAITS = os.environ.get("LIA_LEGACY_WAITS") == "1"
+
+    CAPTCHA_READY_JS = """() => {
+        const img = document.querySelector('#captcha');
+        return !!img && img.complete && img.naturalWidth > 0;
+    }"""
+    CAPTCHA_REFRESHED_JS = """(oldSrc) => {
+        const img = document.querySelector('#captcha');
+        return !!img && img.getAttribute('src') !== oldSrc && img.complete && img.naturalWidth > 0;
+    }"""
+    RESULT_READY_JS = """() => {
+        if (document.querySelector('table.formStyle02')) return true;
+        if (document.body && document.body.innerText.includes('查無資料')) return true;
+        return document.readyState === 'complete' && !document.querySelector('#iusr');
+    }"""
+
+    # 可用 LIA_BASE_URL (或建構子的 base_url) 指向離線模擬站台，例如 http://127.0.0.1:5055
+    BASE_URL = os.environ.get("LIA_BASE_URL", "https://public.liaroc.org.tw").rstrip("/")
+    QUERY_PATH = (
+        "/lia-public/DIS/Servlet/RD?"
         "returnUrl=..%2F..%2FindexUsr.jsp&xml=%3C%3Fxml+version%3D%221.0%22+"
         "encoding%3D%22BIG5%22%3F%3E%3CRoot%3E%3CForm%3E%3CreturnUrl%3E"
         "..%2F..%2FindexUsr.jsp%3C%2FreturnUrl%3E%3Cxml%2F%3E%3Cfuncid%3E"
@@ -22,64 +609,107 @@ class LIAQueryBot:
         "%3C%2FprogId%3E%3C%2FForm%3E%3C%2FRoot%3E&funcid="
         "PGQ010++++++++++++++++++++++++&progId=PGQ010S01"
     )
+    URL = BASE_URL + QUERY_PATH
+
+    # 子資源攔截：查詢流程只需要文件、同站 script / xhr 與同站圖片 (驗證碼)
+    BLOCK_RESOURCES = os.environ.get("LIA_BLOCK_RESOURCES", "1") != "0"
+    # 不需截圖時一律擋掉的資源類型
+    NON_ESSENTIAL_TYPES = ("stylesheet", "font", "media", "manifest", "texttrack", "other")
+
+    # 查詢結束後把 page 留在查詢表單 (返回上一頁並刷新驗證碼)，下一次查詢省去整頁載入；
+    # 表單閒置超過 WARM_PAGE_MAX_AGE_SECONDS 視為伺服器 session 可能已過期，改為重新載入
+    WARM_PAGE = os.environ.get("LIA_WARM_PAGE", "1") != "0"
+    WARM_PAGE_MAX_AGE_SECONDS = float(os.environ.get("LIA_WARM_PAGE_MAX_AGE_SECONDS", "240"))
+    # 留在表單上的 page 同時預先解好驗證碼，查詢時只需填入證號送出；預解答案超過
+    # PREARM_MAX_AGE_SECONDS 視為伺服器端已過期，通道閒置時會在到期前重新預解
+    PREARM_CAPTCHA = os.environ.get("LIA_PREARM_CAPTCHA", "1") != "0"
+    PREARM_MAX_AGE_SECONDS = float(os.environ.get("LIA_PREARM_MAX_AGE_SECONDS", "90"))
+    # 超過此秒數沒有任何查詢時停止閒置重新預解 (不再定期連線到壽險公會)，下一次查詢重新載入表單
+    PREARM_IDLE_SECONDS = float(os.environ.get("LIA_PREARM_IDLE_SECONDS", "600"))
     
-    def __init__(self, headless: bool = True):
+    def __init__(self, headless: bool = True, base_url: str = None):
         self.headless = headless
-        print("初始化 OCR 引擎...")
-        self.ocr = ddddocr.DdddOcr(show_ad=False)
-        self.playwright = None
-        self.browser = None
+        if base_url:
+            self.URL = base_url.rstrip("/") + self.QUERY_PATH
+        self.pool = None
         self.page = None
+        self.deadline = Deadline()
+        self._pending_screenshot = None
         
     def start(self):
-        """啟動瀏覽器（同時取得全域鎖，確保僅一個 Chromium 實例）"""
-        _browser_lock.acquire()
-        self.playwright = sync_playwright().start()
-        self.browser = self.playwright.chromium.launch(
-            headless=self.headless,
-            args=[
-                '--disable-dev-shm-usage',
-                '--disable-gpu',
-                '--no-sandbox',
-                '--disable-extensions',
-                '--single-process',
-            ]
-        )
-        self.page = self.browser.new_page()
+        """連上常駐瀏覽器池 (不再每次啟動 Chromium，並行數量由瀏覽器池控制)"""
+        self.pool = get_browser_pool(self.headless)
         
     def close(self):
-        """關閉瀏覽器並釋放全域鎖"""
-        try:
-            if self.browser:
-                self.browser.close()
-            if self.playwright:
-                self.playwright.stop()
-            self.page = None
-            self.browser = None
-            self.playwright = None
-        finally:
-            _browser_lock.release()
+        """歸還瀏覽器池 (瀏覽器本身保持常駐)"""
+        self.pool = None
+        self.page = None
 
     def _get_captcha_text(self) -> str:
         """擷取並識別驗證碼"""
         # 等待圖片載入
-        time.sleep(1)
         element = self.page.locator('#captcha')
-        element.wait_for(state="visible")
+        if self.LEGACY_FIXED_WAITS:
+            self.deadline.sleep(1)
+            element.wait_for(state="visible")
+        else:
+            self.page.wait_for_function(self.CAPTCHA_READY_JS, timeout=self.deadline.timeout_ms(self.WAIT_TIMEOUT_MS))
         
         # 截圖並識別
         img_bytes = element.screenshot()
-        result = self.ocr.classification(img_bytes)
+        result = ocr_service.classify(img_bytes)
         print(f"    識別驗證碼: {result}")
         return result.lower().strip()
 
     def _refresh_captcha(self):
-        """點擊刷新驗證碼"""
+        """點擊刷新驗證碼，等到新圖片載入完成 (src 改變且圖片已解碼)"""
         print("    刷新驗證碼...")
+        if self.LEGACY_FIXED_WAITS:
+            self.page.locator('#btn3').click()
+            self.deadline.sleep(1)
+            return
+        old_src = self.page.locator('#captcha').get_attribute('src')
         self.page.locator('#btn3').click()
-        time.sleep(1)
+        try:
+            self.page.wait_for_function(
+                self.CAPTCHA_REFRESHED_JS, arg=old_src, timeout=self.deadline.timeout_ms(self.CAPTCHA_REFRESH_TIMEOUT_MS)
+            )
+        except PlaywrightTimeoutError:
+            # 部分情況 src 不變 (伺服器端直接換圖)，交由 _get_captcha_text 等待圖片就緒
+            print("    驗證碼圖片網址未改變，沿用目前圖片狀態")
+
+    def _attempt_elapsed_ms(self, started: float) -> float:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        metrics.CAPTCHA_ATTEMPT_SECONDS.observe(elapsed_ms / 1000, engine=self.ENGINE)
+        print(f"    本次嘗試耗時 {elapsed_ms:.0f}ms")
+        return round(elapsed_ms, 1)
+
+    def _wait_for_result(self, dialog_seen) -> str:
+        """
+        送出表單後等待結果：攔截到對話框、出現結果表格 / 查無資料，
+        或已離開查詢表單的其他頁面，以先發生者為準。
+        以短時間片輪詢，讓 dialog 事件能在等待期間被處理。
+        逾時不拋例外，交由後續頁面判斷 (會得到 unknown)；整體時間預算用完時
+        拋出 DeadlineExceeded。
+        """
+        wait_until = time.monotonic() + self.deadline.timeout(self.WAIT_TIMEOUT_MS / 1000)
+        while time.monotonic() < wait_until:
+            if dialog_seen():
+                return "dialog"
+            try:
+                self.page.wait_for_function(self.RESULT_READY_JS, timeout=self.WAIT_SLICE_MS)
+                return "page"
+            except PlaywrightTimeoutError:
+                continue
+            except PlaywrightError:
+                # 換頁中 (execution context 被銷毀)，稍後再檢查
+                self.page.wait_for_timeout(self.WAIT_SLICE_MS)
+        self.deadline.check()
+        print(f"    等待查詢結果逾時 ({self.WAIT_TIMEOUT_MS}ms)")
+        return "timeout"
     
-    def _parse_roc_date(self, date_text: str) -> tuple:
+    @staticmethod
+    def _parse_roc_date(date_text: str) -> tuple:
         """
         解析民國年日期
         Args:
@@ -99,78 +729,89 @@ class LIAQueryBot:
             return (year, month, day)
         return None
     
-    def _roc_to_western(self, roc_year: int, month: int, day: int) -> datetime:
+    @staticmethod
+    def _roc_to_western(roc_year: int, month: int, day: int) -> datetime:
         """
         將民國年轉換為西元 datetime
         """
         western_year = roc_year + 1911
         return datetime(western_year, month, day)
     
-    def _is_within_one_year(self, roc_year: int, month: int, day: int) -> bool:
+    @staticmethod
+    def _is_within_one_year(roc_year: int, month: int, day: int) -> bool:
         """
         判斷日期是否在今天的一年內
         """
-        target_date = self._roc_to_western(roc_year, month, day)
+        target_date = LIAQueryBot._roc_to_western(roc_year, month, day)
         today = datetime.now()
         one_year_ago = today - timedelta(days=365) # 近一年
         
         return target_date >= one_year_ago
+
+    @staticmethod
+    def _date_verdict(roc_year: int, month: int, day: int) -> dict:
+        """
+        依初次登錄日期判斷資格，回傳要更新到查詢結果的欄位
+        """
+        date_str = f"{roc_year}_{month:02d}_{day:02d}"
+        if LIAQueryBot._is_within_one_year(roc_year, month, day):
+            return {"success": True, "status": "found_valid", "msg": f"審核成功（初次登錄 {roc_year}年{month}月{day}日，在一年內）", "date": date_str}
+        return {"success": True, "status": "found_invalid", "msg": f"審核失敗（初次登錄 {roc_year}年{month}月{day}日，超過一年）", "date": date_str}
     
-    def _extract_registration_date(self) -> tuple:
+    @staticmethod
+    def _verdict_from_page(page) -> dict:
         """
-        從頁面表格中提取初次登錄日期
+        依解析後的結果頁面 (lia_parser.parse_page) 判斷查詢狀態，回傳要更新到查詢
+        結果的欄位；找到結果表格時附上結構化紀錄 record (姓名、公司、初次登錄日期、
+        登錄狀態)，供截圖檔名與 Email 範本共用
         """
-        try:
-            # 取得表格內容
-            table = self.page.locator('table.formStyle02')
-            if table.count() == 0:
-                print("    找不到 formStyle02 表格")
-                return None
-            
-            # 尋找包含「初次登錄日期」的列
-            rows = table.locator('tr')
-            for i in range(rows.count()):
-                row_text = rows.nth(i).inner_text()
-                if '初次登錄日期' in row_text:
-                    # 解析日期
-                    return self._parse_roc_date(row_text)
-            
-            print("    找不到初次登錄日期")
-            return None
-        except Exception as e:
-            print(f"    提取日期時發生錯誤: {e}")
-            return None
-            
-    def _generate_screenshot_filename(self, registration_number: str, result_status: str) -> str:
+        if "查無資料" in page.text or any("查無資料" in alert for alert in page.alerts):
+            return {"success": True, "status": "not_found", "msg": "查無此登錄字號資料"}
+
+        record = extract_result_record(page)
+        if record is None or "初次登錄日期" not in page.text:
+            return {"success": True, "status": "unknown", "msg": "表單已送出，無明確結果或非預期頁面"}
+
+        if "未辦理登錄" in page.text:
+            verdict = {"success": True, "status": "not_registered", "msg": "未辦理登錄（未登記於任何公司）"}
+        else:
+            date_tuple = LIAQueryBot._parse_roc_date(record["first_registration_date"] or "")
+            if date_tuple is None:
+                # 欄位配對不符合實際表格排列時，改從含「初次登錄日期」的整列文字解析
+                for row_text in page.result_rows:
+                    if "初次登錄日期" in row_text:
+                        date_tuple = LIAQueryBot._parse_roc_date(row_text)
+                        if date_tuple:
+                            break
+            if date_tuple:
+                verdict = LIAQueryBot._date_verdict(*date_tuple)
+            else:
+                print("    找不到初次登錄日期")
+                verdict = {"success": True, "status": "found_undetermined", "msg": "找到資料但無法解析日期"}
+        verdict["record"] = record
+        return verdict
+
+    @staticmethod
+    def _generate_screenshot_filename(registration_number: str, result_status: str, date_str: str = None,
+                                      extension: str = ".png") -> str:
         """
-        根據查詢結果生成截圖檔名
+        根據查詢結果生成截圖檔名 (date_str 為查詢結果的 date，如 "114_05_13"；extension 依截圖格式)
         """
         base_name = f"{registration_number}"
         
         if result_status == "not_found":
-            return f"{base_name}_查無資料.png"
+            return f"{base_name}_查無資料{extension}"
         elif result_status == "found_valid":
-            date_tuple = self._extract_registration_date()
-            if date_tuple:
-                year, month, day = date_tuple
-                date_str = f"{year}_{month:02d}_{day:02d}"
-                return f"{base_name}_審核通過_{date_str}.png"
-            else:
-                return f"{base_name}_審核通過_日期未知.png"
+            return f"{base_name}_審核通過_{date_str or '日期未知'}{extension}"
         elif result_status == "found_invalid":
-            date_tuple = self._extract_registration_date()
-            if date_tuple:
-                year, month, day = date_tuple
-                date_str = f"{year}_{month:02d}_{day:02d}"
-                return f"{base_name}_資格不符_{date_str}.png"
-            else:
-                return f"{base_name}_資格不符_日期未知.png"
+            return f"{base_name}_資格不符_{date_str or '日期未知'}{extension}"
         elif result_status == "not_registered":
-            return f"{base_name}_未辦理登錄.png"
+            return f"{base_name}_未辦理登錄{extension}"
         else: # unknown 或 error
-            return f"{base_name}_無效證號.png"
+            return f"{base_name}_無效證號{extension}"
 
-    def _generate_email_template(self, status: str) -> dict:
+    @staticmethod
+    def _generate_email_template(status: str) -> dict:
         """根據狀態生成回信範本"""
         today = datetime.now()
         one_year_ago = today - timedelta(days=365)
@@ -248,109 +889,547 @@ Finfo 客服團隊 敬上"""
         else:
             return templates["not_found"]
 
-    def perform_query(self, reg_no: str, max_retries=5, skip_screenshot=False):
-        """執行查詢動作 (含驗證碼重試機制)"""
-        final_result = {
+    def perform_query(self, reg_no: str, max_retries=5, skip_screenshot=False, deadline: Deadline = None,
+                      lazy_screenshot: bool = False):
+        """
+        執行查詢動作 (交由瀏覽器池的執行緒在已就緒的 page 上執行)
+        deadline 為整體時間預算 (含等待瀏覽器池)，未指定時為 QUERY_DEADLINE_SECONDS 秒；
+        預算用完時回傳 status 為 error 的結果 (deadline_exceeded 為 True)
+        lazy_screenshot 為 True 時解析出結果就回傳，不先截圖：結果中的 "screenshot"
+        為 PendingScreenshot，需要時再呼叫 get() 截圖
+        """
+        if self.pool is None:
+            raise RuntimeError("請先呼叫 start() 取得瀏覽器池")
+        self.deadline = deadline or Deadline(self.QUERY_DEADLINE_SECONDS)
+        if self.deadline.expired():
+            # 例如等待合併的查詢時已用完預算，不再排入瀏覽器池
+            return self._deadline_result(self.deadline)
+        return self.pool.run(
+            lambda page: self._perform_query_on_page(page, reg_no, max_retries, skip_screenshot, lazy_screenshot),
+            after=self._finish_page if self.WARM_PAGE or lazy_screenshot else None,
+            idle=self._rearm_captcha if self.WARM_PAGE and self.PREARM_CAPTCHA else None,
+            max_wait=min(BrowserPool.MAX_WAIT_SECONDS, self.deadline.remaining()),
+        )
+
+    @staticmethod
+    def _deadline_result(deadline: Deadline) -> dict:
+        """時間預算用完時的查詢結果 (各引擎共用)"""
+        print(f"    查詢超過 {deadline.seconds:g} 秒時間預算，停止查詢")
+        return {
             "success": False,
             "status": "error",
-            "msg": "未完成查詢",
+            "msg": f"查詢逾時（超過 {deadline.seconds:g} 秒）",
             "screenshot_path": None,
-            "email_info": None
+            "email_info": LIAQueryBot._generate_email_template("error"),
+            "attempt_ms": [],
+            "deadline_exceeded": True,
         }
 
-        print(f"前往查詢頁面: {reg_no}")
-        for nav_attempt in range(self.DNS_MAX_RETRIES):
+    def _perform_query_on_page(self, page, reg_no: str, max_retries: int, skip_screenshot: bool,
+                               lazy_screenshot: bool = False):
+        """在瀏覽器執行緒上執行查詢 (含驗證碼重試機制)"""
+        global _last_query_at
+        _last_query_at = time.monotonic()
+        self.page = page
+        started = time.perf_counter()
+        status = "exception"
+        try:
+            self._install_request_filter(screenshot_fidelity=not skip_screenshot)
             try:
-                self.page.goto(self.URL, wait_until='domcontentloaded', timeout=60000)
-                break
-            except Exception as e:
-                if "ERR_NAME_NOT_RESOLVED" in str(e):
-                    print(f"    DNS 解析失敗，3秒後重試... ({nav_attempt + 1}/{self.DNS_MAX_RETRIES})")
-                    if nav_attempt < self.DNS_MAX_RETRIES - 1:
-                        time.sleep(3)
-                        continue
-                    print(f"    DNS 解析連續 {self.DNS_MAX_RETRIES} 次失敗，無法連接至壽險公會網站")
-                raise
-        
+                result = self._run_query(reg_no, max_retries, skip_screenshot, lazy_screenshot)
+            except DeadlineExceeded:
+                result = self._deadline_result(self.deadline)
+            except PlaywrightTimeoutError:
+                # 逾時是依剩餘預算縮短的結果時，同樣視為預算用完
+                if not self.deadline.expired():
+                    raise
+                result = self._deadline_result(self.deadline)
+            status = result["status"]
+            return result
+        finally:
+            page.set_default_timeout(self.DEFAULT_ACTION_TIMEOUT_MS)
+            self.page = None
+            self.deadline = Deadline()
+            metrics.QUERY_SECONDS.observe(time.perf_counter() - started, engine=self.ENGINE, status=status)
+            metrics.QUERY_OUTCOMES.inc(engine=self.ENGINE, status=status)
+
+    def _install_request_filter(self, screenshot_fidelity: bool):
+        """
+        設定本次查詢的子資源攔截規則 (page 會被重複使用，每次查詢先移除上一次的規則)
+        注意：啟用 route 後 Playwright 會停用該 page 的 HTTP 快取
+        """
+        self.page.unroute("**/*")
+        if not self.BLOCK_RESOURCES:
+            return
+        origin = urlsplit(self.URL).netloc
+
+        def handle_route(route):
+            request = route.request
+            if self._should_block(request.resource_type, request.url, origin, screenshot_fidelity):
+                metrics.BLOCKED_REQUESTS.inc(resource_type=request.resource_type)
+                route.abort()
+            else:
+                route.continue_()
+
+        self.page.route("**/*", handle_route)
+
+    @classmethod
+    def _should_block(cls, resource_type: str, url: str, origin: str, screenshot_fidelity: bool) -> bool:
+        """
+        判斷子資源是否攔截
+        文件 (含表單送出) 一律放行；需要截圖時載入同站 / CDN 的樣式、字型與圖片
+        以維持畫面，其餘情況只放行同站 script / xhr 與同站圖片
+        (驗證碼圖片的網址沒有固定格式，同站圖片一律放行以免擋到驗證碼)
+        """
+        if resource_type == "document":
+            return False
+        same_origin = urlsplit(url).netloc == origin
+        if screenshot_fidelity:
+            if resource_type in ("stylesheet", "font", "image"):
+                return False
+            return resource_type == "media" or not same_origin
+        if resource_type in cls.NON_ESSENTIAL_TYPES:
+            return True
+        # 第三方 script / xhr / 圖片 (追蹤碼等)
+        return not same_origin
+
+    def _phase(self, phase: str):
+        """查詢階段計時 (lia_query_phase_seconds)"""
+        return metrics.QUERY_PHASE_SECONDS.time(engine=self.ENGINE, phase=phase)
+
+    def _classify_page(self, final_result: dict):
+        """
+        依結果頁面內容判斷查詢狀態，更新 final_result
+        只取一次 page.content() 在本機解析，不逐列向瀏覽器查詢表格內容
+        """
+        page = parse_page(self.page.content())
+        final_result.update(self._verdict_from_page(page))
+
+    def _navigate(self):
+        """完整載入查詢頁面 (DNS 解析失敗時重試)"""
+        with self._phase("navigation"):
+            for nav_attempt in range(self.DNS_MAX_RETRIES):
+                try:
+                    self.page.goto(self.URL, wait_until='domcontentloaded', timeout=self.deadline.timeout_ms(60000))
+                    break
+                except Exception as e:
+                    if "ERR_NAME_NOT_RESOLVED" in str(e):
+                        print(f"    DNS 解析失敗，3秒後重試... ({nav_attempt + 1}/{self.DNS_MAX_RETRIES})")
+                        if nav_attempt < self.DNS_MAX_RETRIES - 1:
+                            metrics.DNS_RETRIES.inc(engine=self.ENGINE)
+                            self.deadline.sleep(3)
+                            continue
+                        print(f"    DNS 解析連續 {self.DNS_MAX_RETRIES} 次失敗，無法連接至壽險公會網站")
+                    raise
+
+    def _take_warm_form(self):
+        """
+        取出 page 上一次查詢結束後整理好的查詢表單狀態 (只使用一次，查詢中途失敗
+        不會沿用)，回傳 (是否沿用表單, 預解的驗證碼答案或 None)
+        表單閒置超過 WARM_PAGE_MAX_AGE_SECONDS 或已不在查詢頁面時不沿用；
+        預解答案超過 PREARM_MAX_AGE_SECONDS 時先刷新驗證碼，改為當場識別
+        """
+        warm = _warm_pages.pop(self.page, None)
+        if not self.WARM_PAGE:
+            return False, None
+        if warm is None:
+            metrics.PREARMED_CAPTCHA.inc(result="miss")
+            return False, None
+        url, ready_at, captcha_text = warm
+        age = time.monotonic() - ready_at
+        if url != self.URL or self.page.locator('#iusr').count() == 0:
+            metrics.WARM_PAGE.inc(result="miss")
+            metrics.PREARMED_CAPTCHA.inc(result="miss")
+            return False, None
+        if age > self.WARM_PAGE_MAX_AGE_SECONDS:
+            metrics.WARM_PAGE.inc(result="expired")
+            metrics.PREARMED_CAPTCHA.inc(result="miss")
+            return False, None
+        metrics.WARM_PAGE.inc(result="hit")
+
+        if captcha_text is None:
+            metrics.PREARMED_CAPTCHA.inc(result="miss")
+            return True, None
+        if age > self.PREARM_MAX_AGE_SECONDS:
+            metrics.PREARMED_CAPTCHA.inc(result="expired")
+            with self._phase("captcha_refresh"):
+                self._refresh_captcha()
+            return True, None
+        metrics.PREARMED_CAPTCHA.inc(result="hit")
+        return True, captcha_text
+
+    def _arm_form(self, page, refresh: bool = True):
+        """刷新驗證碼 (並在啟用時預先識別)，記錄為可直接使用的查詢表單"""
+        self.page = page
+        try:
+            if refresh:
+                self._refresh_captcha()
+            captcha_text = None
+            if self.PREARM_CAPTCHA:
+                captcha_text = self._get_captcha_text()
+            _warm_pages[page] = (self.URL, time.monotonic(), captcha_text)
+        finally:
+            self.page = None
+
+    def _finish_page(self, page):
+        """
+        (瀏覽器池在結果回傳後呼叫) 有延後截圖時先保留結果頁面等待取用，
+        再把 page 整理回查詢表單
+        """
+        pending, self._pending_screenshot = self._pending_screenshot, None
+        if pending is not None:
+            pending._serve()
+        if self.WARM_PAGE:
+            self._reset_to_form(page)
+
+    def _reset_to_form(self, page):
+        """
+        (瀏覽器池在結果回傳後呼叫) 把 page 整理回乾淨的查詢表單：
+        結果頁先返回上一頁，再清空證號並刷新驗證碼 (舊驗證碼已在送出時用掉)
+        """
+        if page.locator('#iusr').count() == 0:
+            page.go_back(wait_until='domcontentloaded', timeout=10000)
+            if page.locator('#iusr').count() == 0:
+                return
+        page.locator('#iusr').fill('')
+        page.locator('input[name="captchaAnswer"]').fill('')
+        self._arm_form(page)
+
+    def _rearm_captcha(self, page):
+        """
+        (瀏覽器池在通道閒置時定期呼叫) 預解答案即將超過 PREARM_MAX_AGE_SECONDS
+        時刷新驗證碼重新預解；刷新也會讓伺服器端 session 保持有效
+        斷路器不是 closed 時不連線到壽險公會；超過 PREARM_IDLE_SECONDS 沒有查詢時
+        停止重新預解，由下一次查詢重新載入表單
+        """
+        warm = _warm_pages.get(page)
+        if warm is None:
+            return
+        if time.monotonic() - _last_query_at > self.PREARM_IDLE_SECONDS:
+            _warm_pages.pop(page, None)
+            return
+        if CIRCUIT_ENABLED and not _upstream_breaker.is_closed():
+            return
+        age = time.monotonic() - warm[1]
+        if age + BrowserPool.IDLE_INTERVAL_SECONDS < self.PREARM_MAX_AGE_SECONDS:
+            return
+        if age > self.WARM_PAGE_MAX_AGE_SECONDS:
+            # 表單可能已失效，交由下一次查詢重新載入
+            _warm_pages.pop(page, None)
+            return
+        metrics.PREARMED_CAPTCHA.inc(result="rearmed")
+        self._arm_form(page)
+
+    def _attempt_queries(self, reg_no: str, max_retries: int, final_result: dict, prearmed: str = None) -> list:
+        """
+        驗證碼重試迴圈，結果寫入 final_result，回傳每次嘗試的耗時 (毫秒)
+        prearmed 為閒置時預先解好的驗證碼答案，第一次嘗試直接使用
+        """
+        attempt_ms = []
         for attempt in range(1, max_retries + 1):
             print(f"第 {attempt} 次嘗試...")
+            attempt_started = time.perf_counter()
+            # 填寫、點擊、截圖等未指定逾時的操作也不超過剩餘預算
+            self.page.set_default_timeout(self.deadline.timeout_ms(self.WAIT_TIMEOUT_MS))
             
-            # 1. 識別驗證碼
-            captcha_text = self._get_captcha_text()
-            
-            # 2. 填寫表單
-            self.page.locator('#iusr').fill(reg_no)
-            self.page.locator('input[name="captchaAnswer"]').fill(captcha_text)
-            
-            # 3. 處理 Alert 對話框
-            dialog_message = None
-            def handle_dialog(dialog):
-                nonlocal dialog_message
-                dialog_message = dialog.message
-                print(f"    攔截到對話框: {dialog_message}")
-                dialog.accept()
+            # 1. 識別驗證碼 (第一次嘗試優先使用預解的答案)
+            if attempt == 1 and prearmed:
+                captcha_text = prearmed
+                print(f"    使用預解驗證碼: {captcha_text}")
+            else:
+                with self._phase("captcha"):
+                    captcha_text = self._get_captcha_text()
             
-            self.page.once("dialog", handle_dialog)
+            # 2~4. 填寫表單、送出並等待結果
+            with self._phase("submit"):
+                # 2. 填寫表單
+                self.page.locator('#iusr').fill(reg_no)
+                self.page.locator('input[name="captchaAnswer"]').fill(captcha_text)
             
-            # 4. 點擊查詢
-            self.page.locator('#btn1').click()
+                # 3. 處理 Alert 對話框
+                dialog_message = None
+                def handle_dialog(dialog):
+                    nonlocal dialog_message
+                    dialog_message = dialog.message
+                    print(f"    攔截到對話框: {dialog_message}")
+                    dialog.accept()
             
-            # 等待處理結果
-            self.page.wait_for_load_state('networkidle', timeout=60000)
-            time.sleep(1)
+                # page 會被重複使用，用 on + remove_listener 避免未觸發的 handler 殘留到下一次查詢
+                self.page.on("dialog", handle_dialog)
+                try:
+                    # 4. 點擊查詢
+                    self.page.locator('#btn1').click()
+                
+                    # 等待處理結果
+                    if self.LEGACY_FIXED_WAITS:
+                        self.page.wait_for_load_state('networkidle', timeout=self.deadline.timeout_ms(60000))
+                        self.deadline.sleep(1)
+                    else:
+                        self._wait_for_result(lambda: dialog_message is not None)
+                finally:
+                    self.page.remove_listener("dialog", handle_dialog)
             
             # 5. 判斷結果
             if dialog_message and "驗證碼錯誤" in dialog_message:
                 print("    驗證碼錯誤，重試中...")
-                self._refresh_captcha()
+                metrics.CAPTCHA_ATTEMPTS.inc(engine=self.ENGINE, outcome="rejected")
+                if attempt == 1 and prearmed:
+                    metrics.PREARMED_CAPTCHA.inc(result="stale")
+                with self._phase("captcha_refresh"):
+                    self._refresh_captcha()
                 dialog_message = None
+                attempt_ms.append(self._attempt_elapsed_ms(attempt_started))
                 continue
 
+            metrics.CAPTCHA_ATTEMPTS.inc(engine=self.ENGINE, outcome="accepted")
             if dialog_message and "查無資料" in dialog_message:
                 final_result.update({"success": True, "status": "not_found", "msg": "查無此登錄字號資料"})
                 break
             
             # 檢查頁面內容
-            page_content = self.page.content()
-            
-            if "查無資料" in page_content:
-                final_result.update({"success": True, "status": "not_found", "msg": "查無此登錄字號資料"})
-                break
-                
-            elif "formStyle02" in page_content and "初次登錄日期" in page_content:
-                if "未辦理登錄" in page_content:
-                    final_result.update({"success": True, "status": "not_registered", "msg": "未辦理登錄（未登記於任何公司）"})
-                else:
-                    date_tuple = self._extract_registration_date()
-                    if date_tuple:
-                        year, month, day = date_tuple
-                        if self._is_within_one_year(year, month, day):
-                            final_result.update({"success": True, "status": "found_valid", "msg": f"審核成功（初次登錄 {year}年{month}月{day}日，在一年內）", "date": f"{year}_{month:02d}_{day:02d}"})
-                        else:
-                            final_result.update({"success": True, "status": "found_invalid", "msg": f"審核失敗（初次登錄 {year}年{month}月{day}日，超過一年）", "date": f"{year}_{month:02d}_{day:02d}"})
-                    else:
-                        final_result.update({"success": True, "status": "found_undetermined", "msg": "找到資料但無法解析日期"})
-                break
-            
-            final_result.update({"success": True, "status": "unknown", "msg": "表單已送出，無明確結果或非預期頁面"})
+            with self._phase("parse"):
+                self._classify_page(final_result)
             break
-        
-        # 截取最終結果頁面 (記憶體截圖)
-        if final_result["success"] and not skip_screenshot:
-            suggested_filename = self._generate_screenshot_filename(reg_no, final_result["status"])
-            # 截取最終結果頁面 (記憶體截圖)，只截取頁面上方 60%
-            page_height = self.page.evaluate("document.body.scrollHeight")
-            clip_height = page_height * 0.6 # 截取 60% 的高度
+        else:
+            _mark_captcha_exhausted(final_result, max_retries)
 
-            screenshot_bytes = self.page.screenshot(
-                clip={"x": 0, "y": 0, "width": self.page.viewport_size['width'], "height": clip_height}
-            )
+        if final_result["success"]:
+            attempt_ms.append(self._attempt_elapsed_ms(attempt_started))
+        return attempt_ms
+
+    def _run_query(self, reg_no: str, max_retries: int, skip_screenshot: bool, lazy_screenshot: bool = False):
+        final_result = {
+            "success": False,
+            "status": "error",
+            "msg": "未完成查詢",
+            "screenshot_path": None,
+            "email_info": None
+        }
 
-            final_result["screenshot_bytes"] = screenshot_bytes
-            final_result["suggested_filename"] = suggested_filename
-            print(f"截圖已擷取 (記憶體中), 建議檔名: {suggested_filename}")
+        # 沿用表單時的檢查與驗證碼刷新同樣不超過剩餘預算
+        self.page.set_default_timeout(self.deadline.timeout_ms(self.WAIT_TIMEOUT_MS))
+        warm, captcha_text = self._take_warm_form()
+        if warm:
+            print(f"沿用已載入的查詢表單: {reg_no}")
+        else:
+            print(f"前往查詢頁面: {reg_no}")
+            self._navigate()
+
+        attempt_ms = self._attempt_queries(reg_no, max_retries, final_result, captcha_text)
+        if warm and final_result["status"] in ("unknown", "error"):
+            # 沿用的表單 session 可能已在伺服器端過期，重新載入後再查一次
+            print("    沿用的查詢表單可能已失效，重新載入查詢頁面")
+            metrics.WARM_PAGE.inc(result="stale")
+            final_result.update({"success": False, "status": "error", "msg": "未完成查詢"})
+            final_result.pop("captcha_exhausted", None)
+            self._navigate()
+            attempt_ms += self._attempt_queries(reg_no, max_retries, final_result)
+
+        # 每次驗證碼嘗試的耗時 (毫秒)，供比較 p50 / p95 使用
+        final_result["attempt_ms"] = attempt_ms
+        
+        # 截取最終結果頁面 (記憶體截圖)；延後截圖時保留 page 等到有人取用再截
+        if final_result["success"] and not skip_screenshot:
+            if lazy_screenshot:
+                page, status, date_str = self.page, final_result["status"], final_result.get("date")
+                self._pending_screenshot = PendingScreenshot(
+                    lambda: self._render_screenshot(page, reg_no, status, date_str), self.SCREENSHOT_HOLD_SECONDS
+                )
+                final_result["screenshot"] = self._pending_screenshot
+            else:
+                self.page.set_default_timeout(self.deadline.timeout_ms(self.WAIT_TIMEOUT_MS))
+                screenshot_bytes, mimetype, filename = self._render_screenshot(
+                    self.page, reg_no, final_result["status"], final_result.get("date")
+                )
+                final_result["screenshot_bytes"] = screenshot_bytes
+                final_result["screenshot_mimetype"] = mimetype
+                final_result["suggested_filename"] = filename
 
         # 生成 Email 範本
         final_result["email_info"] = self._generate_email_template(final_result["status"])
 
-        return final_result
\ No newline at end of file
+        return final_result
+
+    def _render_screenshot(self, page, reg_no: str, status: str, date_str: str = None) -> tuple:
+        """
+        截取結果區域並壓縮 (記憶體截圖，格式與大小上限見 screenshot_store)，
+        回傳 (bytes, mimetype, 建議檔名)
+        """
+        with self._phase("screenshot"):
+            screenshot_bytes, mimetype, extension = encode_screenshot(page.screenshot(clip=self._screenshot_clip(page)))
+        suggested_filename = self._generate_screenshot_filename(reg_no, status, date_str, extension)
+        print(f"截圖已擷取 (記憶體中), 建議檔名: {suggested_filename}")
+        return screenshot_bytes, mimetype, suggested_filename
+
+    def _screenshot_clip(self, page) -> dict:
+        """
+        截圖範圍：頁面頂端 (保留查詢頁標題) 到結果表格底部；
+        沒有結果表格 (例如查無資料只有對話框) 時沿用頁面上方 60%
+        """
+        width = page.viewport_size['width']
+        table = page.locator('table.formStyle02').first
+        box = table.bounding_box() if table.count() else None
+        if box:
+            bottom = box["y"] + box["height"] + self.SCREENSHOT_PADDING_PX
+            return {"x": 0, "y": 0, "width": max(width, box["x"] + box["width"]), "height": bottom}
+        page_height = page.evaluate("document.body.scrollHeight")
+        return {"x": 0, "y": 0, "width": width, "height": page_height * 0.6}
+
+
+# 查詢引擎：browser (Playwright，預設)、async (playwright.async_api，單一 event loop 並行查詢)
+# 或 http (直接呼叫查詢 Servlet)
+QUERY_ENGINE = os.environ.get("LIA_QUERY_ENGINE", "browser").lower()
+
+# 可快取的結果狀態 (error / unknown / found_undetermined 不快取，下次重新查詢)
+CACHEABLE_STATUSES = ("found_valid", "found_invalid", "not_registered", "not_found")
+
+_result_cache = create_result_cache()
+
+# 合併同一證號同時進行中的查詢；等待者最多等 SINGLE_FLIGHT_TIMEOUT_SECONDS 秒
+_in_flight = SingleFlight()
+SINGLE_FLIGHT_TIMEOUT_SECONDS = float(os.environ.get("SINGLE_FLIGHT_TIMEOUT_SECONDS", "180"))
+
+
+def _probe_upstream() -> bool:
+    """斷路器半開時的探測：查詢頁面能在 10 秒內正常載入 (含 #iusr 欄位) 才算恢復"""
+    with urllib.request.urlopen(LIAQueryBot.URL, timeout=10) as response:
+        return response.status == 200 and b"iusr" in response.read()
+
+
+# 壽險公會站台斷路器：維護或連不上時直接回報錯誤，不再每筆查詢等上數分鐘
+CIRCUIT_ENABLED = os.environ.get("CIRCUIT_ENABLED", "1") != "0"
+_upstream_breaker = CircuitBreaker(
+    "liaroc",
+    window=int(os.environ.get("CIRCUIT_WINDOW", "20")),
+    min_calls=int(os.environ.get("CIRCUIT_MIN_CALLS", "5")),
+    failure_rate=float(os.environ.get("CIRCUIT_FAILURE_RATE", "0.5")),
+    open_seconds=float(os.environ.get("CIRCUIT_OPEN_SECONDS", "30")),
+    probe=_probe_upstream,
+)
+
+
+def upstream_status() -> dict:
+    """壽險公會站台斷路器狀態 (供監控端點使用)"""
+    return _upstream_breaker.snapshot()
+
+
+def _failure_kind(error: Exception) -> str:
+    """把查詢例外歸類為斷路器的失敗種類；與上游無關的例外回傳 None"""
+    if isinstance(error, BrowserPoolBusy):
+        return None
+    if isinstance(error, (PlaywrightTimeoutError, requests.Timeout)):
+        return "timeout"
+    message = str(error)
+    if "ERR_NAME_NOT_RESOLVED" in message:
+        return "dns"
+    if "net::ERR_" in message or isinstance(error, requests.ConnectionError):
+        return "connection"
+    if isinstance(error, requests.HTTPError):
+        return "http_error"
+    return "error"
+
+
+def _mark_captcha_exhausted(final_result: dict, max_retries: int):
+    """驗證碼重試次數用完 (每次都被回應驗證碼錯誤)：上游正常回應，斷路器不計為上游失敗"""
+    print(f"    驗證碼連續 {max_retries} 次識別錯誤")
+    final_result.update({"captcha_exhausted": True, "msg": f"驗證碼連續 {max_retries} 次識別錯誤"})
+
+
+def _revalidate_cached_result(result: dict) -> dict:
+    """
+    快取結果依今天日期重新判斷資格：超過 365 天的 found_valid 會自動變成 found_invalid
+    Email 範本含有今天日期，一併重新產生
+    """
+    date_str = result.get("date")
+    if result["status"] in ("found_valid", "found_invalid") and date_str:
+        year, month, day = (int(part) for part in date_str.split("_"))
+        result.update(LIAQueryBot._date_verdict(year, month, day))
+    result["email_info"] = LIAQueryBot._generate_email_template(result["status"])
+    result["cached"] = True
+    return result
+
+
+def query_license(reg_no: str, skip_screenshot: bool = False, headless: bool = True, deadline: Deadline = None,
+                  lazy_screenshot: bool = False) -> dict:
+    """
+    各流程共用的查詢入口 (reg_no 需已補零為 10 碼)
+    不需要截圖的呼叫端 (REST API) 會先查結果快取；需要截圖的呼叫端一律重新查詢，
+    查到的結果同樣寫入快取 (不含截圖)。同一證號同時進行中的查詢會合併為一次。
+    壽險公會站台斷路中時 (快取未命中) 立即拋出 CircuitOpenError。
+    deadline 為整體時間預算 (未指定時從呼叫當下起算 LIAQueryBot.QUERY_DEADLINE_SECONDS 秒)，
+    等待合併的查詢同樣受此限制。
+    lazy_screenshot 為 True 時不等截圖就回傳，結果中的 "screenshot" 為 PendingScreenshot
+    (需在 LIAQueryBot.SCREENSHOT_HOLD_SECONDS 秒內呼叫 get()，用不到時呼叫 release())。
+    """
+    deadline = deadline or Deadline(LIAQueryBot.QUERY_DEADLINE_SECONDS)
+    if skip_screenshot:
+        cached = _result_cache.get(reg_no)
+        metrics.RESULT_CACHE_LOOKUPS.inc(result="hit" if cached else "miss")
+        if cached:
+            print(f"快取命中: {reg_no} ({cached['status']})")
+            return _revalidate_cached_result(cached)
+
+    lazy_screenshot = lazy_screenshot and not skip_screenshot
+    key = (reg_no, skip_screenshot, lazy_screenshot)
+    # 含截圖的查詢結果也能滿足不需截圖的呼叫端，有進行中的就直接等它
+    join = ((reg_no, False, False), (reg_no, False, True)) if skip_screenshot else ()
+
+    return _in_flight.do(
+        key,
+        lambda: _query_and_cache(reg_no, skip_screenshot, headless, deadline, lazy_screenshot),
+        timeout=min(SINGLE_FLIGHT_TIMEOUT_SECONDS, max(0.0, deadline.remaining())),
+        join=join,
+    )
+
+
+def _create_bot(skip_screenshot: bool, headless: bool):
+    """
+    依 LIA_QUERY_ENGINE 選擇查詢引擎：http 引擎不啟動瀏覽器，
+    但無法截圖，需要截圖的呼叫端仍使用瀏覽器引擎
+    """
+    if QUERY_ENGINE == "http" and skip_screenshot:
+        from lia_http import LIAHttpQueryBot
+        return LIAHttpQueryBot()
+    if QUERY_ENGINE == "async":
+        from lia_async import get_async_bridge
+        return get_async_bridge(headless)
+    return LIAQueryBot(headless=headless)
+
+
+def _query_and_cache(reg_no: str, skip_screenshot: bool, headless: bool, deadline: Deadline,
+                     lazy_screenshot: bool = False) -> dict:
+    if CIRCUIT_ENABLED:
+        _upstream_breaker.before_call()
+    bot = _create_bot(skip_screenshot, headless)
+    bot.start()
+    try:
+        result = bot.perform_query(
+            reg_no, skip_screenshot=skip_screenshot, deadline=deadline, lazy_screenshot=lazy_screenshot
+        )
+    except Exception as e:
+        kind = _failure_kind(e)
+        if kind is None:
+            _upstream_breaker.record_ignored()
+        else:
+            _upstream_breaker.record_failure(kind)
+        raise
+    finally:
+        bot.close()
+
+    # error / unknown 多半是維護頁面或非預期的回應，視為上游失敗；
+    # 驗證碼識別連續失敗是本機 OCR 的問題 (上游有正常回應驗證碼錯誤)，不計入
+    if result.get("deadline_exceeded"):
+        _upstream_breaker.record_failure("timeout")
+    elif result.get("captcha_exhausted"):
+        _upstream_breaker.record_ignored()
+    elif result.get("status") in ("error", "unknown"):
+        _upstream_breaker.record_failure("unexpected_page")
+    else:
+        _upstream_breaker.record_success()
+
+    if result.get("success") and result.get("status") in CACHEABLE_STATUSES:
+        _result_cache.put(reg_no, {
+            key: value for key, value in result.items()
+            if key not in ("screenshot", "screenshot_bytes", "screenshot_mimetype", "suggested_filename", "email_info", "attempt_ms")
+        })
+    return result
@@ -0,0 +1,186 @@
+import time
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+import ocr_service
+from deadline import Deadline, DeadlineExceeded
+from lia_bot import LIAQueryBot, _mark_captcha_exhausted
+from lia_parser import parse_page, find_query_form
+
+# 所有查詢共用同一組連線池 (keep-alive)；cookie 仍由各自的 Session 保存，
+# 避免同時進行的查詢共用同一個伺服器端驗證碼 session
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+
+
+class LIAHttpQueryBot:
+    """
+    壽險公會業務員登錄查詢 (不啟動瀏覽器)
+
+    直接以 HTTP 讀取查詢 Servlet 的表單、下載 #captcha 圖片交給 ddddocr 識別，
+    再送出 iusr / captchaAnswer 表單並解析結果 HTML，回傳與
+    LIAQueryBot.perform_query 相同格式的 final_result。無法截圖，需要截圖的
+    呼叫端仍應使用 LIAQueryBot。
+    """
+
+    DNS_MAX_RETRIES = LIAQueryBot.DNS_MAX_RETRIES
+    ENGINE = "http"
+    URL = LIAQueryBot.URL
+    TIMEOUT = 30
+    USER_AGENT = (
+        "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.36"
+    )
+
+    def __init__(self, base_url: str = None):
+        self.session = None
+        self.deadline = Deadline()
+        if base_url:
+            self.URL = base_url.rstrip("/") + LIAQueryBot.QUERY_PATH
+
+    def start(self):
+        """建立本次查詢專用的 Session (掛上共用連線池)"""
+        self.session = requests.Session()
+        self.session.mount("https://", _adapter)
+        self.session.mount("http://", _adapter)
+        self.session.headers["User-Agent"] = self.USER_AGENT
+
+    def close(self):
+        """釋放 Session (不呼叫 session.close()，避免關掉共用的連線池)"""
+        self.session = None
+
+    def _get(self, url: str, **kwargs) -> requests.Response:
+        response = self.session.get(url, timeout=self.deadline.timeout(self.TIMEOUT), **kwargs)
+        response.raise_for_status()
+        return response
+
+    @staticmethod
+    def _decode(response: requests.Response) -> str:
+        # 壽險公會頁面為 BIG5，回應標頭未註明 charset 時改用內容偵測
+        if "charset" not in response.headers.get("Content-Type", "").lower():
+            response.encoding = response.apparent_encoding
+        return response.text
+
+    def _load_form(self):
+        """載入查詢頁面 (DNS 失敗時重試)，回傳 (頁面網址, 解析結果)"""
+        for nav_attempt in range(self.DNS_MAX_RETRIES):
+            try:
+                response = self._get(self.URL)
+                break
+            except requests.ConnectionError as e:
+                print(f"    連線失敗，3秒後重試... ({nav_attempt + 1}/{self.DNS_MAX_RETRIES}): {e}")
+                if nav_attempt < self.DNS_MAX_RETRIES - 1:
+                    metrics.DNS_RETRIES.inc(engine=self.ENGINE)
+                    self.deadline.sleep(3)
+                    continue
+                print(f"    連續 {self.DNS_MAX_RETRIES} 次無法連接至壽險公會網站")
+                raise
+        return response.url, parse_page(self._decode(response))
+
+    def _get_captcha_text(self, page_url: str, page) -> str:
+        """下載並識別驗證碼圖片 (加上時間戳避免取得快取的舊圖)"""
+        src = page.images.get("captcha")
+        if not src:
+            raise RuntimeError("查詢頁面找不到 #captcha 驗證碼圖片")
+        captcha_url = urljoin(page_url, src)
+        separator = "&" if "?" in captcha_url else "?"
+        img_bytes = self._get(f"{captcha_url}{separator}_={int(time.time() * 1000)}").content
+        result = ocr_service.classify(img_bytes)
+        print(f"    識別驗證碼: {result}")
+        return result.lower().strip()
+
+    def _submit(self, page_url: str, form: dict, reg_no: str, captcha_text: str):
+        fields = dict(form["fields"])
+        fields[form["names_by_id"].get("iusr", "iusr")] = reg_no
+        fields["captchaAnswer"] = captcha_text
+        action = urljoin(page_url, form["action"] or page_url)
+        timeout = self.deadline.timeout(self.TIMEOUT)
+        if form["method"] == "post":
+            response = self.session.post(action, data=fields, timeout=timeout)
+        else:
+            response = self.session.get(action, params=fields, timeout=timeout)
+        response.raise_for_status()
+        return parse_page(self._decode(response))
+
+    def _phase(self, phase: str):
+        """查詢階段計時 (lia_query_phase_seconds)"""
+        return metrics.QUERY_PHASE_SECONDS.time(engine=self.ENGINE, phase=phase)
+
+    def perform_query(self, reg_no: str, max_retries=5, skip_screenshot=True, deadline: Deadline = None,
+                      lazy_screenshot: bool = False):
+        """
+        執行查詢動作 (含驗證碼重試機制)；本引擎不支援截圖，skip_screenshot / lazy_screenshot 僅為介面相容
+        deadline 的用法同 LIAQueryBot.perform_query
+        """
+        started = time.perf_counter()
+        status = "exception"
+        self.deadline = deadline or Deadline(LIAQueryBot.QUERY_DEADLINE_SECONDS)
+        try:
+            try:
+                result = self._run_query(reg_no, max_retries)
+            except DeadlineExceeded:
+                result = LIAQueryBot._deadline_result(self.deadline)
+            except requests.Timeout:
+                # 逾時是依剩餘預算縮短的結果時，同樣視為預算用完
+                if not self.deadline.expired():
+                    raise
+                result = LIAQueryBot._deadline_result(self.deadline)
+            status = result["status"]
+            return result
+        finally:
+            self.deadline = Deadline()
+            metrics.QUERY_SECONDS.observe(time.perf_counter() - started, engine=self.ENGINE, status=status)
+            metrics.QUERY_OUTCOMES.inc(engine=self.ENGINE, status=status)
+
+    def _run_query(self, reg_no: str, max_retries: int):
+        final_result = {
+            "success": False,
+            "status": "error",
+            "msg": "未完成查詢",
+            "screenshot_path": None,
+            "email_info": None
+        }
+
+        print(f"[HTTP] 前往查詢頁面: {reg_no}")
+        with self._phase("navigation"):
+            page_url, page = self._load_form()
+
+        attempt_ms = []
+        for attempt in range(1, max_retries + 1):
+            print(f"第 {attempt} 次嘗試...")
+            attempt_started = time.perf_counter()
+            form = find_query_form(page)
+            if form is None:
+                final_result.update({"status": "error", "msg": "查詢頁面找不到查詢表單"})
+                break
+
+            with self._phase("captcha"):
+                captcha_text = self._get_captcha_text(page_url, page)
+            with self._phase("submit"):
+                result_page = self._submit(page_url, form, reg_no, captcha_text)
+            attempt_seconds = time.perf_counter() - attempt_started
+            metrics.CAPTCHA_ATTEMPT_SECONDS.observe(attempt_seconds, engine=self.ENGINE)
+            attempt_ms.append(round(attempt_seconds * 1000, 1))
+            dialog_message = " ".join(result_page.alerts)
+            if dialog_message:
+                print(f"    頁面 alert: {dialog_message}")
+
+            if "驗證碼錯誤" in dialog_message:
+                print("    驗證碼錯誤，重新載入表單...")
+                metrics.CAPTCHA_ATTEMPTS.inc(engine=self.ENGINE, outcome="rejected")
+                with self._phase("captcha_refresh"):
+                    page_url, page = self._load_form()
+                continue
+
+            metrics.CAPTCHA_ATTEMPTS.inc(engine=self.ENGINE, outcome="accepted")
+            with self._phase("parse"):
+                final_result.update(LIAQueryBot._verdict_from_page(result_page))
+            break
+        else:
+            _mark_captcha_exhausted(final_result, max_retries)
+
+        final_result["attempt_ms"] = attempt_ms
+        final_result["email_info"] = LIAQueryBot._generate_email_template(final_result["status"])
+        return final_result
@@ -0,0 +1,191 @@
+import re
+from html.parser import HTMLParser
+
+
+class _LIAPageParser(HTMLParser):
+    """
+    單次掃描壽險公會頁面 HTML，收集查詢表單、驗證碼圖片、結果表格與 alert 訊息
+    """
+
+    # 送出表單時不帶入的 input 類型
+    SKIP_INPUT_TYPES = ("button", "submit", "image", "reset", "file")
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.forms = []
+        self.images = {}
+        self.result_rows = []
+        self.result_cells = []
+        self.alerts = []
+        self._form = None
+        self._select_name = None
+        self._select_value = None
+        self._textarea_name = None
+        self._in_script = False
+        self._script_text = []
+        self._table_depth = 0
+        self._row = None
+        self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {key: (value or "") for key, value in attrs}
+
+        if tag == "form":
+            self._form = {
+                "action": attrs.get("action", ""),
+                "method": attrs.get("method", "get").lower(),
+                "fields": {},
+                "names_by_id": {},
+            }
+            self.forms.append(self._form)
+        elif tag == "input" and self._form is not None:
+            input_type = attrs.get("type", "text").lower()
+            name = attrs.get("name")
+            if attrs.get("id") and name:
+                self._form["names_by_id"][attrs["id"]] = name
+            if not name or input_type in self.SKIP_INPUT_TYPES:
+                return
+            if input_type in ("checkbox", "radio") and "checked" not in attrs:
+                return
+            self._form["fields"][name] = attrs.get("value", "")
+        elif tag == "select" and self._form is not None:
+            self._select_name = attrs.get("name")
+            self._select_value = None
+        elif tag == "option" and self._select_name:
+            if self._select_value is None or "selected" in attrs:
+                self._select_value = attrs.get("value", "")
+        elif tag == "textarea" and self._form is not None:
+            self._textarea_name = attrs.get("name")
+            if self._textarea_name:
+                self._form["fields"][self._textarea_name] = ""
+        elif tag == "img" and attrs.get("id"):
+            self.images[attrs["id"]] = attrs.get("src", "")
+        elif tag == "script":
+            self._in_script = True
+            self._script_text = []
+        elif tag == "table":
+            if self._table_depth or "formStyle02" in attrs.get("class", "").split():
+                self._table_depth += 1
+        elif tag == "tr" and self._table_depth:
+            self._row = []
+        elif tag in ("td", "th") and self._row is not None:
+            self._row.append([])
+
+    def handle_endtag(self, tag):
+        if tag == "form":
+            self._form = None
+        elif tag == "select" and self._select_name:
+            if self._form is not None and self._select_value is not None:
+                self._form["fields"][self._select_name] = self._select_value
+            self._select_name = None
+        elif tag == "textarea":
+            self._textarea_name = None
+        elif tag == "script" and self._in_script:
+            self._in_script = False
+            script = "".join(self._script_text)
+            self.alerts.extend(re.findall(r'alert\(\s*["\'](.*?)["\']\s*\)', script))
+        elif tag == "table" and self._table_depth:
+            self._table_depth -= 1
+        elif tag == "tr" and self._row is not None:
+            cells = [" ".join(part for part in cell if part) for cell in self._row]
+            self.result_rows.append(" ".join(cell for cell in cells if cell))
+            self.result_cells.append(cells)
+            self._row = None
+
+    def handle_data(self, data):
+        if self._in_script:
+            self._script_text.append(data)
+            return
+        if self._textarea_name and self._form is not None:
+            self._form["fields"][self._textarea_name] += data
+        if self._row is not None:
+            if not self._row:
+                self._row.append([])
+            self._row[-1].append(data.strip())
+        self._text.append(data)
+
+    @property
+    def text(self) -> str:
+        return "".join(self._text)
+
+
+def parse_page(html: str) -> _LIAPageParser:
+    """解析頁面 HTML，回傳收集完成的 parser (forms / images / result_rows / result_cells / alerts / text)"""
+    parser = _LIAPageParser()
+    parser.feed(html)
+    parser.close()
+    return parser
+
+
+def find_query_form(page: _LIAPageParser):
+    """找出含有 #iusr 欄位的查詢表單，找不到回傳 None"""
+    for form in page.forms:
+        if "iusr" in form["names_by_id"] or "iusr" in form["fields"]:
+            return form
+    return None
+
+
+# 結果表格欄位名稱 (th / 第一格) 與紀錄欄位的對應，依序比對第一個包含關鍵字的欄位
+_RECORD_LABELS = (
+    ("name", "姓名"),
+    ("reg_no", "登錄證字號"),
+    ("reg_no", "登錄字號"),
+    ("company", "公司"),
+    ("first_registration_date", "初次登錄日期"),
+    ("registration_status", "登錄狀態"),
+)
+
+
+# 同一格內的「欄位名稱：值」(欄位名稱不含數字，避免誤拆時間等數值)
+_LABEL_VALUE = re.compile(r'^([^:：\d]{1,20})[:：](.*)$')
+
+
+def _split_label(cell: str):
+    """把「欄位名稱：值」形式的單一格拆成 (欄位名稱, 值)，不是這種形式時回傳 None"""
+    match = _LABEL_VALUE.match(cell)
+    if match is None or not any(keyword in match.group(1) for _, keyword in _RECORD_LABELS):
+        return None
+    return match.group(1).strip(), match.group(2).strip()
+
+
+def extract_result_record(page: _LIAPageParser):
+    """
+    把 formStyle02 結果表格整理成一筆紀錄，找不到結果表格回傳 None
+    回傳 {"name", "reg_no", "company", "first_registration_date",
+    "registration_status", "fields"}，fields 保留表格上所有「欄位名稱: 值」；
+    欄位不存在時為 None。「欄位名稱：值」寫在同一格時直接拆開；其餘各格
+    在同一列有多組欄位 (名稱、值交錯) 時逐組讀取，只有一格的列則整列當作值
+    (例如「初次登錄日期 114年5月13日」)。
+    表格排列不同時配對可能不正確，日期請再以 result_rows 整列文字確認
+    """
+    if not page.result_cells:
+        return None
+    fields = {}
+    for cells in page.result_cells:
+        plain = []
+        for cell in cells:
+            if not cell:
+                continue
+            pair = _split_label(cell)
+            if pair:
+                fields.setdefault(*pair)
+            else:
+                plain.append(cell)
+        if len(plain) == 1:
+            for _, keyword in _RECORD_LABELS:
+                if plain[0].startswith(keyword):
+                    fields.setdefault(keyword, plain[0][len(keyword):].strip(" :："))
+            continue
+        for label, value in zip(plain[0::2], plain[1::2]):
+            fields.setdefault(label.strip(" :："), value)
+
+    record = {key: None for key, _ in _RECORD_LABELS}
+    for key, keyword in _RECORD_LABELS:
+        if record[key] is not None:
+            continue
+        for label, value in fields.items():
+            if keyword in label:
+                record[key] = value
+                break
+    record["fields"] = fields
+    return record
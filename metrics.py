@@ -0,0 +1,208 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# 查詢各階段耗時多在數十毫秒到一分鐘之間
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=None) -> str:
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """只增不減的計數器 (Prometheus counter)"""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Gauge:
+    """可任意設定的數值 (Prometheus gauge)"""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """固定 bucket 的直方圖 (Prometheus histogram)，observe 只做一次二分搜尋與加法"""
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [各 bucket 個數 (最後一格為 +Inf), 總和]
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """以 with 區塊計時，例外時同樣記錄"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(counts), total) for key, (counts, total) in self._series.items())
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', f'{bound:g}'))} {cumulative}")
+            cumulative += counts[-1]
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', '+Inf'))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total:g}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """同名指標只註冊一次 (模組重複載入時回傳既有的指標)"""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames=()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames=()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# 查詢流程共用的指標
+QUERY_PHASE_SECONDS = histogram(
+    "lia_query_phase_seconds", "Duration of each phase of a LIA query", ("engine", "phase")
+)
+QUERY_SECONDS = histogram(
+    "lia_query_seconds", "End-to-end duration of a LIA query", ("engine", "status")
+)
+QUERY_OUTCOMES = counter(
+    "lia_query_outcomes_total", "LIA query results by status", ("engine", "status")
+)
+CAPTCHA_ATTEMPT_SECONDS = histogram(
+    "lia_captcha_attempt_seconds", "Duration of one CAPTCHA attempt (solve, submit, wait)", ("engine",)
+)
+CAPTCHA_ATTEMPTS = counter(
+    "lia_captcha_attempts_total", "CAPTCHA submissions by outcome", ("engine", "outcome")
+)
+DNS_RETRIES = counter(
+    "lia_dns_retries_total", "Navigation retries caused by DNS / connection failures", ("engine",)
+)
+BLOCKED_REQUESTS = counter(
+    "lia_blocked_requests_total", "Sub-resource requests aborted during LIA page loads", ("resource_type",)
+)
+RESULT_CACHE_LOOKUPS = counter(
+    "lia_result_cache_lookups_total", "Result cache lookups", ("result",)
+)
+BROWSER_POOL_WAIT_SECONDS = histogram(
+    "lia_browser_pool_wait_seconds", "Time spent waiting for a free browser lane"
+)
+BROWSER_POOL_REJECTED = counter(
+    "lia_browser_pool_rejected_total", "Queries rejected after waiting too long for a browser lane"
+)
+WARM_PAGE = counter(
+    "lia_warm_page_total", "Reuse of a query form left loaded by the previous query", ("result",)
+)
+PREARMED_CAPTCHA = counter(
+    "lia_prearmed_captcha_total", "Pre-solved CAPTCHA slots: hit/miss/expired at query time, stale when rejected, rearmed while idle", ("result",)
+)
+DEFERRED_SCREENSHOTS = counter(
+    "lia_deferred_screenshots_total", "Result pages held for on-demand screenshots: rendered, expired (nobody asked) or released early", ("result",)
+)
+TRELLO_QUEUE_EVENTS = counter(
+    "lia_trello_queue_events_total", "Trello card queue events (queued/duplicate/full on enqueue, done/retry/failed after processing)", ("result",)
+)
+UPSTREAM_FAILURES = counter(
+    "lia_upstream_failures_total", "Upstream call failures seen by the circuit breaker", ("circuit", "kind")
+)
+CIRCUIT_STATE = gauge(
+    "lia_upstream_circuit_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)", ("circuit",)
+)
+CIRCUIT_REJECTED = counter(
+    "lia_upstream_circuit_rejected_total", "Calls failed fast while the circuit was open", ("circuit",)
+)
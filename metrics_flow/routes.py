@@ -0,0 +1,18 @@
+from flask import Blueprint, Response, jsonify
+
+import metrics
+from lia_bot import upstream_status
+
+metrics_bp = Blueprint('metrics_flow', __name__)
+
+
+@metrics_bp.route('/metrics')
+def prometheus_metrics():
+    """Prometheus text exposition format"""
+    return Response(metrics.REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@metrics_bp.route('/health/upstream')
+def upstream_health():
+    """壽險公會站台斷路器狀態 (closed / half_open / open、最近失敗次數與種類)"""
+    return jsonify(upstream_status())
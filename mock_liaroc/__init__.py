@@ -0,0 +1 @@
+from .server import create_mock_app
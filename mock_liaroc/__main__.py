@@ -0,0 +1,38 @@
+"""
+啟動壽險公會模擬站台
+
+Usage:
+    python -m mock_liaroc --port 5055 --latency-ms 200 --jitter-ms 100 --error-rate 0.05
+    LIA_BASE_URL=http://127.0.0.1:5055 python app.py
+"""
+import argparse
+
+from .server import create_mock_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="壽險公會查詢頁面離線模擬站台")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--latency-ms", type=float, default=0, help="每個請求的固定延遲")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="每個請求額外的隨機延遲上限")
+    parser.add_argument("--error-rate", type=float, default=0, help="回傳 HTTP 503 的機率")
+    parser.add_argument("--captcha-error-rate", type=float, default=0, help="驗證碼正確仍回應錯誤的機率")
+    parser.add_argument("--lenient-captcha", action="store_true", help="不檢查驗證碼答案")
+    parser.add_argument("--seed", type=int, default=None, help="亂數種子 (固定後結果可重現)")
+    args = parser.parse_args()
+
+    app = create_mock_app(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        captcha_error_rate=args.captcha_error_rate,
+        strict_captcha=not args.lenient_captcha,
+        seed=args.seed,
+    )
+    print(f"模擬站台啟動: http://{args.host}:{args.port}  (LIA_BASE_URL=http://{args.host}:{args.port})")
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
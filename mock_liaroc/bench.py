@@ -0,0 +1,65 @@
+"""
+對模擬站台重複查詢並統計耗時 (p50 / p95)
+
+Usage:
+    python -m mock_liaroc --port 5055 --seed 1 &
+    python -m mock_liaroc.bench --base-url http://127.0.0.1:5055 --engine http -n 50
+"""
+import argparse
+import time
+
+DEFAULT_NUMBERS = ["0113403577", "0102204809", "0104300989", "0000000001"]
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def run_once(engine: str, base_url: str, reg_no: str, skip_screenshot: bool) -> dict:
+    if engine == "http":
+        from lia_http import LIAHttpQueryBot
+        bot = LIAHttpQueryBot(base_url=base_url)
+    else:
+        from lia_bot import LIAQueryBot
+        bot = LIAQueryBot(headless=True, base_url=base_url)
+    bot.start()
+    try:
+        return bot.perform_query(reg_no, skip_screenshot=skip_screenshot)
+    finally:
+        bot.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模擬站台查詢壓測")
+    parser.add_argument("--base-url", default="http://127.0.0.1:5055")
+    parser.add_argument("--engine", choices=("browser", "http"), default="browser")
+    parser.add_argument("-n", type=int, default=20, help="查詢次數")
+    parser.add_argument("--screenshot", action="store_true", help="瀏覽器引擎一併截圖")
+    args = parser.parse_args()
+
+    totals_ms, attempts_ms, statuses = [], [], {}
+    for i in range(args.n):
+        reg_no = DEFAULT_NUMBERS[i % len(DEFAULT_NUMBERS)]
+        started = time.perf_counter()
+        try:
+            result = run_once(args.engine, args.base_url, reg_no, not args.screenshot)
+            status = result["status"]
+            attempts_ms.extend(result.get("attempt_ms", []))
+        except Exception as e:
+            status = f"exception: {type(e).__name__}"
+        totals_ms.append((time.perf_counter() - started) * 1000)
+        statuses[status] = statuses.get(status, 0) + 1
+
+    print(f"\n引擎: {args.engine}  查詢次數: {args.n}")
+    print(f"單次查詢 p50={percentile(totals_ms, 50):.0f}ms  p95={percentile(totals_ms, 95):.0f}ms")
+    if attempts_ms:
+        print(f"單次驗證碼嘗試 p50={percentile(attempts_ms, 50):.0f}ms  p95={percentile(attempts_ms, 95):.0f}ms")
+    print(f"結果分布: {statuses}")
+
+
+if __name__ == "__main__":
+    main()
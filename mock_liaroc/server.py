@@ -0,0 +1,166 @@
+"""
+壽險公會查詢頁面的離線模擬站台
+
+重現 LIAQueryBot 依賴的頁面元素：含 #iusr / #captcha / #btn1 / #btn3 的查詢表單、
+答案已知的驗證碼圖片、「驗證碼錯誤」與「查無資料」alert，以及含「初次登錄日期」
+與「未辦理登錄」的 table.formStyle02 結果頁。可調整回應延遲並注入錯誤，
+供本機壓測與回歸測試使用 (LIA_BASE_URL=http://127.0.0.1:<port>)。
+"""
+import io
+import random
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask, Response, request, session
+from PIL import Image, ImageDraw, ImageFont
+
+SERVLET_PATH = "/lia-public/DIS/Servlet"
+CAPTCHA_CHARS = "2345678abcdefhkmnprstuvwxyz"
+
+
+def _roc_date(days_ago: int) -> str:
+    target = datetime.now() - timedelta(days=days_ago)
+    return f"{target.year - 1911}年 {target.month}月 {target.day}日"
+
+
+# 證號 -> 模擬資料 (與 README / test_verify_api.py 的範例證號對應)；其餘證號一律查無資料
+DEFAULT_RECORDS = {
+    "0113403577": {"name": "王小明", "company": "模擬人壽", "days_ago": 30, "registered": True},
+    "0102204809": {"name": "李大華", "company": "模擬人壽", "days_ago": 3650, "registered": True},
+    "0104300989": {"name": "陳美玲", "company": "", "days_ago": 2000, "registered": False},
+}
+
+FORM_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>業務員登錄資料查詢 (模擬)</title>
+<link rel="stylesheet" href="{servlet}/static/style.css"></head>
+<body>
+<form id="queryForm" name="queryForm" action="RD" method="post">
+  <input type="hidden" name="funcid" value="PGQ010">
+  <input type="hidden" name="progId" value="PGQ010S01">
+  <label>登錄證字號 <input type="text" id="iusr" name="iusr" value=""></label>
+  <label>驗證碼 <input type="text" name="captchaAnswer" value=""></label>
+  <img id="captcha" src="CaptchaImg?t={nonce}" alt="captcha">
+  <button type="button" id="btn3"
+          onclick="document.getElementById('captcha').src='CaptchaImg?t=' + Date.now();">刷新</button>
+  <button type="button" id="btn1" onclick="document.getElementById('queryForm').submit();">查詢</button>
+</form>
+{script}
+</body>
+</html>"""
+
+RESULT_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>業務員登錄資料查詢結果 (模擬)</title>
+<link rel="stylesheet" href="{servlet}/static/style.css"></head>
+<body>
+<table class="formStyle02">
+  <tr><th>姓名</th><td>{name}</td></tr>
+  <tr><th>登錄證字號</th><td>{reg_no}</td></tr>
+  <tr><th>所屬公司</th><td>{company}</td></tr>
+  <tr><th>初次登錄日期</th><td>{first_date}</td></tr>
+  <tr><th>登錄狀態</th><td>{status}</td></tr>
+</table>
+</body>
+</html>"""
+
+
+def _load_font(size: int):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 的 load_default 不支援 size
+        return ImageFont.load_default()
+
+
+def create_mock_app(latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0,
+                    captcha_error_rate: float = 0, strict_captcha: bool = True,
+                    records: dict = None, seed: int = None) -> Flask:
+    """
+    建立模擬站台
+    Args:
+        latency_ms / jitter_ms: 每個請求的固定延遲與隨機抖動
+        error_rate: 以此機率回傳 HTTP 503 (模擬維護中)
+        captcha_error_rate: 以此機率在驗證碼正確時仍回應「驗證碼錯誤」
+        strict_captcha: False 時不檢查驗證碼答案
+        records: 證號 -> 模擬資料，預設使用 DEFAULT_RECORDS
+        seed: 亂數種子，固定後延遲、錯誤注入與驗證碼內容皆可重現
+    """
+    app = Flask(__name__)
+    app.secret_key = secrets.token_hex(16)
+    records = DEFAULT_RECORDS if records is None else records
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+    font = _load_font(30)
+
+    def roll() -> float:
+        with rng_lock:
+            return rng.random()
+
+    @app.before_request
+    def inject_latency_and_errors():
+        if latency_ms or jitter_ms:
+            with rng_lock:
+                delay = latency_ms + rng.uniform(0, jitter_ms)
+            time.sleep(delay / 1000)
+        if error_rate and roll() < error_rate:
+            return Response("Service Unavailable (mock)", status=503)
+
+    def form_page(alert: str = None) -> Response:
+        script = f"<script>alert('{alert}');</script>" if alert else ""
+        html = FORM_TEMPLATE.format(servlet=SERVLET_PATH, nonce=int(time.time() * 1000), script=script)
+        return Response(html, content_type="text/html; charset=utf-8")
+
+    @app.route(f"{SERVLET_PATH}/RD", methods=["GET"])
+    def query_form():
+        return form_page()
+
+    @app.route(f"{SERVLET_PATH}/CaptchaImg")
+    def captcha_image():
+        with rng_lock:
+            answer = "".join(rng.choice(CAPTCHA_CHARS) for _ in range(4))
+            offsets = [rng.randint(-3, 3) for _ in answer]
+        session["captcha"] = answer
+        image = Image.new("RGB", (120, 44), "white")
+        draw = ImageDraw.Draw(image)
+        for index, (char, offset) in enumerate(zip(answer, offsets)):
+            draw.text((8 + index * 26, 4 + offset), char, fill=(40, 40, 40), font=font)
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        response = Response(buffer.getvalue(), content_type="image/png")
+        response.headers["Cache-Control"] = "no-store"
+        response.headers["X-Captcha-Answer"] = answer
+        return response
+
+    @app.route(f"{SERVLET_PATH}/RD", methods=["POST"])
+    def submit_query():
+        answer = session.pop("captcha", None)
+        submitted = request.form.get("captchaAnswer", "").strip().lower()
+        if strict_captcha and (not answer or submitted != answer):
+            return form_page("驗證碼錯誤")
+        if captcha_error_rate and roll() < captcha_error_rate:
+            return form_page("驗證碼錯誤")
+
+        reg_no = request.form.get("iusr", "").strip()
+        record = records.get(reg_no)
+        if record is None:
+            return form_page("查無資料")
+
+        html = RESULT_TEMPLATE.format(
+            servlet=SERVLET_PATH,
+            name=record["name"],
+            reg_no=reg_no,
+            company=record["company"] or "-",
+            first_date=_roc_date(record["days_ago"]),
+            status="登錄中" if record["registered"] else "未辦理登錄",
+        )
+        return Response(html, content_type="text/html; charset=utf-8")
+
+    @app.route(f"{SERVLET_PATH}/static/style.css")
+    def stylesheet():
+        css = "body { font-family: sans-serif; } table.formStyle02 td, table.formStyle02 th { padding: 4px 12px; }"
+        return Response(css, content_type="text/css")
+
+    return app
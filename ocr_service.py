@@ -0,0 +1,67 @@
+import io
+import threading
+import time
+
+import ddddocr
+import onnxruntime
+from PIL import Image
+
+_ocr = None
+_ocr_lock = threading.Lock()
+
+
+def get_ocr() -> ddddocr.DdddOcr:
+    """
+    取得程序層級共用的 ddddocr 實例 (第一次呼叫時載入 ONNX 模型，之後共用)
+    """
+    global _ocr
+    if _ocr is None:
+        with _ocr_lock:
+            if _ocr is None:
+                print("初始化 OCR 引擎...")
+                ocr = ddddocr.DdddOcr(show_ad=False)
+                _use_single_thread_session(ocr)
+                _ocr = ocr
+    return _ocr
+
+
+def _use_single_thread_session(ocr: ddddocr.DdddOcr):
+    """
+    換成單執行緒的 ONNX session
+
+    ONNX Runtime 預設會建立 intra-op 執行緒池，gunicorn --preload 在 master
+    載入後 fork 出的 worker 沒有這些執行緒，推論會卡住。驗證碼模型很小，
+    單執行緒推論只需數毫秒，換來 session 可以安全地在 fork 後以
+    copy-on-write 共用。ddddocr 1.5.6 沒有提供 SessionOptions 參數，只能
+    替換其私有屬性；版本不符找不到屬性時維持原狀。
+    """
+    session = getattr(ocr, "_DdddOcr__ort_session", None)
+    graph_path = getattr(ocr, "_DdddOcr__graph_path", None)
+    if session is None or graph_path is None:
+        return
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = 1
+    options.inter_op_num_threads = 1
+    ocr._DdddOcr__ort_session = onnxruntime.InferenceSession(
+        graph_path, sess_options=options, providers=session.get_providers()
+    )
+
+
+def classify(img_bytes: bytes) -> str:
+    """識別驗證碼圖片 (ONNX Runtime 的 session.run 可多執行緒同時呼叫)"""
+    return get_ocr().classification(img_bytes)
+
+
+def warm_up():
+    """
+    啟動時預先載入模型並執行一次推論，避免第一個查詢負擔 session 初始化成本
+    失敗只記錄訊息，不影響服務啟動 (之後的查詢仍會延遲載入)
+    """
+    started = time.perf_counter()
+    try:
+        buffer = io.BytesIO()
+        Image.new("RGB", (120, 40), "white").save(buffer, format="PNG")
+        classify(buffer.getvalue())
+        print(f"OCR 引擎預熱完成 ({(time.perf_counter() - started) * 1000:.0f}ms)")
+    except Exception as e:
+        print(f"OCR 引擎預熱失敗: {e}")
@@ -0,0 +1,59 @@
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    以登錄證字號為 key 的查詢結果快取 (TTL + LRU)
+
+    只負責存放與淘汰，結果內容 (例如依日期重新判斷資格) 由呼叫端處理。
+    取出的是深拷貝，呼叫端可以自由修改。
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 21600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """取得未過期的快取結果，不存在或已過期回傳 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return copy.deepcopy(value)
+
+    def put(self, key: str, value: dict):
+        """寫入快取，超過 max_entries 時淘汰最久未使用的項目"""
+        if self.max_entries <= 0 or self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def create_result_cache() -> ResultCache:
+    """依環境變數建立快取 (RESULT_CACHE_TTL_SECONDS 設為 0 即停用)"""
+    return ResultCache(
+        max_entries=int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "1024")),
+        ttl_seconds=float(os.environ.get("RESULT_CACHE_TTL_SECONDS", "21600")),
+    )
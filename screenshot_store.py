@@ -0,0 +1,138 @@
+import hashlib
+import io
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image  # Pillow 由 ddddocr 一併安裝
+
+# 截圖輸出格式：webp (預設) / jpeg / png
+SCREENSHOT_FORMAT = os.environ.get("SCREENSHOT_FORMAT", "webp").lower()
+# 壓縮後的大小上限 (bytes)，超過時逐步降低品質，仍超過則縮小尺寸
+SCREENSHOT_MAX_BYTES = int(os.environ.get("SCREENSHOT_MAX_BYTES", "120000"))
+SCREENSHOT_QUALITY = int(os.environ.get("SCREENSHOT_QUALITY", "80"))
+MIN_QUALITY = 40
+
+FORMATS = {
+    "webp": ("WEBP", "image/webp", ".webp"),
+    "jpeg": ("JPEG", "image/jpeg", ".jpg"),
+    "png": ("PNG", "image/png", ".png"),
+}
+
+
+def encode_screenshot(png_bytes: bytes, fmt: str = SCREENSHOT_FORMAT, max_bytes: int = SCREENSHOT_MAX_BYTES):
+    """
+    把 Playwright 的 PNG 截圖壓縮成 fmt 格式，回傳 (bytes, mimetype, 副檔名)
+
+    從 SCREENSHOT_QUALITY 開始每次降低 10 直到不超過 max_bytes，降到
+    MIN_QUALITY 仍超過時改為縮小尺寸。png 不壓縮；壓縮結果沒有比原本的
+    PNG 小 (且 PNG 未超過上限) 時同樣回傳原本的 PNG。
+    """
+    pil_format, mimetype, extension = FORMATS.get(fmt, FORMATS["webp"])
+    if pil_format == "PNG":
+        return png_bytes, mimetype, extension
+
+    image = Image.open(io.BytesIO(png_bytes)).convert("RGB")
+    quality = SCREENSHOT_QUALITY
+    while True:
+        buffer = io.BytesIO()
+        image.save(buffer, pil_format, quality=quality)
+        data = buffer.getvalue()
+        if len(png_bytes) <= min(len(data), max_bytes):
+            # 純文字頁面 PNG 有時反而較小，直接沿用原圖
+            print(f"    截圖壓縮: {pil_format} ({len(data) // 1024} KB) 未小於 PNG ({len(png_bytes) // 1024} KB)，保留 PNG")
+            return png_bytes, FORMATS["png"][1], FORMATS["png"][2]
+        if len(data) <= max_bytes:
+            break
+        if quality > MIN_QUALITY:
+            quality = max(MIN_QUALITY, quality - 10)
+        elif min(image.size) > 200:
+            image = image.resize((image.width * 3 // 4, image.height * 3 // 4), Image.LANCZOS)
+        else:
+            break  # 已無法再縮小，接受超過上限的結果
+    print(f"    截圖壓縮: PNG {len(png_bytes) // 1024} KB → {pil_format} {len(data) // 1024} KB (quality={quality}, {image.width}x{image.height})")
+    return data, mimetype, extension
+
+
+class ScreenshotStore:
+    """
+    截圖暫存區 (TTL + LRU)
+
+    put() 以內容的 SHA-256 作為 ID (同一張圖只存一份)；put_pending() 存入
+    尚未截圖的 PendingScreenshot，第一次 get() 時才截圖並換成圖片內容。
+    圖片由獨立端點 (GET /screenshots/<id>) 提供並以內容雜湊作為 ETag，
+    JSON 回應只帶網址。
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, data: bytes, mimetype: str, filename: str) -> str:
+        """存入截圖，回傳 ID；超過 max_entries 時淘汰最久未使用的截圖"""
+        screenshot_id = _etag(data)
+        self._store(screenshot_id, (data, mimetype, filename))
+        return screenshot_id
+
+    def put_pending(self, pending) -> str:
+        """存入延後截圖 (lia_bot.PendingScreenshot)，回傳 ID"""
+        screenshot_id = secrets.token_hex(16)
+        self._store(screenshot_id, pending)
+        return screenshot_id
+
+    def get(self, screenshot_id: str, timeout: float = 30):
+        """
+        回傳 (bytes, mimetype, filename, etag)，不存在或已過期回傳 None
+        延後截圖在此時截取 (最多等 timeout 秒)；結果頁面已釋放時同樣回傳 None
+        """
+        with self._lock:
+            entry = self._entries.get(screenshot_id)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[screenshot_id]
+                return None
+            self._entries.move_to_end(screenshot_id)
+        if not isinstance(value, tuple):
+            try:
+                value = value.get(timeout)
+            except Exception as e:
+                print(f"    延後截圖無法取得 ({screenshot_id}): {e}")
+                self._remove(screenshot_id, entry)
+                return None
+            with self._lock:
+                if self._entries.get(screenshot_id) is entry:
+                    self._entries[screenshot_id] = (expires_at, value)
+        data, mimetype, filename = value
+        return data, mimetype, filename, _etag(data)
+
+    def _store(self, screenshot_id: str, value):
+        with self._lock:
+            self._entries[screenshot_id] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(screenshot_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _remove(self, screenshot_id: str, entry):
+        with self._lock:
+            if self._entries.get(screenshot_id) is entry:
+                del self._entries[screenshot_id]
+
+
+def _etag(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def create_screenshot_store() -> ScreenshotStore:
+    return ScreenshotStore(
+        max_entries=int(os.environ.get("SCREENSHOT_STORE_MAX_ENTRIES", "256")),
+        ttl_seconds=float(os.environ.get("SCREENSHOT_STORE_TTL_SECONDS", "3600")),
+    )
+
+
+screenshots = create_screenshot_store()
@@ -0,0 +1,67 @@
+import copy
+import threading
+
+
+class _Call:
+    """一次進行中的呼叫，等待者共用其結果或例外"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    合併相同 key 的同時呼叫 (single-flight)
+
+    第一個呼叫者 (leader) 實際執行 fn，其餘同 key 的呼叫者等待同一次執行的
+    結果；fn 拋出的例外會同樣拋給所有等待者。結束後 key 立即移除，之後的
+    呼叫會重新執行。
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout: float = None, join=()):
+        """
+        執行 fn() 或等待相同 key 進行中的呼叫
+        join 為結果同樣可用的其他 key，其中有進行中的呼叫時直接等待它 (查找與登記
+        在同一把鎖內完成，不會在兩者之間成為 leader)
+        等待者超過 timeout 秒仍未取得結果時拋出 TimeoutError (leader 不受影響)
+        """
+        with self._lock:
+            call = next((self._calls[k] for k in (key, *join) if k in self._calls), None)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+            else:
+                call.waiters += 1
+                leader = False
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            return call.result
+
+        print(f"    合併進行中的查詢: {key} (共 {call.waiters + 1} 個呼叫者)")
+        if not call.done.wait(timeout):
+            raise TimeoutError(f"等待進行中的查詢逾時: {key}")
+        if call.error is not None:
+            raise call.error
+        # 每個等待者拿到獨立的副本，避免互相修改
+        return copy.deepcopy(call.result)
+
+    def in_flight(self, key) -> bool:
+        with self._lock:
+            return key in self._calls
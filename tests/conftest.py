@@ -0,0 +1,13 @@
+import sys
+from pathlib import Path
+
+# 專案模組都在根目錄 (lia_bot.py、deadline.py ...)
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+
+def load_fixture(name: str) -> str:
+    return (FIXTURES / name).read_text(encoding="utf-8")
@@ -0,0 +1,100 @@
+import json
+import threading
+
+import pytest
+from flask import Flask
+
+from api_flow import api_bp, routes
+
+URL = "/api/verify-agent-license/batch"
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+    lock = threading.Lock()
+
+    def verify(reg_no):
+        with lock:
+            calls.append(reg_no)
+        if reg_no == "0102204809":
+            return {"status_code": 1, "message": "Failed: Not a new agent (seniority > 1 year)."}
+        return {"status_code": 0, "message": "Verification passed: New agent identified."}
+
+    monkeypatch.setattr(routes, "_verify", verify)
+    return calls
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    app.register_blueprint(api_bp)
+    return app.test_client()
+
+
+def _lines(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_streams_one_line_per_input(client, calls):
+    response = client.post(URL, json={"license_numbers": ["0113403577", "102204809", "A123456789"]})
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = _lines(response)
+    # 格式無效的證號最先回傳
+    assert lines[0] == {
+        "license_number": "A123456789", "normalized_license_number": None,
+        "status_code": 2, "message": "Failed: Invalid ID alphanumeric format.",
+    }
+    by_input = {line["license_number"]: line for line in lines[1:]}
+    assert by_input["0113403577"]["status_code"] == 0
+    assert by_input["102204809"]["normalized_license_number"] == "0102204809"
+    assert by_input["102204809"]["status_code"] == 1
+    assert sorted(calls) == ["0102204809", "0113403577"]
+
+
+def test_duplicates_after_padding_are_queried_once(client, calls):
+    response = client.post(URL, json={"license_numbers": ["13403577", "0013403577", "13403577"]})
+    lines = _lines(response)
+    assert calls == ["0013403577"]
+    assert sorted(line["license_number"] for line in lines) == ["0013403577", "13403577"]
+    assert {line["normalized_license_number"] for line in lines} == {"0013403577"}
+
+
+def test_non_string_inputs_are_echoed_as_invalid(client, calls):
+    lines = _lines(client.post(URL, json={"license_numbers": [113403577, None]}))
+    assert [line["license_number"] for line in lines] == [113403577, None]
+    assert all(line["status_code"] == 2 for line in lines)
+    assert calls == []
+
+
+@pytest.mark.parametrize("body", [{}, {"license_numbers": []}, {"license_numbers": "0113403577"}, []])
+def test_rejects_missing_or_empty_list(client, calls, body):
+    assert client.post(URL, json=body).status_code == 400
+
+
+def test_rejects_oversized_batch(client, calls, monkeypatch):
+    monkeypatch.setattr(routes, "BATCH_MAX_SIZE", 2)
+    response = client.post(URL, json={"license_numbers": ["0113403577", "0102204809", "0104300989"]})
+    assert response.status_code == 400
+    assert calls == []
+
+
+def test_lines_are_sent_as_each_query_finishes(client, monkeypatch):
+    release = threading.Event()
+
+    def verify(reg_no):
+        if reg_no == "0102204809":
+            release.wait(5)
+        return {"status_code": 0, "message": "ok"}
+
+    monkeypatch.setattr(routes, "_verify", verify)
+    response = client.post(URL, json={"license_numbers": ["0113403577", "0102204809"]}, buffered=False)
+    chunks = iter(response.response)
+    # 慢的查詢尚未完成前，先完成的那筆已經送出
+    first = json.loads(next(chunks))
+    assert first["license_number"] == "0113403577"
+    release.set()
+    second = json.loads(next(chunks))
+    assert second["license_number"] == "0102204809"
+    response.close()
@@ -0,0 +1,144 @@
+import socket
+import time
+
+import pytest
+from flask import Flask
+
+from api_flow import api_bp, jobs, routes
+from api_flow.jobs import JobManager, is_valid_callback_url
+
+
+def _resolve_to(monkeypatch, *addresses):
+    """讓 getaddrinfo 把任何主機解析成指定位址"""
+    def getaddrinfo(host, port, *args, **kwargs):
+        return [
+            (socket.AF_INET6 if ":" in address else socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, port))
+            for address in addresses
+        ]
+    monkeypatch.setattr(jobs.socket, "getaddrinfo", getaddrinfo)
+
+
+@pytest.fixture(autouse=True)
+def no_allowlist(monkeypatch):
+    monkeypatch.setattr(jobs, "CALLBACK_ALLOWED_HOSTS", set())
+
+
+@pytest.mark.parametrize("address", [
+    "127.0.0.1",
+    "10.0.0.5",
+    "172.16.3.4",
+    "192.168.1.10",
+    "169.254.169.254",
+    "100.64.0.1",
+    "0.0.0.0",
+    "::1",
+    "fd00::1",
+    "fe80::1%eth0",
+    "::ffff:127.0.0.1",
+])
+def test_internal_addresses_are_rejected(monkeypatch, address):
+    _resolve_to(monkeypatch, address)
+    assert not is_valid_callback_url("https://hooks.example.com/lia")
+
+
+def test_public_address_is_accepted(monkeypatch):
+    _resolve_to(monkeypatch, "93.184.216.34")
+    assert is_valid_callback_url("https://hooks.example.com/lia")
+
+
+def test_any_internal_address_rejects_host(monkeypatch):
+    """DNS 同時回傳公開與內部位址時拒絕 (連線可能落在內部位址)"""
+    _resolve_to(monkeypatch, "93.184.216.34", "10.0.0.5")
+    assert not is_valid_callback_url("https://hooks.example.com/lia")
+
+
+@pytest.mark.parametrize("url", [
+    "ftp://hooks.example.com/lia",
+    "file:///etc/passwd",
+    "https:///no-host",
+    "https://hooks.example.com:99999/lia",
+    "not a url",
+])
+def test_malformed_urls_are_rejected(monkeypatch, url):
+    _resolve_to(monkeypatch, "93.184.216.34")
+    assert not is_valid_callback_url(url)
+
+
+def test_unresolvable_host_is_rejected(monkeypatch):
+    def getaddrinfo(*args, **kwargs):
+        raise socket.gaierror("Name or service not known")
+    monkeypatch.setattr(jobs.socket, "getaddrinfo", getaddrinfo)
+    assert not is_valid_callback_url("https://missing.example.com/lia")
+
+
+def test_allowlist_replaces_dns_check(monkeypatch):
+    monkeypatch.setattr(jobs, "CALLBACK_ALLOWED_HOSTS", {"hooks.internal"})
+    _resolve_to(monkeypatch, "10.0.0.5")
+    assert is_valid_callback_url("http://HOOKS.internal/lia")
+    assert not is_valid_callback_url("https://hooks.example.com/lia")
+
+
+class _Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def test_notify_does_not_follow_redirects(monkeypatch):
+    _resolve_to(monkeypatch, "93.184.216.34")
+    posts = []
+    monkeypatch.setattr(jobs.requests, "post", lambda url, **kwargs: posts.append(kwargs) or _Response(302))
+    JobManager(workers=1)._notify("https://hooks.example.com/lia", {"job_id": "x"})
+    assert len(posts) == 1
+    assert posts[0]["allow_redirects"] is False
+
+
+def test_notify_rechecks_address_before_retry(monkeypatch):
+    """第一次送出失敗後 DNS 改指向內部位址 (DNS rebinding)，重試時不再送出"""
+    _resolve_to(monkeypatch, "93.184.216.34")
+    posts = []
+
+    def post(url, **kwargs):
+        posts.append(url)
+        _resolve_to(monkeypatch, "127.0.0.1")
+        return _Response(503)
+
+    monkeypatch.setattr(jobs.requests, "post", post)
+    monkeypatch.setattr(jobs.time, "sleep", lambda seconds: None)
+    JobManager(workers=1)._notify("https://hooks.example.com/lia", {"job_id": "x"})
+    assert posts == ["https://hooks.example.com/lia"]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    app = Flask(__name__)
+    app.register_blueprint(api_bp)
+    monkeypatch.setattr(routes, "job_manager", JobManager(workers=1))
+    monkeypatch.setattr(routes, "_verify", lambda reg_no: {"status_code": 0, "message": "ok"})
+    return app.test_client()
+
+
+def test_job_echoes_original_and_normalized_number(client):
+    response = client.post("/api/verify-agent-license/jobs", json={"license_number": "13403577"})
+    assert response.status_code == 202
+    job = response.get_json()
+    assert job["license_number"] == "13403577"
+    assert job["normalized_license_number"] == "0013403577"
+
+    for _ in range(100):
+        job = client.get(f"/api/verify-agent-license/jobs/{job['job_id']}").get_json()
+        if job["state"] == "done":
+            break
+        time.sleep(0.01)
+    assert job["state"] == "done"
+    assert job["license_number"] == "13403577"
+    assert job["normalized_license_number"] == "0013403577"
+    assert job["status_code"] == 0
+
+
+def test_job_rejects_internal_callback(client, monkeypatch):
+    _resolve_to(monkeypatch, "169.254.169.254")
+    response = client.post(
+        "/api/verify-agent-license/jobs",
+        json={"license_number": "0113403577", "callback_url": "http://metadata.example.com/"},
+    )
+    assert response.status_code == 400
@@ -0,0 +1,111 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+from contextlib import closing
+
+import pytest
+
+from trello_flow import backfill, work_queue
+from trello_flow.routes import TRIGGER_KEYWORD
+from trello_flow.work_queue import CardWorkQueue
+
+CARDS = [
+    {"id": "webhook-pending", "name": f"{TRIGGER_KEYWORD} A", "desc": "", "shortLink": "a"},
+    {"id": "webhook-failed", "name": f"{TRIGGER_KEYWORD} B", "desc": "", "shortLink": "b"},
+    {"id": "missed", "name": f"{TRIGGER_KEYWORD} C", "desc": "desc", "shortLink": "c"},
+    {"id": "done", "name": f"{TRIGGER_KEYWORD} D", "desc": "", "shortLink": "d"},
+    {"id": "other", "name": "其他卡片", "desc": "", "shortLink": "e"},
+]
+COMMENTS = {"done": ["查詢完成：0113403577"]}
+
+
+def _set_state(db_path, card_id, state, claimed_by=None):
+    with closing(sqlite3.connect(db_path, isolation_level=None)) as conn:
+        conn.execute(
+            "UPDATE card_jobs SET state = ?, attempts = 1, claimed_by = ? WHERE card_id = ?", (state, claimed_by, card_id)
+        )
+
+
+def _other_process():
+    """另一個仍在執行的程序，代表同時執行的 Webhook 服務"""
+    process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    return process, f"{process.pid}:{work_queue._process_start_time(process.pid)}"
+
+
+def test_backfill_skips_cards_already_in_webhook_queue(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "queue.db")
+    webhook = CardWorkQueue(lambda card_id, card_url: None, db_path=db_path, workers=0)
+    webhook.enqueue("webhook-pending", "https://trello.com/c/a")
+    webhook.enqueue("webhook-failed", "https://trello.com/c/b")
+    _set_state(db_path, "webhook-failed", "failed")
+    server, owner = _other_process()
+    _set_state(db_path, "webhook-pending", "running", owner)
+
+    processed = []
+    monkeypatch.setattr(backfill.trello_utils, "list_board_cards", lambda board_id: CARDS)
+    monkeypatch.setattr(backfill.trello_utils, "list_board_comments", lambda board_id: COMMENTS)
+    monkeypatch.setattr(
+        backfill, "process_trello_card",
+        lambda card_id, card_url, description: processed.append((card_id, description)),
+    )
+    monkeypatch.setattr(sys, "argv", ["backfill", "--board", "b1", "--db", db_path, "--workers", "1"])
+
+    # Webhook 服務處理中的卡片完成後，補處理工具才會結束
+    finished = threading.Timer(0.3, lambda: _set_state(db_path, "webhook-pending", "done", owner))
+    finished.start()
+    try:
+        backfill.main()
+    finally:
+        finished.cancel()
+        server.kill()
+        server.wait()
+
+    assert processed == [("missed", "desc")]
+    assert CardWorkQueue(None, db_path=db_path).stats() == {"done": 2, "failed": 1}
+
+
+def test_start_leaves_cards_of_live_processes_running(tmp_path):
+    db_path = str(tmp_path / "queue.db")
+    queue = CardWorkQueue(lambda card_id, card_url: None, db_path=db_path, workers=0)
+    for card_id in ("live", "dead", "legacy"):
+        queue.enqueue(card_id, f"https://trello.com/c/{card_id}")
+    server, owner = _other_process()
+    exited = subprocess.Popen(["true"])
+    exited.wait()
+    _set_state(db_path, "live", "running", owner)
+    _set_state(db_path, "dead", "running", f"{exited.pid}:{work_queue._process_start_time(os.getpid())}")
+    _set_state(db_path, "legacy", "running", None)
+    try:
+        # 模擬另一個程序 (例如補處理工具) 啟動
+        queue._pid = None
+        queue.start()
+        with closing(sqlite3.connect(db_path)) as conn:
+            states = dict(conn.execute("SELECT card_id, state FROM card_jobs"))
+    finally:
+        server.kill()
+        server.wait()
+    assert states == {"live": "running", "dead": "pending", "legacy": "pending"}
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="需要 /proc 的程序啟動時間")
+def test_reused_pid_is_not_treated_as_owner():
+    owner = f"{os.getppid()}:0"
+    assert not work_queue._owner_alive(owner)
+    assert work_queue._owner_alive(f"{os.getppid()}:{work_queue._process_start_time(os.getppid())}")
+
+
+def test_old_database_gets_new_columns(tmp_path):
+    db_path = str(tmp_path / "queue.db")
+    with closing(sqlite3.connect(db_path, isolation_level=None)) as conn:
+        conn.execute(
+            "CREATE TABLE card_jobs (card_id TEXT PRIMARY KEY, card_url TEXT NOT NULL, state TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, updated_at REAL NOT NULL, last_error TEXT)"
+        )
+        conn.execute("INSERT INTO card_jobs VALUES ('a', 'https://trello.com/c/a', 'running', 1, 0, 0, NULL)")
+    queue = CardWorkQueue(lambda card_id, card_url: None, db_path=db_path, workers=0)
+    queue.start()
+    assert queue.stats() == {"pending": 1}
+    with queue._lock:
+        assert queue._claim() == ("a", "https://trello.com/c/a", 2)
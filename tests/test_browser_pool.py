@@ -0,0 +1,148 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import lia_bot
+from lia_bot import BrowserPool
+
+
+def _write(path, text):
+    path.write_text(text)
+    return str(path)
+
+
+@pytest.fixture
+def sizing(monkeypatch):
+    monkeypatch.delenv("BROWSER_CONCURRENCY", raising=False)
+    monkeypatch.setenv("BROWSER_CONTEXT_MB", "150")
+    monkeypatch.setenv("BROWSER_RESERVED_MB", "300")
+    monkeypatch.setattr(lia_bot, "_mem_available_mb", lambda: 8192)
+
+
+def test_cgroup_v2_limit(tmp_path, monkeypatch, sizing):
+    limit = _write(tmp_path / "memory.max", f"{512 * 1024 * 1024}\n")
+    usage = _write(tmp_path / "memory.current", "0\n")
+    monkeypatch.setattr(lia_bot, "CGROUP_MEMORY_FILES", ((limit, usage),))
+    assert lia_bot._cgroup_available_mb() == 512
+    assert lia_bot._default_concurrency() == 1
+
+
+def test_cgroup_usage_is_subtracted(tmp_path, monkeypatch, sizing):
+    limit = _write(tmp_path / "memory.max", f"{1024 * 1024 * 1024}\n")
+    usage = _write(tmp_path / "memory.current", f"{300 * 1024 * 1024}\n")
+    monkeypatch.setattr(lia_bot, "CGROUP_MEMORY_FILES", ((limit, usage),))
+    assert lia_bot._cgroup_available_mb() == 724
+    assert lia_bot._default_concurrency() == 2
+
+
+def test_unlimited_cgroup_uses_mem_available(tmp_path, monkeypatch, sizing):
+    v2 = (_write(tmp_path / "memory.max", "max\n"), _write(tmp_path / "memory.current", "0\n"))
+    v1 = (_write(tmp_path / "limit_in_bytes", f"{(1 << 63) - 4096}\n"), _write(tmp_path / "usage_in_bytes", "0\n"))
+    for files in (v2, v1):
+        monkeypatch.setattr(lia_bot, "CGROUP_MEMORY_FILES", (files,))
+        assert lia_bot._cgroup_available_mb() is None
+        assert lia_bot._default_concurrency() == 4
+
+
+def test_falls_back_to_cgroup_v1(tmp_path, monkeypatch, sizing):
+    missing = (str(tmp_path / "missing.max"), str(tmp_path / "missing.current"))
+    v1 = (_write(tmp_path / "limit_in_bytes", f"{600 * 1024 * 1024}\n"), _write(tmp_path / "usage_in_bytes", "0\n"))
+    monkeypatch.setattr(lia_bot, "CGROUP_MEMORY_FILES", (missing, v1))
+    assert lia_bot._default_concurrency() == 2
+
+
+def test_nothing_readable_means_one_lane(tmp_path, monkeypatch, sizing):
+    monkeypatch.setattr(lia_bot, "_mem_available_mb", lambda: 0)
+    monkeypatch.setattr(lia_bot, "CGROUP_MEMORY_FILES", ((str(tmp_path / "a"), str(tmp_path / "b")),))
+    assert lia_bot._default_concurrency() == 1
+
+
+def test_configured_concurrency_wins(monkeypatch):
+    monkeypatch.setenv("BROWSER_CONCURRENCY", "3")
+    assert lia_bot._default_concurrency() == 3
+
+
+def _fake_browser(pool, tmp_path):
+    """以 sleep 代替 Chromium，依 _launch_browser 的方式啟動"""
+    profile = tmp_path / f"{lia_bot.PROFILE_PREFIX}{os.getpid()}-test"
+    profile.mkdir()
+    pool._pid = os.getpid()
+    pool._user_data_dir = str(profile)
+    pool._process = subprocess.Popen(
+        ["sleep", "60"], start_new_session=True, preexec_fn=lia_bot._kill_with_parent(os.getpid())
+    )
+    return pool._process, profile
+
+
+def _dead(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            return any(line.startswith("State:") and "Z" in line for line in f)
+    except FileNotFoundError:
+        return True
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="需要 Linux process group 與 /proc")
+def test_stop_browser_kills_group_and_is_idempotent(tmp_path):
+    pool = BrowserPool(size=1)
+    process, profile = _fake_browser(pool, tmp_path)
+    pool._stop_browser()
+    assert process.poll() is not None
+    assert not profile.exists()
+    pool._stop_browser()
+    assert pool._process is None
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="需要 Linux process group 與 /proc")
+def test_stop_at_exit_ignores_other_processes(tmp_path):
+    pool = BrowserPool(size=1)
+    process, profile = _fake_browser(pool, tmp_path)
+    pool._pid = os.getpid() + 1  # 例如 fork 前的父程序
+    pool._stop_at_exit()
+    assert process.poll() is None
+    pool._pid = os.getpid()
+    pool._stop_at_exit()
+    assert process.poll() is not None
+    assert not profile.exists()
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="需要 PR_SET_PDEATHSIG")
+def test_browser_dies_with_killed_worker():
+    script = (
+        "import os, subprocess, sys, time\n"
+        "import lia_bot\n"
+        "child = subprocess.Popen(['sleep', '60'], start_new_session=True,"
+        " preexec_fn=lia_bot._kill_with_parent(os.getpid()))\n"
+        "print(child.pid, flush=True)\n"
+        "time.sleep(60)\n"
+    )
+    worker = subprocess.Popen(
+        [sys.executable, "-c", script], stdout=subprocess.PIPE, text=True,
+        cwd=os.path.dirname(lia_bot.__file__),
+    )
+    child_pid = int(worker.stdout.readline())
+    worker.kill()
+    worker.wait()
+    for _ in range(50):
+        if _dead(child_pid):
+            break
+        time.sleep(0.1)
+    assert _dead(child_pid)
+
+
+def test_stale_profiles_of_dead_processes_are_removed(tmp_path, monkeypatch):
+    monkeypatch.setattr(lia_bot.tempfile, "gettempdir", lambda: str(tmp_path))
+    dead = subprocess.Popen(["true"])
+    dead.wait()
+    stale = tmp_path / f"{lia_bot.PROFILE_PREFIX}{dead.pid}-abc"
+    alive = tmp_path / f"{lia_bot.PROFILE_PREFIX}{os.getpid()}-abc"
+    unrelated = tmp_path / f"{lia_bot.PROFILE_PREFIX}notapid"
+    for path in (stale, alive, unrelated):
+        path.mkdir()
+    lia_bot._remove_stale_profiles()
+    assert not stale.exists()
+    assert alive.exists()
+    assert unrelated.exists()
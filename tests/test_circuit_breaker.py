@@ -0,0 +1,150 @@
+import threading
+import time
+
+import pytest
+
+import lia_bot
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from conftest import load_fixture
+from deadline import Deadline
+from lia_http import LIAHttpQueryBot
+from lia_parser import parse_page
+
+
+def _tripped(probe=None, open_seconds=0.05):
+    breaker = CircuitBreaker("test", window=4, min_calls=2, failure_rate=0.5, open_seconds=open_seconds, probe=probe)
+    breaker.record_failure("timeout")
+    breaker.record_failure("dns")
+    return breaker
+
+
+def test_stays_closed_below_min_calls():
+    breaker = CircuitBreaker("test", window=4, min_calls=3, failure_rate=0.5)
+    breaker.record_failure("timeout")
+    breaker.record_failure("timeout")
+    breaker.before_call()
+    assert breaker.is_closed()
+
+
+def test_stays_closed_below_failure_rate():
+    breaker = CircuitBreaker("test", window=4, min_calls=2, failure_rate=0.75)
+    breaker.record_success()
+    breaker.record_failure("timeout")
+    breaker.record_success()
+    breaker.record_failure("timeout")
+    assert breaker.is_closed()
+
+
+def test_opens_and_rejects_calls():
+    breaker = _tripped(open_seconds=60)
+    assert not breaker.is_closed()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    snapshot = breaker.snapshot()
+    assert snapshot["state"] == OPEN
+    assert snapshot["failure_kinds"] == {"timeout": 1, "dns": 1}
+
+
+def test_half_open_lets_one_call_probe_without_probe_fn():
+    breaker = _tripped()
+    time.sleep(0.06)
+    breaker.before_call()  # 這個呼叫當作探測
+    assert breaker.snapshot()["state"] == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.snapshot()["state"] == CLOSED
+    breaker.before_call()
+
+
+def test_failed_probe_call_reopens():
+    breaker = _tripped()
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.record_failure("unexpected_page")
+    assert breaker.snapshot()["state"] == OPEN
+
+
+def test_ignored_probe_call_allows_another_probe():
+    breaker = _tripped()
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.record_ignored()
+    breaker.before_call()
+
+
+def test_background_probe_closes_circuit():
+    probed = threading.Event()
+
+    def probe():
+        probed.set()
+        return True
+
+    breaker = _tripped(probe=probe)
+    time.sleep(0.06)
+    # 有 probe 時呼叫端仍直接失敗，由背景探測恢復
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    assert probed.wait(5)
+    for _ in range(50):
+        if breaker.is_closed():
+            break
+        time.sleep(0.01)
+    assert breaker.is_closed()
+
+
+class _FakeBot:
+    def __init__(self, result):
+        self.result = result
+
+    def start(self):
+        pass
+
+    def close(self):
+        pass
+
+    def perform_query(self, reg_no, **kwargs):
+        return dict(self.result)
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    breaker = CircuitBreaker("test-upstream", window=4, min_calls=2, failure_rate=0.5, open_seconds=60)
+    monkeypatch.setattr(lia_bot, "_upstream_breaker", breaker)
+    monkeypatch.setattr(lia_bot, "CIRCUIT_ENABLED", True)
+
+    def run(result):
+        monkeypatch.setattr(lia_bot, "_create_bot", lambda skip_screenshot, headless: _FakeBot(result))
+        return lia_bot._query_and_cache("0113403577", True, True, Deadline(10))
+
+    return breaker, run
+
+
+def test_captcha_exhaustion_does_not_trip_upstream_breaker(upstream):
+    breaker, run = upstream
+    exhausted = {"success": False, "status": "error", "msg": "驗證碼連續 5 次識別錯誤", "captcha_exhausted": True}
+    for _ in range(5):
+        assert run(exhausted)["captcha_exhausted"]
+    assert breaker.is_closed()
+    assert breaker.snapshot()["recent_calls"] == 0
+
+
+def test_unexpected_page_trips_upstream_breaker(upstream):
+    breaker, run = upstream
+    for _ in range(2):
+        run({"success": False, "status": "unknown", "msg": "非預期頁面"})
+    assert breaker.snapshot()["state"] == OPEN
+    assert breaker.snapshot()["failure_kinds"] == {"unexpected_page": 2}
+
+
+def test_http_engine_marks_captcha_exhaustion(monkeypatch):
+    bot = LIAHttpQueryBot()
+    form_page = parse_page(load_fixture("query_not_found.html").replace("alert('查無資料');", ""))
+    rejected = parse_page("<script>alert('驗證碼錯誤');</script>")
+    monkeypatch.setattr(bot, "_load_form", lambda: ("https://example.test/query", form_page))
+    monkeypatch.setattr(bot, "_get_captcha_text", lambda page_url, page: "abcd")
+    monkeypatch.setattr(bot, "_submit", lambda page_url, form, reg_no, captcha_text: rejected)
+    result = bot._run_query("0113403577", max_retries=3)
+    assert result["status"] == "error"
+    assert result["captcha_exhausted"] is True
+    assert len(result["attempt_ms"]) == 3
@@ -0,0 +1,99 @@
+import time
+
+import pytest
+
+import lia_bot
+from deadline import Deadline, DeadlineExceeded
+from lia_bot import LIAQueryBot
+
+
+def test_unlimited_deadline_keeps_caps():
+    deadline = Deadline()
+    assert deadline.remaining() == float("inf")
+    assert not deadline.expired()
+    assert deadline.timeout(30) == 30
+    assert deadline.timeout_ms(60000) == 60000
+
+
+def test_timeout_is_capped_by_remaining_time():
+    deadline = Deadline(5)
+    assert deadline.timeout(60) <= 5
+    assert deadline.timeout(1) == 1
+    assert deadline.timeout_ms(60000) <= 5000
+
+
+def test_expired_deadline_raises():
+    deadline = Deadline(0.01)
+    time.sleep(0.02)
+    assert deadline.expired()
+    with pytest.raises(DeadlineExceeded):
+        deadline.check()
+    with pytest.raises(DeadlineExceeded):
+        deadline.timeout(10)
+
+
+def test_check_requires_needed_seconds():
+    deadline = Deadline(1)
+    deadline.check(0.5)
+    with pytest.raises(DeadlineExceeded):
+        deadline.check(2)
+
+
+def test_sleep_refuses_to_outlast_deadline():
+    """等完後已沒有時間時直接拋出，不浪費這段等待"""
+    deadline = Deadline(0.5)
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        deadline.sleep(3)
+    assert time.monotonic() - started < 0.1
+
+
+class _FakePage:
+    """記錄每次 locator 操作時生效的預設逾時"""
+
+    def __init__(self):
+        self.default_timeout = LIAQueryBot.DEFAULT_ACTION_TIMEOUT_MS
+        self.seen = []
+
+    def set_default_timeout(self, ms):
+        self.default_timeout = ms
+
+    def locator(self, selector):
+        page = self
+
+        class Locator:
+            def count(self):
+                page.seen.append((selector, page.default_timeout))
+                return 1
+
+        return Locator()
+
+
+class _Stop(Exception):
+    pass
+
+
+def test_warm_form_checks_run_under_the_request_deadline(monkeypatch):
+    bot = LIAQueryBot()
+    monkeypatch.setattr(LIAQueryBot, "WARM_PAGE", True)
+    page = _FakePage()
+    bot.page = page
+    bot.deadline = Deadline(2)
+    lia_bot._warm_pages[page] = (bot.URL, time.monotonic(), None)
+
+    def stop(*args):
+        raise _Stop
+
+    monkeypatch.setattr(bot, "_attempt_queries", stop)
+    with pytest.raises(_Stop):
+        bot._run_query("0113403577", 1, skip_screenshot=True)
+    assert page.seen and page.seen[0][0] == "#iusr"
+    assert page.seen[0][1] <= 2000
+
+
+def test_expired_deadline_returns_result_before_touching_page():
+    bot = LIAQueryBot()
+    bot.pool = object()  # 不應被使用
+    result = bot.perform_query("0113403577", deadline=Deadline(0))
+    assert result["status"] == "error"
+    assert result["deadline_exceeded"] is True
@@ -0,0 +1,92 @@
+from datetime import datetime
+
+from conftest import load_fixture
+from lia_bot import LIAQueryBot
+from lia_parser import extract_result_record, find_query_form, parse_page
+
+
+def _record(fixture: str) -> dict:
+    return extract_result_record(parse_page(load_fixture(fixture)))
+
+
+def test_th_td_rows():
+    record = _record("result_th_td.html")
+    assert record["name"] == "王小明"
+    assert record["reg_no"] == "0113403577"
+    assert record["company"] == "國泰人壽保險股份有限公司"
+    assert record["first_registration_date"] == "105年 3月 8日"
+    assert record["registration_status"] == "登錄中"
+
+
+def test_label_and_value_in_one_cell():
+    record = _record("result_label_colon.html")
+    assert record["name"] == "王小明"
+    assert record["reg_no"] == "0113403577"
+    assert record["company"] == "國泰人壽保險股份有限公司"
+    assert record["first_registration_date"] == "105年 3月 8日"
+    assert record["registration_status"] == "登錄中"
+
+
+def test_several_pairs_per_row():
+    record = _record("result_pairs.html")
+    assert record["name"] == "王小明"
+    assert record["reg_no"] == "0113403577"
+    assert record["company"] == "國泰人壽保險股份有限公司"
+    assert record["first_registration_date"] == "105年 3月 8日"
+    assert record["registration_status"] == "登錄中"
+
+
+def test_no_result_table():
+    page = parse_page(load_fixture("query_not_found.html"))
+    assert extract_result_record(page) is None
+
+
+def test_query_form_and_alert():
+    page = parse_page(load_fixture("query_not_found.html"))
+    form = find_query_form(page)
+    assert form["action"] == "/lia/PublicQuery.do"
+    assert form["method"] == "post"
+    assert form["fields"] == {"method": "query", "regNo": "", "captchaCode": "", "queryType": "2"}
+    assert page.images["captchaImg"] == "/lia/Captcha.do?t=1"
+    assert page.alerts == ["查無資料"]
+
+
+def test_verdict_found_invalid():
+    verdict = LIAQueryBot._verdict_from_page(parse_page(load_fixture("result_th_td.html")))
+    assert verdict["status"] == "found_invalid"
+    assert verdict["date"] == "105_03_08"
+    assert verdict["record"]["name"] == "王小明"
+
+
+def test_verdict_found_valid():
+    today = datetime.now()
+    html = load_fixture("result_th_td.html").replace(
+        "105年 3月 8日", f"{today.year - 1911}年 {today.month}月 {today.day}日"
+    )
+    verdict = LIAQueryBot._verdict_from_page(parse_page(html))
+    assert verdict["status"] == "found_valid"
+
+
+def test_verdict_reads_date_from_row_when_pairing_fails():
+    page = parse_page(load_fixture("result_split_date.html"))
+    assert extract_result_record(page)["first_registration_date"] == "105年"
+    verdict = LIAQueryBot._verdict_from_page(page)
+    assert verdict["status"] == "found_invalid"
+    assert verdict["date"] == "105_03_08"
+
+
+def test_verdict_not_registered():
+    verdict = LIAQueryBot._verdict_from_page(parse_page(load_fixture("result_not_registered.html")))
+    assert verdict["status"] == "not_registered"
+    assert verdict["record"]["company"] == "-"
+
+
+def test_verdict_not_found():
+    verdict = LIAQueryBot._verdict_from_page(parse_page(load_fixture("query_not_found.html")))
+    assert verdict["status"] == "not_found"
+    assert "record" not in verdict
+
+
+def test_verdict_unexpected_page():
+    verdict = LIAQueryBot._verdict_from_page(parse_page("<html><body>系統維護中</body></html>"))
+    assert verdict["status"] == "unknown"
@@ -0,0 +1,42 @@
+import pytest
+
+from lia_bot import LIAQueryBot
+
+ORIGIN = "public.liaroc.org.tw"
+
+
+def _blocked(resource_type, url, screenshot_fidelity=False):
+    return LIAQueryBot._should_block(resource_type, url, ORIGIN, screenshot_fidelity)
+
+
+@pytest.mark.parametrize("url", [
+    "https://public.liaroc.org.tw/lia-public/DIS/Servlet/RD?returnUrl=/captcha",
+    "https://public.liaroc.org.tw/lia-public/simpleCaptcha.png",
+    "https://public.liaroc.org.tw/images/checkcode.jsp?t=1700000000",
+])
+def test_same_origin_images_pass(url):
+    """驗證碼圖片網址沒有固定格式，同站圖片一律放行"""
+    assert not _blocked("image", url)
+
+
+@pytest.mark.parametrize("resource_type", ["script", "xhr", "fetch", "image"])
+def test_third_party_resources_are_blocked(resource_type):
+    assert _blocked(resource_type, "https://www.google-analytics.com/collect")
+
+
+@pytest.mark.parametrize("resource_type", ["stylesheet", "font", "media", "other"])
+def test_non_essential_types_are_blocked(resource_type):
+    assert _blocked(resource_type, f"https://{ORIGIN}/static/site.css")
+
+
+def test_documents_always_pass():
+    assert not _blocked("document", "https://elsewhere.example/redirect")
+    assert not _blocked("document", "https://elsewhere.example/redirect", screenshot_fidelity=True)
+
+
+def test_screenshot_fidelity_keeps_styles_but_not_media_or_third_party_scripts():
+    assert not _blocked("stylesheet", "https://cdn.example/site.css", screenshot_fidelity=True)
+    assert not _blocked("font", "https://cdn.example/font.woff2", screenshot_fidelity=True)
+    assert _blocked("media", f"https://{ORIGIN}/intro.mp4", screenshot_fidelity=True)
+    assert _blocked("script", "https://www.googletagmanager.com/gtm.js", screenshot_fidelity=True)
+    assert not _blocked("script", f"https://{ORIGIN}/js/query.js", screenshot_fidelity=True)
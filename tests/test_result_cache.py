@@ -0,0 +1,80 @@
+import time
+from datetime import datetime, timedelta
+
+from lia_bot import LIAQueryBot, _revalidate_cached_result
+from result_cache import ResultCache
+
+
+def test_get_returns_independent_copy():
+    cache = ResultCache()
+    cache.put("0113403577", {"status": "found_valid", "record": {"name": "王小明"}})
+    first = cache.get("0113403577")
+    first["record"]["name"] = "changed"
+    assert cache.get("0113403577")["record"]["name"] == "王小明"
+
+
+def test_put_stores_a_copy():
+    cache = ResultCache()
+    value = {"status": "not_found"}
+    cache.put("a", value)
+    value["status"] = "changed"
+    assert cache.get("a")["status"] == "not_found"
+
+
+def test_entries_expire_after_ttl():
+    cache = ResultCache(ttl_seconds=0.01)
+    cache.put("a", {"status": "not_found"})
+    time.sleep(0.02)
+    assert cache.get("a") is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResultCache(max_entries=2)
+    cache.put("a", {"n": 1})
+    cache.put("b", {"n": 2})
+    cache.get("a")  # a 變成最近使用
+    cache.put("c", {"n": 3})
+    assert cache.get("b") is None
+    assert cache.get("a") == {"n": 1}
+    assert cache.get("c") == {"n": 3}
+
+
+def test_zero_ttl_disables_cache():
+    cache = ResultCache(ttl_seconds=0)
+    cache.put("a", {"n": 1})
+    assert cache.get("a") is None
+
+
+def test_invalidate_and_clear():
+    cache = ResultCache()
+    cache.put("a", {"n": 1})
+    cache.put("b", {"n": 2})
+    cache.invalidate("a")
+    assert cache.get("a") is None
+    cache.clear()
+    assert cache.get("b") is None
+
+
+def _roc(days_ago: int) -> str:
+    day = datetime.now() - timedelta(days=days_ago)
+    return f"{day.year - 1911}_{day.month:02d}_{day.day:02d}"
+
+
+def test_cached_valid_result_flips_after_one_year():
+    cached = {"success": True, "status": "found_valid", "msg": "審核成功", "date": _roc(366), "email_info": None}
+    result = _revalidate_cached_result(cached)
+    assert result["status"] == "found_invalid"
+    assert result["cached"] is True
+    assert result["email_info"] == LIAQueryBot._generate_email_template("found_invalid")
+
+
+def test_cached_result_within_one_year_stays_valid():
+    result = _revalidate_cached_result({"success": True, "status": "found_valid", "date": _roc(364)})
+    assert result["status"] == "found_valid"
+    assert result["date"] == _roc(364)
+
+
+def test_cached_result_without_date_keeps_status():
+    result = _revalidate_cached_result({"success": True, "status": "not_found"})
+    assert result["status"] == "not_found"
+    assert result["email_info"] == LIAQueryBot._generate_email_template("not_found")
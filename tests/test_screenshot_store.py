@@ -0,0 +1,83 @@
+import io
+import random
+
+from PIL import Image
+
+from screenshot_store import ScreenshotStore, encode_screenshot
+
+
+def _png(width=600, height=400, noise=True, seed=0) -> bytes:
+    """noise 為 True 時產生照片般難以壓縮的 PNG，否則為黑白棋盤格 (PNG 遠小於有損格式)"""
+    if noise:
+        rng = random.Random(seed)
+        image = Image.frombytes("RGB", (width, height), bytes(rng.getrandbits(8) for _ in range(width * height * 3)))
+    else:
+        image = Image.new("1", (width, height))
+        image.putdata([(x + y) % 2 for y in range(height) for x in range(width)])
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def _decode(data: bytes) -> Image.Image:
+    return Image.open(io.BytesIO(data))
+
+
+def test_webp_within_limit():
+    png = _png()
+    data, mimetype, extension = encode_screenshot(png, "webp", max_bytes=10 ** 7)
+    assert (mimetype, extension) == ("image/webp", ".webp")
+    assert _decode(data).format == "WEBP"
+    assert len(data) < len(png)
+
+
+def test_jpeg_format():
+    data, mimetype, extension = encode_screenshot(_png(), "jpeg", max_bytes=10 ** 7)
+    assert (mimetype, extension) == ("image/jpeg", ".jpg")
+    assert _decode(data).format == "JPEG"
+
+
+def test_png_is_passed_through():
+    png = _png()
+    assert encode_screenshot(png, "png") == (png, "image/png", ".png")
+
+
+def test_unknown_format_falls_back_to_webp():
+    _, mimetype, _ = encode_screenshot(_png(), "gif", max_bytes=10 ** 7)
+    assert mimetype == "image/webp"
+
+
+def test_keeps_png_when_it_is_smaller():
+    png = _png(noise=False)
+    assert encode_screenshot(png, "webp") == (png, "image/png", ".png")
+
+
+def test_shrinks_until_under_limit():
+    png = _png(800, 600)
+    data, mimetype, _ = encode_screenshot(png, "jpeg", max_bytes=30000)
+    assert len(data) <= 30000
+    assert mimetype == "image/jpeg"
+    assert _decode(data).width < 800
+
+
+def test_gives_up_at_minimum_size():
+    """無法壓到上限以下時仍回傳壓縮結果，不會無限縮小"""
+    data, mimetype, _ = encode_screenshot(_png(300, 300), "jpeg", max_bytes=100)
+    assert mimetype == "image/jpeg"
+    assert min(_decode(data).size) <= 200
+
+
+def test_store_deduplicates_by_content():
+    store = ScreenshotStore()
+    first = store.put(b"image", "image/webp", "a.webp")
+    assert store.put(b"image", "image/webp", "b.webp") == first
+    data, mimetype, filename, etag = store.get(first)
+    assert (data, mimetype, filename) == (b"image", "image/webp", "b.webp")
+    assert etag == first
+    assert store.get("missing") is None
+
+
+def test_store_expires_entries():
+    store = ScreenshotStore(ttl_seconds=0)
+    assert store.get(store.put(b"image", "image/webp", "a.webp")) is None
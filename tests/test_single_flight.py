@@ -0,0 +1,126 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import lia_bot
+from single_flight import SingleFlight
+
+
+def _start_leader(flight, key, fn):
+    """在背景執行 leader，等到它確實進入 fn 後才回傳"""
+    entered = threading.Event()
+    release = threading.Event()
+
+    def leader_fn():
+        entered.set()
+        release.wait(5)
+        return fn()
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(flight.do, key, leader_fn)
+    assert entered.wait(5)
+    return future, release, executor
+
+
+def test_concurrent_callers_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+    leader, release, executor = _start_leader(flight, "k", lambda: calls.append(1) or {"status": "ok"})
+    assert flight.in_flight("k")
+
+    with ThreadPoolExecutor(max_workers=3) as waiters:
+        results = [waiters.submit(flight.do, "k", lambda: calls.append(2) or {"status": "other"}) for _ in range(3)]
+        release.set()
+        assert [future.result(5) for future in results] == [{"status": "ok"}] * 3
+    assert leader.result(5) == {"status": "ok"}
+    assert calls == [1]
+    assert not flight.in_flight("k")
+    executor.shutdown()
+
+
+def test_waiters_get_independent_copies():
+    flight = SingleFlight()
+    leader, release, executor = _start_leader(flight, "k", lambda: {"record": {"name": "王小明"}})
+    with ThreadPoolExecutor(max_workers=2) as waiters:
+        results = [waiters.submit(flight.do, "k", dict) for _ in range(2)]
+        release.set()
+        first, second = (future.result(5) for future in results)
+    first["record"]["name"] = "changed"
+    assert second["record"]["name"] == "王小明"
+    executor.shutdown()
+
+
+def test_leader_error_is_raised_to_waiters():
+    flight = SingleFlight()
+
+    def fail():
+        raise RuntimeError("upstream down")
+
+    leader, release, executor = _start_leader(flight, "k", fail)
+    with ThreadPoolExecutor(max_workers=1) as waiters:
+        waiter = waiters.submit(flight.do, "k", dict)
+        release.set()
+        with pytest.raises(RuntimeError, match="upstream down"):
+            waiter.result(5)
+    with pytest.raises(RuntimeError):
+        leader.result(5)
+    executor.shutdown()
+
+
+def test_waiter_timeout_does_not_affect_leader():
+    flight = SingleFlight()
+    leader, release, executor = _start_leader(flight, "k", lambda: "done")
+    with pytest.raises(TimeoutError):
+        flight.do("k", dict, timeout=0.05)
+    release.set()
+    assert leader.result(5) == "done"
+    executor.shutdown()
+
+
+def test_calls_after_completion_run_again():
+    flight = SingleFlight()
+    assert flight.do("k", lambda: 1) == 1
+    assert flight.do("k", lambda: 2) == 2
+
+
+def test_join_waits_for_compatible_call():
+    flight = SingleFlight()
+    leader, release, executor = _start_leader(flight, ("a", False), lambda: {"screenshot": "png"})
+    with ThreadPoolExecutor(max_workers=1) as waiters:
+        waiter = waiters.submit(flight.do, ("a", True), lambda: {"screenshot": None}, None, (("a", False),))
+        release.set()
+        assert waiter.result(5) == {"screenshot": "png"}
+    executor.shutdown()
+
+
+def test_join_without_compatible_call_runs_own_key():
+    flight = SingleFlight()
+    assert flight.do(("a", True), lambda: "own", join=(("a", False),)) == "own"
+
+
+def test_screenshot_caller_never_joins_skip_screenshot_flight(monkeypatch):
+    """不需截圖的呼叫端成為 leader 時以自己的 key 登記，需要截圖的呼叫端不會拿到沒有截圖的結果"""
+    flight = SingleFlight()
+    monkeypatch.setattr(lia_bot, "_in_flight", flight)
+    monkeypatch.setattr(lia_bot._result_cache, "get", lambda key: None)
+    entered = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fake_query(reg_no, skip_screenshot, headless, deadline, lazy_screenshot=False):
+        calls.append(skip_screenshot)
+        if skip_screenshot:
+            entered.set()
+            release.wait(5)
+        return {"status": "found_valid", "screenshot": None if skip_screenshot else b"png"}
+
+    monkeypatch.setattr(lia_bot, "_query_and_cache", fake_query)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        skip = executor.submit(lia_bot.query_license, "0113403577", skip_screenshot=True)
+        assert entered.wait(5)
+        with_screenshot = executor.submit(lia_bot.query_license, "0113403577")
+        assert with_screenshot.result(5)["screenshot"] == b"png"
+        release.set()
+        assert skip.result(5)["screenshot"] is None
+    assert sorted(calls) == [False, True]
@@ -0,0 +1,103 @@
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+from trello_flow import trello_client
+from trello_flow.trello_client import TrelloClient
+
+
+class _Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """回應依序取自 client.replies (例外會被拋出)，等待秒數記在 client.sleeps"""
+    client = TrelloClient("key", "token")
+    client.replies = []
+    client.calls = []
+    client.sleeps = []
+
+    def request(method, url, **kwargs):
+        client.calls.append(method)
+        reply = client.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    monkeypatch.setattr(client.session, "request", request)
+    monkeypatch.setattr(trello_client.time, "sleep", client.sleeps.append)
+    monkeypatch.setattr(trello_client, "MAX_RETRIES", 2)
+    return client
+
+
+def _refused():
+    reason = NewConnectionError(None, "Failed to establish a new connection: [Errno 111] Connection refused")
+    return requests.ConnectionError(MaxRetryError(None, "/", reason))
+
+
+def _reset_after_send():
+    return requests.ConnectionError(ProtocolError("Connection aborted.", ConnectionResetError(104, "reset")))
+
+
+def test_get_retries_server_errors(client):
+    client.replies = [_Response(503), _Response(502), _Response(200)]
+    assert client.get("/cards/a").status_code == 200
+    assert client.sleeps == [1, 2]
+
+
+def test_post_does_not_retry_server_errors(client):
+    client.replies = [_Response(503)]
+    assert client.post("/cards/a/actions/comments").status_code == 503
+    assert client.calls == ["POST"]
+
+
+def test_post_retries_rate_limit(client):
+    client.replies = [_Response(429, {"Retry-After": "3"}), _Response(200)]
+    assert client.post("/cards/a/actions/comments").status_code == 200
+    assert client.sleeps == [3]
+
+
+def test_post_retries_connection_never_established(client):
+    client.replies = [_refused(), requests.ConnectTimeout("connect timeout"), _Response(200)]
+    assert client.post("/cards/a/attachments").status_code == 200
+    assert client.calls == ["POST"] * 3
+
+
+def test_post_does_not_retry_after_request_was_sent(client):
+    client.replies = [_reset_after_send()]
+    with pytest.raises(requests.ConnectionError):
+        client.post("/cards/a/attachments")
+    assert client.calls == ["POST"]
+
+
+def test_get_retries_any_connection_error(client):
+    client.replies = [_reset_after_send(), _Response(200)]
+    assert client.get("/cards/a").status_code == 200
+
+
+def test_gives_up_after_max_retries(client):
+    client.replies = [_Response(429)] * 3
+    assert client.post("/cards/a/actions/comments").status_code == 429
+    assert len(client.calls) == 3
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("3", 3),
+    ("60", 60),
+    ("3600", None),
+    ("-5", None),
+    ("nan", None),
+    ("inf", None),
+    ("Wed, 21 Oct 2026 07:28:00 GMT", None),
+])
+def test_retry_after_is_capped(header, expected):
+    assert TrelloClient._retry_after(_Response(429, {"Retry-After": header})) == expected
+
+
+def test_huge_retry_after_falls_back_to_backoff(client):
+    client.replies = [_Response(429, {"Retry-After": "86400"}), _Response(200)]
+    assert client.post("/cards/a/actions/comments").status_code == 200
+    assert client.sleeps == [1]
@@ -0,0 +1,140 @@
+import threading
+
+import pytest
+
+from trello_flow import work_queue
+from trello_flow.work_queue import CardWorkQueue, RetryLater
+
+
+@pytest.fixture
+def queue(tmp_path):
+    """不啟動工作執行緒的佇列，由測試直接呼叫 _claim / _finish"""
+    q = CardWorkQueue(lambda card_id, card_url: None, db_path=str(tmp_path / "queue.db"), workers=0, max_pending=3)
+    q.start()
+    return q
+
+
+def _claim(q):
+    with q._lock:
+        return q._claim()
+
+
+def test_enqueue_deduplicates_and_limits(queue):
+    assert queue.enqueue("a", "https://trello.com/c/a") == "queued"
+    assert queue.enqueue("a", "https://trello.com/c/a") == "duplicate"
+    assert queue.enqueue("b", "https://trello.com/c/b") == "queued"
+    assert queue.enqueue("c", "https://trello.com/c/c") == "queued"
+    assert queue.enqueue("d", "https://trello.com/c/d") == "full"
+    assert queue.stats() == {"pending": 3}
+
+
+def test_claim_in_order_and_finish(queue):
+    queue.enqueue("a", "https://trello.com/c/a")
+    queue.enqueue("b", "https://trello.com/c/b")
+    assert _claim(queue) == ("a", "https://trello.com/c/a", 1)
+    assert _claim(queue) == ("b", "https://trello.com/c/b", 1)
+    assert _claim(queue) is None
+    assert queue.stats() == {"running": 2}
+
+    queue._finish("a", "done")
+    queue._finish("b", "failed", "boom")
+    assert queue.stats() == {"done": 1, "failed": 1}
+    # 已處理的卡片重送時不會再處理
+    assert queue.enqueue("a", "https://trello.com/c/a") == "duplicate"
+
+
+def test_restart_fails_cards_over_max_attempts(queue, monkeypatch):
+    queue.enqueue("a", "https://trello.com/c/a")
+    queue.enqueue("b", "https://trello.com/c/b")
+    _claim(queue)
+    _claim(queue)
+    monkeypatch.setattr(work_queue, "MAX_ATTEMPTS", 1)
+    # 模擬程序重啟 (兩張都已處理 MAX_ATTEMPTS 次)
+    queue._pid = None
+    queue.start()
+    assert queue.stats() == {"failed": 2}
+
+
+def test_restart_requeues_interrupted_card(queue):
+    queue.enqueue("a", "https://trello.com/c/a")
+    _claim(queue)
+    queue._pid = None
+    queue.start()
+    assert queue.stats() == {"pending": 1}
+    assert _claim(queue) == ("a", "https://trello.com/c/a", 2)
+
+
+def test_same_process_restart_keeps_running_cards_and_live_threads(tmp_path):
+    """個別執行緒結束後再呼叫 start()：只補上該執行緒，處理中的卡片不會被放回 pending 重複處理"""
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def handler(card_id, card_url):
+        calls.append(card_id)
+        started.set()
+        release.wait(5)
+
+    q = CardWorkQueue(handler, db_path=str(tmp_path / "queue.db"), workers=2)
+    q.enqueue("a", "https://trello.com/c/a")
+    assert started.wait(5)
+    live = [thread for thread in q._threads if thread.is_alive()]
+    dead = threading.Thread(target=lambda: None, name="trello-queue-1")
+    dead.start()
+    dead.join()
+    q._threads[1] = dead
+
+    q.start()
+    assert q.stats() == {"running": 1}
+    assert len(q._threads) == 2
+    assert q._threads[0] is live[0]
+    assert q._threads[1] is not dead and q._threads[1].is_alive()
+
+    release.set()
+    assert q.wait_until_idle(poll_seconds=0.01) == {"done": 1}
+    assert calls == ["a"]
+
+
+def test_retry_later_waits_for_backoff(queue, monkeypatch):
+    monkeypatch.setattr(work_queue, "RETRY_BACKOFF_SECONDS", 60)
+    queue.enqueue("a", "https://trello.com/c/a")
+    card_id, _, attempts = _claim(queue)
+    assert queue._retry_later(card_id, attempts, "circuit open") == 60
+    assert queue._retry_later(card_id, 2, "circuit open") == 120
+    assert _claim(queue) is None
+    with queue._lock:
+        assert 100 < queue._next_retry_in() <= 120
+
+
+def test_worker_retries_then_reports_failure(tmp_path, monkeypatch):
+    monkeypatch.setattr(work_queue, "RETRY_BACKOFF_SECONDS", 0.01)
+    monkeypatch.setattr(work_queue, "MAX_ATTEMPTS", 3)
+    calls = []
+    failures = []
+    reported = threading.Event()
+
+    def handler(card_id, card_url):
+        calls.append(card_id)
+        if card_id == "a":
+            raise RetryLater("upstream down")
+        if card_id == "b" and calls.count("b") == 1:
+            raise RetryLater("busy")
+        if card_id == "c":
+            raise ValueError("bad card")
+
+    def on_failure(card_id, card_url, error):
+        failures.append((card_id, str(error)))
+        if len(failures) == 2:
+            reported.set()
+
+    q = CardWorkQueue(handler, db_path=str(tmp_path / "queue.db"), workers=1, on_failure=on_failure)
+    for card_id in ("a", "b", "c"):
+        q.enqueue(card_id, f"https://trello.com/c/{card_id}")
+    assert reported.wait(10)
+    stats = q.wait_until_idle(poll_seconds=0.01)
+
+    assert stats == {"done": 1, "failed": 2}
+    assert calls.count("a") == 3
+    assert calls.count("b") == 2
+    assert calls.count("c") == 1
+    assert sorted(failures) == [("a", "upstream down"), ("c", "bad card")]
@@ -0,0 +1,75 @@
+"""
+補處理 Webhook 沒收到的 Trello 卡片
+
+以兩組批次 API 呼叫取得看板上所有卡片 (含描述) 與留言，挑出標題包含
+TRIGGER_KEYWORD 且還沒有「查詢完成」留言的卡片，交給固定數量的執行緒並行
+驗證。卡片排入與 Webhook 共用的佇列資料庫 (TRELLO_QUEUE_DB)，Webhook 已
+收到的卡片 (等待中、處理中，或已處理但留言不完整) 不會重複處理；中斷後以
+相同指令重新執行即可接續。與 Webhook 服務同時執行時，兩邊的執行緒都會處理
+佇列中的卡片，本工具等到佇列清空才結束。
+
+Usage:
+    python -m trello_flow.backfill                      # 使用 TRELLO_BOARD_ID
+    python -m trello_flow.backfill --board <board_id> --workers 4
+    python -m trello_flow.backfill --dry-run            # 只列出待處理的卡片
+"""
+import argparse
+import os
+
+from . import trello_utils
+from .routes import TRIGGER_KEYWORD, process_trello_card, report_card_failure
+from .work_queue import DB_PATH, CardWorkQueue
+
+# 已處理完成的卡片會有這則留言 (見 trello_utils.upload_result_to_trello)
+DONE_COMMENT_PREFIX = "查詢完成"
+
+
+def find_unhandled_cards(board_id: str) -> list:
+    """回傳標題包含 TRIGGER_KEYWORD 且沒有「查詢完成」留言的卡片"""
+    cards = trello_utils.list_board_cards(board_id)
+    comments = trello_utils.list_board_comments(board_id)
+    unhandled = []
+    for card in cards:
+        if TRIGGER_KEYWORD not in card.get("name", ""):
+            continue
+        if any(text.startswith(DONE_COMMENT_PREFIX) for text in comments.get(card["id"], [])):
+            continue
+        unhandled.append(card)
+    print(f"[Backfill] 看板共 {len(cards)} 張卡片，{len(unhandled)} 張符合「{TRIGGER_KEYWORD}」且尚未處理")
+    return unhandled
+
+
+def main():
+    parser = argparse.ArgumentParser(description="補處理 Webhook 沒收到的 Trello 卡片")
+    parser.add_argument("--board", default=os.environ.get("TRELLO_BOARD_ID"), help="看板 ID (預設 TRELLO_BOARD_ID)")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("TRELLO_QUEUE_WORKERS", "2")), help="同時處理的卡片數")
+    parser.add_argument("--db", default=DB_PATH, help="佇列資料庫 (預設與 Webhook 共用的 TRELLO_QUEUE_DB)")
+    parser.add_argument("--dry-run", action="store_true", help="只列出待處理的卡片，不進行驗證")
+    args = parser.parse_args()
+    if not args.board:
+        parser.error("請以 --board 或 TRELLO_BOARD_ID 指定看板")
+
+    cards = find_unhandled_cards(args.board)
+    if args.dry_run:
+        for card in cards:
+            print(f"  {card['id']}  {card.get('name', '')}")
+        return
+
+    # 卡片描述已在批次查詢中取得，處理時不必逐張再向 Trello 讀取
+    descriptions = {card["id"]: card.get("desc", "") for card in cards}
+    queue = CardWorkQueue(
+        lambda card_id, card_url: process_trello_card(card_id, card_url, descriptions.get(card_id)),
+        db_path=args.db,
+        workers=args.workers,
+        max_pending=float("inf"),  # 命令列補處理不限制等待中的卡片數
+        on_failure=report_card_failure,
+    )
+    results = [queue.enqueue(card["id"], f"https://trello.com/c/{card['shortLink']}") for card in cards]
+    print(f"[Backfill] 新加入 {results.count('queued')} 張，{results.count('duplicate')} 張已在佇列中 (Webhook 已收到或先前已補處理)")
+
+    stats = queue.wait_until_idle()
+    print(f"[Backfill] 完成：{stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,35 @@
 import os
-import threading
 from flask import Blueprint, request
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
 
-from lia_bot import LIAQueryBot
+from circuit_breaker import CircuitOpenError
+from lia_bot import BrowserPoolBusy, query_license
 from . import trello_utils
+from .work_queue import CardWorkQueue, RetryLater
 
 trello_bp = Blueprint('trello_flow', __name__)
 
 TRIGGER_KEYWORD = os.environ.get("TRIGGER_KEYWORD", "年繳方案申請")
 
+# 查詢時的暫時性錯誤：交由佇列稍後重試，不在卡片上留言
+TRANSIENT_ERRORS = (CircuitOpenError, BrowserPoolBusy, TimeoutError, PlaywrightTimeoutError)
 
-def process_trello_card(card_id, card_url):
+
+def process_trello_card(card_id, card_url, description=None):
     """
     背景任務：處理 Trello 卡片的自動驗證
+    description 為已取得的卡片描述 (例如批次補處理時)，未提供時向 Trello 讀取
+    查詢發生 TRANSIENT_ERRORS 或超過時間預算時拋出 RetryLater，由 CardWorkQueue
+    稍後重試 (此時尚未在卡片上留言)；重試次數用完後由 report_card_failure 留言
     """
     print(f"[Background] 開始處理卡片: {card_id}")
-    bot = None
     try:
         # 1. 從卡片解析證號和信箱
         try:
-            reg_no, _, contact_email = trello_utils.resolve_trello_input(card_url)
+            if description is None:
+                reg_no, _, contact_email = trello_utils.resolve_trello_input(card_url)
+            else:
+                reg_no, contact_email = trello_utils.parse_card_description(description)
         except ValueError as ve:
             trello_utils._post_trello_comment(
                 card_id,
@@ -56,27 +66,25 @@ def process_trello_card(card_id, card_url):
         if len(reg_no) < 10:
             reg_no = reg_no.zfill(10)
 
-        # 3. 執行爬蟲
-        bot = LIAQueryBot(headless=True)
-        bot.start()
-        result = bot.perform_query(reg_no)
-
-        # 4. 回傳結果到 Trello
-        if result['success'] and result.get('screenshot_bytes'):
-            filename = result.get('suggested_filename', f'{reg_no}_result.png')
-
-            trello_utils.upload_result_to_trello(
-                card_id,
-                result['screenshot_bytes'],
-                filename,
-                result['msg']
-            )
-
-            trello_utils.post_email_template_to_trello(
+        # 3. 執行爬蟲 (解析出結果就返回，截圖留到上傳時才產生)
+        try:
+            result = query_license(reg_no, lazy_screenshot=True)
+        except TRANSIENT_ERRORS as e:
+            raise RetryLater(str(e)) from e
+        if result.get("deadline_exceeded"):
+            raise RetryLater(result["msg"])
+
+        # 4. 回傳結果到 Trello：Email 範本先送出，截圖產生後上傳
+        if result['success'] and result.get('screenshot'):
+            futures = trello_utils.post_result_and_email_template(
                 card_id,
+                result['screenshot'],
+                result['msg'],
                 result['email_info'],
-                contact_email
+                contact_email,
             )
+            for future in futures:
+                future.result()
             print(f"[Background] 卡片 {card_id} 處理完成並回報")
         else:
             trello_utils._post_trello_comment(
@@ -85,6 +93,8 @@ def process_trello_card(card_id, card_url):
             )
             print(f"[Background] 查詢失敗已回報 Trello: {result['msg']}")
 
+    except RetryLater:
+        raise
     except Exception as e:
         try:
             trello_utils._post_trello_comment(
@@ -94,9 +104,28 @@ def process_trello_card(card_id, card_url):
         except:
             pass
         print(f"[Background] 發生錯誤: {e}")
-    finally:
-        if bot:
-            bot.close()
+
+
+def report_card_failure(card_id, card_url, error):
+    """CardWorkQueue 重試次數用完 (或處理時發生未預期的例外) 時在卡片上留言"""
+    trello_utils._post_trello_comment(
+        card_id,
+        f"自動驗證暫時無法完成：{error}\n已重試多次仍失敗，請稍後手動查詢。"
+    )
+    print(f"[Background] 卡片 {card_id} 重試後仍失敗，已回報 Trello: {error}")
+
+
+# 卡片處理佇列：固定數量的執行緒依序處理，待處理的卡片存在 SQLite，重啟後繼續
+card_queue = CardWorkQueue(process_trello_card, on_failure=report_card_failure)
+
+
+@trello_bp.before_app_request
+def _start_card_queue():
+    """
+    收到第一個請求時就恢復上次未處理完的卡片，不必等到下一個 Webhook
+    (不在 import 時啟動：gunicorn --preload 的 master 不應持有處理執行緒)
+    """
+    card_queue.start()
 
 
 @trello_bp.route('/webhook/trello', methods=['HEAD', 'POST'])
@@ -130,14 +159,19 @@ def trello_webhook():
                 # 組出卡片網址
                 card_url = f"https://trello.com/c/{card_short_link}"
 
-                # 啟動背景執行緒處理，以免 Webhook 超時 (Trello 要求 10秒內回傳 200)
-                thread = threading.Thread(target=process_trello_card, args=(card_id, card_url))
-                thread.start()
+                # 寫入持久化佇列由背景執行緒處理，以免 Webhook 超時 (Trello 要求 10秒內回傳 200)
+                queued = card_queue.enqueue(card_id, card_url)
+                if queued == "duplicate":
+                    print(f"卡片 {card_id} 已處理過或已在佇列中，略過")
+                elif queued == "full":
+                    # 回傳非 2xx，Trello 會稍後重送此事件
+                    print(f"處理佇列已滿，請 Trello 稍後重送卡片 {card_id}")
+                    return "Queue full", 503
             else:
                 print(f"忽略卡片：{card_name} (未包含關鍵字)")
 
     except Exception as e:
         print(f"Webhook 處理錯誤: {e}")
 
-    # 無論如何都回傳 200，告訴 Trello 我們收到了
+    # 除了佇列已滿之外都回傳 200，告訴 Trello 我們收到了
     return "OK", 200
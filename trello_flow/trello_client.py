@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+API_BASE = "https://api.trello.com/1"
+# Trello 每個 token 每 10 秒上限 100 次請求，預設保留一點餘裕
+RATE_LIMIT_PER_10S = float(os.environ.get("TRELLO_RATE_LIMIT_PER_10S", "90"))
+MAX_RETRIES = int(os.environ.get("TRELLO_MAX_RETRIES", "4"))
+# 採用 Retry-After 的上限秒數，超過時改用指數退避 (避免異常的標頭讓工作執行緒長時間停住)
+MAX_RETRY_AFTER_SECONDS = float(os.environ.get("TRELLO_MAX_RETRY_AFTER_SECONDS", "60"))
+TIMEOUT = 30
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# POST (留言、附件) 不是冪等操作，只在確定沒有被處理時重試
+POST_RETRY_STATUSES = (429,)
+
+
+class TokenBucket:
+    """權杖桶限速：每秒補充 rate 個，最多累積 capacity 個；acquire() 在權杖不足時等待"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class TrelloClient:
+    """
+    共用的 Trello API client
+
+    所有請求共用同一個 Session (連線池 + keep-alive)，送出前經過權杖桶限速；
+    遇到 429 / 5xx 或連線錯誤時依 Retry-After (沒有或超過 MAX_RETRY_AFTER_SECONDS
+    時指數退避) 重試 MAX_RETRIES 次，仍失敗則回傳最後一次的回應或拋出連線例外。
+    POST 可能已被 Trello 處理的情況 (5xx、送出後才斷線) 不重試，以免重複留言
+    或上傳附件；只重試 429 與連線建立前就失敗的錯誤。
+    """
+
+    def __init__(self, api_key: str, token: str, rate_limit_per_10s: float = RATE_LIMIT_PER_10S):
+        self.api_key = api_key
+        self.token = token
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=8)
+        self.session.mount("https://", adapter)
+        self.bucket = TokenBucket(rate_limit_per_10s / 10, rate_limit_per_10s)
+
+    def request(self, method: str, path: str, params: dict = None, **kwargs) -> requests.Response:
+        """送出 API 請求 (path 如 "/cards/{id}")，自動帶入 key / token"""
+        url = f"{API_BASE}{path}"
+        params = {"key": self.api_key, "token": self.token, **(params or {})}
+        idempotent = method.upper() != "POST"
+        retry_statuses = RETRY_STATUSES if idempotent else POST_RETRY_STATUSES
+        for attempt in range(MAX_RETRIES + 1):
+            self.bucket.acquire()
+            try:
+                response = self.session.request(method, url, params=params, timeout=TIMEOUT, **kwargs)
+            except requests.ConnectionError as e:
+                if attempt == MAX_RETRIES or not (idempotent or self._not_sent(e)):
+                    raise
+                delay = 2 ** attempt
+                print(f"Trello API 連線失敗，{delay} 秒後重試 ({attempt + 1}/{MAX_RETRIES}): {e}")
+            else:
+                if response.status_code not in retry_statuses or attempt == MAX_RETRIES:
+                    return response
+                delay = self._retry_after(response) or 2 ** attempt
+                print(f"Trello API 回應 {response.status_code}，{delay:g} 秒後重試 ({attempt + 1}/{MAX_RETRIES})")
+            time.sleep(delay)
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    @staticmethod
+    def _not_sent(error: requests.ConnectionError) -> bool:
+        """連線錯誤是否發生在建立連線時 (DNS 解析失敗、連線被拒、連線逾時)，請求確定沒有送出"""
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+    @staticmethod
+    def _retry_after(response: requests.Response) -> float:
+        """Retry-After 秒數；沒有、無法解析或超過 MAX_RETRY_AFTER_SECONDS 時回傳 None (改用指數退避)"""
+        try:
+            seconds = float(response.headers.get("Retry-After", ""))
+        except ValueError:
+            return None
+        if not 0 <= seconds <= MAX_RETRY_AFTER_SECONDS:
+            return None
+        return seconds
@@ -1,12 +1,22 @@
 import os
 import re
-import requests
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-# 從環境變數讀取 API Key
+from dotenv import load_dotenv
+
+from .trello_client import TrelloClient
+
+# 從環境變數讀取 API Key (命令列工具直接 import 時也讀得到 .env)
+load_dotenv()
 TRELLO_API_KEY = os.environ.get("TRELLO_API_KEY")
 TRELLO_TOKEN = os.environ.get("TRELLO_TOKEN")
 
+# 所有 Trello API 呼叫共用的 client (連線池、限速、429 / 5xx 重試)
+client = TrelloClient(TRELLO_API_KEY, TRELLO_TOKEN)
+# 同一張卡片上彼此獨立的上傳 / 留言同時送出
+_post_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="trello-post")
+
 def extract_card_id_from_url(trello_url: str) -> str:
     """從 Trello 卡片網址提取卡片 ID"""
     match = re.search(r'trello\.com/c/([a-zA-Z0-9]+)', trello_url)
@@ -19,14 +29,7 @@ def get_trello_card_description(card_id: str) -> str:
     if not TRELLO_API_KEY or not TRELLO_TOKEN:
         raise ValueError("未設定 TRELLO_API_KEY 或 TRELLO_TOKEN")
     
-    url = f"https://api.trello.com/1/cards/{card_id}"
-    params = {
-        "key": TRELLO_API_KEY,
-        "token": TRELLO_TOKEN,
-        "fields": "desc"
-    }
-    
-    response = requests.get(url, params=params)
+    response = client.get(f"/cards/{card_id}", params={"fields": "desc"})
     if response.status_code == 200:
         return response.json().get("desc", "")
     else:
@@ -78,6 +81,44 @@ def extract_email_from_text(text: str) -> str:
     # print("DEBUG: No email found via regex.")
     return None
 
+def parse_card_description(desc: str) -> tuple:
+    """
+    從卡片描述解析證號與聯絡信箱
+    Returns: (registration_number, contact_email_or_None)，找不到證號時拋出 ValueError
+    """
+    reg_no = extract_registration_number_from_text(desc)
+    if not reg_no:
+        raise ValueError("Trello 卡片描述中找不到登錄證字號")
+    return reg_no, extract_email_from_text(desc)
+
+def list_board_cards(board_id: str) -> list:
+    """一次取得看板上所有未封存卡片的 id / 名稱 / 描述 / shortLink"""
+    response = client.get(f"/boards/{board_id}/cards", params={"filter": "open", "fields": "name,desc,shortLink"})
+    if response.status_code != 200:
+        raise Exception(f"Trello API 錯誤: {response.status_code}")
+    return response.json()
+
+def list_board_comments(board_id: str, page_size: int = 1000) -> dict:
+    """
+    分頁取得看板上所有留言 (每次最多 page_size 筆，依時間由新到舊)
+    Returns: {card_id: [留言內容, ...]}
+    """
+    comments = {}
+    params = {"filter": "commentCard", "limit": page_size, "fields": "data"}
+    while True:
+        response = client.get(f"/boards/{board_id}/actions", params=params)
+        if response.status_code != 200:
+            raise Exception(f"Trello API 錯誤: {response.status_code}")
+        actions = response.json()
+        for action in actions:
+            data = action.get("data", {})
+            card_id = data.get("card", {}).get("id")
+            if card_id:
+                comments.setdefault(card_id, []).append(data.get("text", ""))
+        if len(actions) < page_size:
+            return comments
+        params["before"] = actions[-1]["id"]
+
 def resolve_trello_input(input_value: str) -> tuple:
     """
     解析輸入值，如果是 Trello 網址則解析出證號和 Email
@@ -89,12 +130,7 @@ def resolve_trello_input(input_value: str) -> tuple:
             raise ValueError("無效的 Trello 網址")
             
         desc = get_trello_card_description(card_id)
-        reg_no = extract_registration_number_from_text(desc)
-        contact_email = extract_email_from_text(desc)
-        
-        if not reg_no:
-            raise ValueError("Trello 卡片描述中找不到登錄證字號")
-            
+        reg_no, contact_email = parse_card_description(desc)
         return reg_no, card_id, contact_email
     else:
         # 假設是直接輸入證號
@@ -106,11 +142,8 @@ def _post_trello_comment(card_id: str, comment_text: str) -> bool:
         print("未設定 Trello 憑證，無法回傳結果")
         return False
 
-    url = f"https://api.trello.com/1/cards/{card_id}/actions/comments"
-    params = {"key": TRELLO_API_KEY, "token": TRELLO_TOKEN, "text": comment_text}
-    
     try:
-        response = requests.post(url, params=params)
+        response = client.post(f"/cards/{card_id}/actions/comments", params={"text": comment_text})
         if response.status_code == 200:
             return True
         else:
@@ -120,7 +153,8 @@ def _post_trello_comment(card_id: str, comment_text: str) -> bool:
         print(f"Trello 留言發生錯誤: {e}")
         return False
 
-def upload_result_to_trello(card_id: str, screenshot_bytes: bytes, filename: str, result_msg: str):
+def upload_result_to_trello(card_id: str, screenshot_bytes: bytes, filename: str, result_msg: str,
+                            mimetype: str = "image/png"):
     """
     上傳截圖附件並留言驗證結果摘要到 Trello 卡片
     """
@@ -129,12 +163,10 @@ def upload_result_to_trello(card_id: str, screenshot_bytes: bytes, filename: str
         return
 
     # 1. 上傳附件
-    attachment_url = f"https://api.trello.com/1/cards/{card_id}/attachments"
-    files = {'file': (filename, screenshot_bytes, 'image/png')}
-    params = {"key": TRELLO_API_KEY, "token": TRELLO_TOKEN}
+    files = {'file': (filename, screenshot_bytes, mimetype)}
     
     try:
-        response = requests.post(attachment_url, params=params, files=files)
+        response = client.post(f"/cards/{card_id}/attachments", files=files)
         if response.status_code == 200:
             print(f"截圖上傳成功")
             # 2. 留言驗證結果摘要
@@ -167,4 +199,24 @@ def post_email_template_to_trello(card_id: str, email_info: dict, contact_email:
     if _post_trello_comment(card_id, comment_text):
         print(f"Email 範本留言成功")
     else:
-        print(f"Email 範本留言失敗")
\ No newline at end of file
+        print(f"Email 範本留言失敗")
+
+def post_result_and_email_template(card_id: str, screenshot, result_msg: str,
+                                   email_info: dict, contact_email: str = None) -> list:
+    """
+    在背景同時上傳截圖 (含結果摘要留言) 與發布 Email 範本留言，立即回傳兩者的 futures
+    (需要等送出完成的呼叫端自行等待；兩則留言彼此獨立，在卡片上的先後順序不固定)
+    screenshot 為查詢結果中的 PendingScreenshot，截圖在背景產生後才上傳
+    """
+    return [
+        _post_executor.submit(_upload_pending_screenshot, card_id, screenshot, result_msg),
+        _post_executor.submit(post_email_template_to_trello, card_id, email_info, contact_email),
+    ]
+
+def _upload_pending_screenshot(card_id: str, screenshot, result_msg: str):
+    try:
+        screenshot_bytes, mimetype, filename = screenshot.get()
+    except Exception as e:
+        print(f"產生截圖失敗，未上傳到 Trello: {e}")
+        return
+    upload_result_to_trello(card_id, screenshot_bytes, filename, result_msg, mimetype)
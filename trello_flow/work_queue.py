@@ -0,0 +1,287 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+import metrics
+
+# 佇列資料庫位置 (需放在重新部署後仍保留的磁碟上，重啟後才能接續未完成的工作)
+DB_PATH = os.environ.get("TRELLO_QUEUE_DB", "trello_queue.db")
+WORKERS = int(os.environ.get("TRELLO_QUEUE_WORKERS", "2"))
+# 等待中 + 處理中的卡片上限，超過時 Webhook 回傳 503 讓 Trello 稍後重送
+MAX_PENDING = int(os.environ.get("TRELLO_QUEUE_MAX_PENDING", "100"))
+# 每張卡片最多處理的次數 (含暫時性錯誤後的重試，以及處理中途程序結束後的重新處理)
+MAX_ATTEMPTS = int(os.environ.get("TRELLO_QUEUE_MAX_ATTEMPTS", "3"))
+# 暫時性錯誤後第一次重試前等待的秒數，之後每次加倍
+RETRY_BACKOFF_SECONDS = float(os.environ.get("TRELLO_QUEUE_RETRY_BACKOFF_SECONDS", "60"))
+# 已完成的卡片保留天數 (期間內重送的同一張卡片不會重複處理)
+RETENTION_DAYS = float(os.environ.get("TRELLO_QUEUE_RETENTION_DAYS", "30"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS card_jobs (
+    card_id    TEXT PRIMARY KEY,
+    card_url   TEXT NOT NULL,
+    state      TEXT NOT NULL,
+    attempts   INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    last_error TEXT,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    claimed_by TEXT
+);
+CREATE INDEX IF NOT EXISTS card_jobs_state ON card_jobs (state, created_at);
+"""
+
+
+# 舊版資料庫缺少的欄位 (啟動時補上)
+ADDED_COLUMNS = (
+    ("next_attempt_at", "REAL NOT NULL DEFAULT 0"),
+    ("claimed_by", "TEXT"),
+)
+
+
+def _process_start_time(pid: int) -> str:
+    """程序的啟動時間 (/proc/<pid>/stat 第 22 欄)，用來分辨重複使用的 pid；僅支援 Linux，其他平台回傳空字串"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # 程序名稱可能含空白，從最後一個 ")" 之後 (第 3 欄) 開始計算
+            return f.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        return ""
+
+
+def _owner_alive(owner: str) -> bool:
+    """claimed_by 記錄的程序 ("pid:啟動時間") 是否仍在執行；本程序剛啟動，不會持有任何卡片"""
+    if not owner:
+        return False
+    pid, _, started = owner.partition(":")
+    pid = int(pid)
+    if pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return not started or _process_start_time(pid) == started
+
+
+class RetryLater(Exception):
+    """handler 遇到暫時性錯誤 (上游暫時無法使用等)，卡片稍後重試"""
+
+
+class CardWorkQueue:
+    """
+    Trello 卡片處理佇列 (SQLite 持久化)
+
+    enqueue() 把卡片寫入資料庫後立即返回，固定數量的工作執行緒依建立順序
+    取出 pending 卡片交給 handler(card_id, card_url)。同一張卡片 (card_id)
+    只會處理一次；等待中的卡片達 max_pending 時拒絕新卡片。程序重啟後，
+    pending 與處理到一半 (running) 的卡片會繼續處理，running 超過
+    MAX_ATTEMPTS 次的卡片標記為 failed，避免反覆讓程序當掉。多個程序可以共用
+    同一個資料庫 (例如 Webhook 服務與補處理工具)：每張卡片記錄取得它的程序，
+    啟動時只恢復已結束程序留下的 running 卡片。
+
+    handler 拋出 RetryLater 時，卡片放回 pending，
+    等待 RETRY_BACKOFF_SECONDS (每次加倍) 後再處理；處理滿 MAX_ATTEMPTS 次
+    或拋出其他例外時標記為 failed，並呼叫 on_failure(card_id, card_url, error)。
+
+    工作執行緒延遲到第一次使用時才啟動 (gunicorn --preload fork 後需在
+    子程序重建)；佇列狀態只適用單一程序 (--workers 1)。
+    """
+
+    def __init__(self, handler, db_path: str = DB_PATH, workers: int = WORKERS, max_pending: int = MAX_PENDING,
+                 on_failure=None):
+        self.handler = handler
+        self.on_failure = on_failure
+        self.db_path = db_path
+        self.workers = workers
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._threads = []
+        self._pid = None
+        self._owner = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def start(self):
+        """
+        建立資料表、恢復中斷的卡片並啟動工作執行緒 (已啟動時不做任何事)
+        同一程序內個別工作執行緒意外結束時只補上該執行緒；running 的卡片可能仍由
+        其他執行緒處理中，只在新程序 (重啟或 fork 後) 才放回 pending
+        """
+        with self._lock:
+            if self._pid == os.getpid():
+                for i, thread in enumerate(self._threads):
+                    if not thread.is_alive():
+                        print(f"[Queue] 卡片處理執行緒 {thread.name} 已結束，重新啟動該執行緒")
+                        self._threads[i] = self._start_worker(i)
+                return
+            self._pid = os.getpid()
+            self._owner = f"{self._pid}:{_process_start_time(self._pid)}"
+            with closing(self._connect()) as conn:
+                conn.executescript(SCHEMA)
+                columns = [row["name"] for row in conn.execute("PRAGMA table_info(card_jobs)")]
+                for column, definition in ADDED_COLUMNS:
+                    if column not in columns:
+                        conn.execute(f"ALTER TABLE card_jobs ADD COLUMN {column} {definition}")
+                now = time.time()
+                conn.execute(
+                    "DELETE FROM card_jobs WHERE state IN ('done', 'failed') AND updated_at < ?",
+                    (now - RETENTION_DAYS * 86400,),
+                )
+                failed = resumed = 0
+                running = conn.execute(
+                    "SELECT card_id, attempts, claimed_by FROM card_jobs WHERE state = 'running'"
+                ).fetchall()
+                for row in running:
+                    if _owner_alive(row["claimed_by"]):
+                        continue  # 其他程序處理中
+                    if row["attempts"] >= MAX_ATTEMPTS:
+                        failed += conn.execute(
+                            "UPDATE card_jobs SET state = 'failed', updated_at = ?, last_error = '處理中斷次數過多' "
+                            "WHERE card_id = ? AND state = 'running'",
+                            (now, row["card_id"]),
+                        ).rowcount
+                    else:
+                        resumed += conn.execute(
+                            "UPDATE card_jobs SET state = 'pending', updated_at = ? WHERE card_id = ? AND state = 'running'",
+                            (now, row["card_id"]),
+                        ).rowcount
+                pending = conn.execute("SELECT COUNT(*) FROM card_jobs WHERE state = 'pending'").fetchone()[0]
+            if resumed or failed:
+                print(f"[Queue] 恢復 {resumed} 張處理中斷的卡片，{failed} 張中斷次數過多標記為失敗")
+            self._threads = [self._start_worker(i) for i in range(self.workers)]
+            print(f"[Queue] 啟動 {self.workers} 個卡片處理執行緒 (等待中 {pending} 張)")
+
+    def _start_worker(self, index: int) -> threading.Thread:
+        thread = threading.Thread(target=self._worker, name=f"trello-queue-{index}", daemon=True)
+        thread.start()
+        return thread
+
+    def enqueue(self, card_id: str, card_url: str) -> str:
+        """
+        加入一張卡片，回傳 "queued" / "duplicate" (已處理或已在佇列中) /
+        "full" (等待中的卡片已達上限)
+        """
+        self.start()
+        with self._lock, closing(self._connect()) as conn:
+            if conn.execute("SELECT 1 FROM card_jobs WHERE card_id = ?", (card_id,)).fetchone():
+                result = "duplicate"
+            elif conn.execute(
+                "SELECT COUNT(*) FROM card_jobs WHERE state IN ('pending', 'running')"
+            ).fetchone()[0] >= self.max_pending:
+                result = "full"
+            else:
+                now = time.time()
+                conn.execute(
+                    "INSERT INTO card_jobs (card_id, card_url, state, created_at, updated_at) VALUES (?, ?, 'pending', ?, ?)",
+                    (card_id, card_url, now, now),
+                )
+                self._wakeup.notify()
+                result = "queued"
+        metrics.TRELLO_QUEUE_EVENTS.inc(result=result)
+        return result
+
+    def stats(self) -> dict:
+        """各狀態的卡片數"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT state, COUNT(*) FROM card_jobs GROUP BY state").fetchall()
+        return {state: count for state, count in rows}
+
+    def wait_until_idle(self, poll_seconds: float = 1.0):
+        """等到沒有 pending / running 的卡片 (例如批次補處理的命令列工具結束前)"""
+        self.start()
+        while True:
+            stats = self.stats()
+            if not stats.get("pending") and not stats.get("running"):
+                return stats
+            time.sleep(poll_seconds)
+
+    def _claim(self):
+        """
+        (持有 _lock 時呼叫) 取出最早可處理的 pending 卡片並標記為 running，
+        回傳 (card_id, card_url, attempts)；沒有時回傳 None
+        """
+        with closing(self._connect()) as conn:
+            while True:
+                row = conn.execute(
+                    "SELECT card_id, card_url, attempts FROM card_jobs WHERE state = 'pending' AND next_attempt_at <= ? "
+                    "ORDER BY created_at LIMIT 1",
+                    (time.time(),),
+                ).fetchone()
+                if row is None:
+                    return None
+                # 條件式更新：其他程序共用同一個資料庫時，只有一方能取得這張卡片
+                claimed = conn.execute(
+                    "UPDATE card_jobs SET state = 'running', attempts = attempts + 1, updated_at = ?, claimed_by = ? "
+                    "WHERE card_id = ? AND state = 'pending'",
+                    (time.time(), self._owner, row["card_id"]),
+                ).rowcount
+                if claimed:
+                    return row["card_id"], row["card_url"], row["attempts"] + 1
+
+    def _next_retry_in(self):
+        """(持有 _lock 時呼叫) 最近一張等待重試的卡片還要等幾秒，沒有時回傳 None"""
+        with closing(self._connect()) as conn:
+            next_attempt_at = conn.execute(
+                "SELECT MIN(next_attempt_at) FROM card_jobs WHERE state = 'pending'"
+            ).fetchone()[0]
+        if next_attempt_at is None:
+            return None
+        return max(0.0, next_attempt_at - time.time())
+
+    def _finish(self, card_id: str, state: str, error: str = None):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE card_jobs SET state = ?, updated_at = ?, last_error = ? WHERE card_id = ?",
+                (state, time.time(), error, card_id),
+            )
+
+    def _retry_later(self, card_id: str, attempts: int, error: str):
+        """卡片放回 pending，RETRY_BACKOFF_SECONDS * 2^(attempts - 1) 秒後再處理"""
+        delay = RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1)
+        now = time.time()
+        with self._lock:
+            with closing(self._connect()) as conn:
+                conn.execute(
+                    "UPDATE card_jobs SET state = 'pending', updated_at = ?, next_attempt_at = ?, last_error = ? "
+                    "WHERE card_id = ?",
+                    (now, now + delay, error, card_id),
+                )
+            self._wakeup.notify()
+        return delay
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                job = self._claim()
+                while job is None:
+                    self._wakeup.wait(self._next_retry_in())
+                    job = self._claim()
+            card_id, card_url, attempts = job
+            try:
+                self.handler(card_id, card_url)
+            except Exception as e:
+                if isinstance(e, RetryLater) and attempts < MAX_ATTEMPTS:
+                    delay = self._retry_later(card_id, attempts, str(e))
+                    print(f"[Queue] 卡片 {card_id} 暫時無法處理 (第 {attempts} 次): {e}，{delay:g} 秒後重試")
+                    metrics.TRELLO_QUEUE_EVENTS.inc(result="retry")
+                    continue
+                print(f"[Queue] 卡片 {card_id} 處理失敗: {e}")
+                self._finish(card_id, "failed", str(e))
+                metrics.TRELLO_QUEUE_EVENTS.inc(result="failed")
+                if self.on_failure is not None:
+                    try:
+                        self.on_failure(card_id, card_url, e)
+                    except Exception as report_error:
+                        print(f"[Queue] 卡片 {card_id} 失敗通知發送失敗: {report_error}")
+            else:
+                self._finish(card_id, "done")
+                metrics.TRELLO_QUEUE_EVENTS.inc(result="done")
@@ -1,17 +1,29 @@
-from flask import Blueprint, request, send_file, jsonify
+from flask import Blueprint, request, send_file, jsonify, url_for
 import os
 import io
 import base64
-import ddddocr
-from playwright.sync_api import sync_playwright
+from urllib.parse import quote
 
-from lia_bot import LIAQueryBot
+import ocr_service
+from lia_bot import LIAQueryBot, get_browser_pool, query_license
+from screenshot_store import screenshots
 from trello_flow import trello_utils
 
 web_bp = Blueprint('web_flow', __name__)
 
-# 初始化 OCR (供 /ocr 路由測試用)
-ocr = ddddocr.DdddOcr()
+def run_on_scratch_page(fn):
+    """
+    在瀏覽器池的通道上以臨時 BrowserContext 執行 fn(page) 並回傳結果
+    (Playwright 只在通道執行緒上使用，請求執行緒不直接操作；臨時 context
+    用完即關閉，不影響查詢用的 page 與 cookie)
+    """
+    def job(lane_page):
+        context = lane_page.context.browser.new_context()
+        try:
+            return fn(context.new_page())
+        finally:
+            context.close()
+    return get_browser_pool().run(job)
 
 # 輔助函式：用於遮罩敏感資訊
 def mask_sensitive_data(data):
@@ -131,17 +143,18 @@ def home():
                 btn.disabled = false;
 
                 if (data.success) {{
-                    // 成功：顯示圖片和成功訊息
-                    const filename = data.filename;
-                    const imgUrl = data.image;
+                    // 成功：取得截圖 (第一次請求時才截圖)，檔名的副檔名依實際截圖格式
+                    const imgResponse = await fetch(data.image);
+                    const filename = decodeURIComponent(imgResponse.headers.get('X-Screenshot-Filename') || '');
+                    const imgUrl = imgResponse.ok ? URL.createObjectURL(await imgResponse.blob()) : '';
                     const email = data.email;
 
                     let statusClass = 'status-success';
                     let statusText = '查詢成功';
-                    if (filename.includes('資格不符')) {{ // 檔名已改為資格不符
+                    if (data.status === 'found_invalid') {{ // 資格不符
                         statusClass = 'status-error';
                         statusText = '審核失敗 (超過一年)';
-                    }} else if (filename.includes('無效證號')) {{ // 檔名已改為無效證號
+                    }} else if (!['found_valid', 'not_found', 'not_registered'].includes(data.status)) {{ // 無效證號
                         statusClass = 'status-error';
                         statusText = '無效的證號';
                     }}
@@ -235,79 +248,86 @@ def check_registration():
         if len(reg_no) < 10:
             reg_no = reg_no.zfill(10)
 
-        # 3. 執行機器人查詢
-        bot = None
-        try:
-            bot = LIAQueryBot(headless=True)
-            bot.start()
-
-            result = bot.perform_query(reg_no)
-
-            if result['success'] and result.get('screenshot_bytes'):
-                # 查詢成功
-                filename = result.get('suggested_filename', f'{reg_no}_result.png')
-
-                # 將 bytes 轉為 base64 字串回傳
-                img_base64 = base64.b64encode(result['screenshot_bytes']).decode('utf-8')
-                img_data_url = f"data:image/png;base64,{img_base64}"
-
-                # 4. 如果有 Trello 卡片 ID，回傳結果到 Trello
-                if trello_card_id:
-                    try:
-                        print(f"正在回傳結果到 Trello 卡片 {trello_card_id}...")
-                        trello_utils.upload_result_to_trello(
-                            trello_card_id,
-                            result['screenshot_bytes'],
-                            filename,
-                            result['msg'] # 將訊息傳入，作為截圖留言的一部分
-                        )
-                        trello_utils.post_email_template_to_trello(
-                            trello_card_id,
-                            result['email_info'],
-                            contact_email
-                        )
-                    except Exception as te:
-                        print(f"Trello 回傳失敗 (但不影響主流程): {te}")
-
-                # 回傳 JSON
-                return jsonify({
-                    "success": True,
-                    "image": img_data_url,
-                    "filename": filename,
-                    "email": result.get("email_info", {}),
-                    "trello_card_url": input_value if trello_card_id else None # 回傳 Trello 原始連結
-                })
-            else:
-                return jsonify({"success": False, "message": f"查詢失敗或查無資料: {result['msg']}"}), 404
-
-        finally:
-            if bot:
-                bot.close()
+        # 3. 執行機器人查詢 (解析出結果就返回，截圖等瀏覽器實際載入圖片時才產生)
+        result = query_license(reg_no, lazy_screenshot=True)
+
+        if result['success'] and result.get('screenshot'):
+            # 查詢成功：延後截圖存入暫存區，JSON 只回傳網址；截圖格式 (壓縮效果不佳時
+            # 改用 PNG) 在截圖時才決定，檔名由圖片回應的 X-Screenshot-Filename 提供
+            screenshot_id = screenshots.put_pending(result['screenshot'])
+            image_url = url_for('web_flow.get_screenshot', screenshot_id=screenshot_id)
+
+            # 4. 如果有 Trello 卡片 ID，在背景回傳結果到 Trello (不等待上傳完成)
+            if trello_card_id:
+                print(f"正在回傳結果到 Trello 卡片 {trello_card_id}...")
+                trello_utils.post_result_and_email_template(
+                    trello_card_id,
+                    result['screenshot'],
+                    result['msg'], # 將訊息傳入，作為截圖留言的一部分
+                    result['email_info'],
+                    contact_email,
+                )
+
+            # 回傳 JSON
+            return jsonify({
+                "success": True,
+                "image": image_url,
+                "status": result['status'],
+                "email": result.get("email_info", {}),
+                "trello_card_url": input_value if trello_card_id else None # 回傳 Trello 原始連結
+            })
+        else:
+            return jsonify({"success": False, "message": f"查詢失敗或查無資料: {result['msg']}"}), 404
 
     except Exception as e:
         return jsonify({"success": False, "message": f"系統發生錯誤: {e}"}), 500
 
+@web_bp.route('/screenshots/<screenshot_id>')
+def get_screenshot(screenshot_id):
+    """
+    提供 /check 查詢結果的截圖 (第一次請求時才在保留的結果頁面上截圖，之後內容不會變動)
+    支援 ETag 條件式請求：瀏覽器帶 If-None-Match 重新驗證時回傳 304
+    """
+    entry = screenshots.get(screenshot_id)
+    if entry is None:
+        return jsonify({"success": False, "message": "截圖不存在或已過期，請重新查詢"}), 404
+    data, mimetype, filename, etag = entry
+    response = send_file(
+        io.BytesIO(data),
+        mimetype=mimetype,
+        download_name=filename,
+        etag=etag,
+        max_age=3600,
+        conditional=True,
+    )
+    # 實際檔名 (副檔名依截圖格式)，供頁面顯示與下載
+    response.headers['X-Screenshot-Filename'] = quote(filename)
+    # 截圖含查詢對象資料，只允許瀏覽器快取，不讓共用快取 (proxy / CDN) 保存
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
 @web_bp.route('/ocr')
 def test_ocr_route():
     # (保留原有的 OCR 測試路由)
     target_url = LIAQueryBot.URL
+
+    def capture_captcha(page):
+        page.goto(target_url)
+        captcha_element = page.wait_for_selector('img#captcha', state='visible', timeout=10000)
+        return captcha_element.screenshot()
+
     try:
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            page = browser.new_page()
-            page.goto(target_url)
-            captcha_element = page.wait_for_selector('img#captcha', state='visible', timeout=10000)
-            captcha_bytes = captcha_element.screenshot()
-            browser.close()
-            result = ocr.classification(captcha_bytes)
-            captcha_base64 = base64.b64encode(captcha_bytes).decode('utf-8')
-            return f"""
-            <h1>OCR 識別測試 (目標網頁)</h1>
-            <p>目標網頁: <a href="{target_url}" target="_blank">{target_url}</a></p>
-            <p>識別結果: <strong>{result}</strong></p>
-            <p>截圖的驗證碼:</p>
-            <img src="data:image/png;base64,{captcha_base64}" alt="驗證碼圖片" />
-            """
+        captcha_bytes = run_on_scratch_page(capture_captcha)
+        result = ocr_service.classify(captcha_bytes)
+        captcha_base64 = base64.b64encode(captcha_bytes).decode('utf-8')
+        return f"""
+        <h1>OCR 識別測試 (目標網頁)</h1>
+        <p>目標網頁: <a href="{target_url}" target="_blank">{target_url}</a></p>
+        <p>識別結果: <strong>{result}</strong></p>
+        <p>截圖的驗證碼:</p>
+        <img src="data:image/png;base64,{captcha_base64}" alt="驗證碼圖片" />
+        """
     except Exception as e:
         return f"OCR 識別失敗: {e}", 500
 
@@ -317,13 +337,13 @@ def take_screenshot():
     target_url = request.args.get('url', 'https://example.com')
     if not target_url.startswith('http://') and not target_url.startswith('https://'):
         target_url = 'https://' + target_url
+
+    def capture_page(page):
+        page.goto(target_url)
+        return page.screenshot()
+
     try:
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            page = browser.new_page()
-            page.goto(target_url)
-            screenshot_bytes = page.screenshot()
-            browser.close()
-            return send_file(io.BytesIO(screenshot_bytes), mimetype='image/png')
+        screenshot_bytes = run_on_scratch_page(capture_page)
+        return send_file(io.BytesIO(screenshot_bytes), mimetype='image/png')
     except Exception as e:
         return f"截圖失敗: {e}", 500